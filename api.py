@@ -0,0 +1,237 @@
+"""
+Framework-independent request handlers for the key API
+
+Each handler takes the decoded JSON request body and returns a
+(payload, status_code) tuple. app.py (Flask, sync) and asgi.py (asyncio)
+both serve these, so the two serving modes always answer identically.
+The read-only lookups are also served through lookup(), which adds the
+response cache and ETags (see response_cache.py).
+"""
+
+import time
+from typing import Tuple, Dict, Any, Optional, List
+from totp_generator import redeem_key, redeem_keys, get_key_info
+from key_store import _parse_timestamp
+from metrics import REQUESTS
+from rate_limit import RateLimiter, retry_after_header
+from response_cache import CachedResponse, ResponseCache, etag_matches
+
+Response = Tuple[Dict[str, Any], int]
+
+# Redemption failure reason -> metrics outcome label
+OUTCOMES = {None: 'success', 'invalid_key': 'invalid_key', 'expired': 'expired', 'depleted': 'depleted',
+            'error': 'storage_error'}
+
+def _lookup_outcome(info: Dict[str, Any]) -> str:
+    if info.get('error'):
+        return 'storage_error'
+    if not info.get('exists', False):
+        return 'invalid_key'
+    if info.get('is_expired', False):
+        return 'expired'
+    return 'valid' if info.get('is_valid', False) else 'depleted'
+
+def _usage_info(info: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'max_uses': info.get('max_uses'),
+        'usage_count': info.get('usage_count'),
+        'remaining_uses': info.get('remaining_uses')
+    }
+
+def _invalid_body(data: Any) -> Optional[Response]:
+    """The 400 answer for a body that is valid JSON but not an object ([], "x", 1), else None"""
+    if data is None or isinstance(data, dict):
+        return None
+    return {'error': 'Request body must be a JSON object'}, 400
+
+def _named_keys(data: Any, max_batch_size: int) -> List[str]:
+    """The keys a request body names, for per-key rate limiting"""
+    if not isinstance(data, dict):
+        return []
+    keys = data.get('keys')
+    if isinstance(keys, list):
+        # Oversized batches are rejected with 413 anyway; charge only the IP
+        if len(keys) > max_batch_size:
+            return []
+        return [key for key in keys if isinstance(key, str) and key]
+    key = data.get('key')
+    return [key] if isinstance(key, str) and key else []
+
+def check_rate_limit(limiter: Optional[RateLimiter], endpoint: str, data: Optional[Dict[str, Any]],
+                     client_ip: Optional[str], max_batch_size: int) -> Optional[Tuple[Dict[str, Any], int, str]]:
+    """
+    Charge a request against the per-IP and per-key limits
+
+    Runs before any key store work. Returns None if the request may
+    proceed, otherwise (payload, 429, Retry-After value).
+    """
+    if limiter is None:
+        return None
+    wait = limiter.check(client_ip, _named_keys(data, max_batch_size))
+    if not wait:
+        return None
+    REQUESTS.inc(endpoint=endpoint, outcome='rate_limited')
+    retry_after = retry_after_header(wait)
+    return {'error': f'Too many requests, retry in {retry_after}s'}, 429, retry_after
+
+def get_code(data: Optional[Dict[str, Any]], cache: Optional[ResponseCache] = None) -> Response:
+    """Redeem one key and return its TOTP code"""
+    invalid = _invalid_body(data)
+    if invalid:
+        return invalid
+    user_key = (data or {}).get('key')
+
+    if not user_key:
+        return {'error': 'Key is required'}, 400
+
+    # Validate, increment and read back usage in one store round-trip
+    result = redeem_key(user_key)
+    if cache is not None and isinstance(user_key, str):
+        cache.invalidate([user_key])
+    REQUESTS.inc(endpoint='/get-code', outcome=OUTCOMES[result['reason']])
+
+    if result['reason'] in ('invalid_key', 'expired', 'depleted'):
+        return {'error': result['error']}, 403
+
+    if result['error']:
+        return {'error': result['error']}, 500
+
+    return {
+        'code': result['code'],
+        'success': True,
+        'usage_info': _usage_info(result)
+    }, 200
+
+def get_codes(data: Optional[Dict[str, Any]], max_batch_size: int,
+              cache: Optional[ResponseCache] = None) -> Response:
+    """Redeem a batch of keys in one store transaction"""
+    invalid = _invalid_body(data)
+    if invalid:
+        return invalid
+    user_keys = (data or {}).get('keys')
+
+    if not isinstance(user_keys, list) or not user_keys:
+        return {'error': 'A non-empty list of keys is required'}, 400
+
+    if len(user_keys) > max_batch_size:
+        return {'error': f'Too many keys in one request (maximum {max_batch_size})'}, 413
+
+    # Only well-formed keys reach the store; the rest are answered in place
+    valid_keys = [key for key in user_keys if isinstance(key, str) and key]
+    redeemed = iter(redeem_keys(valid_keys) if valid_keys else [])
+    if cache is not None:
+        cache.invalidate(valid_keys)
+
+    results = []
+    for user_key in user_keys:
+        if not (isinstance(user_key, str) and user_key):
+            results.append({'key': user_key, 'success': False, 'error': 'Key is required'})
+            continue
+        result = next(redeemed)
+        REQUESTS.inc(endpoint='/get-codes', outcome=OUTCOMES[result['reason']])
+        if result['error']:
+            results.append({'key': user_key, 'success': False, 'error': result['error']})
+            continue
+        results.append({
+            'key': user_key,
+            'code': result['code'],
+            'success': True,
+            'usage_info': _usage_info(result)
+        })
+
+    return {'results': results}, 200
+
+def _validation(key_info: Dict[str, Any]) -> Response:
+    """The /validate-key answer for a get_key_info() result"""
+    if not key_info.get('exists', False):
+        return {'valid': False, 'message': 'Invalid key provided'}, 200
+
+    is_valid = key_info.get('is_valid', False)
+    max_uses = key_info.get('max_uses', 1)
+    usage_count = key_info.get('usage_count', 0)
+    remaining = key_info.get('remaining_uses', 0)
+
+    if key_info.get('is_expired', False):
+        message = f"Key expired at {key_info.get('expires_at')}"
+    elif is_valid:
+        if max_uses == -1:
+            message = 'Key is valid and has unlimited uses'
+        else:
+            message = f'Key is valid ({remaining} uses remaining out of {max_uses})'
+    else:
+        if max_uses == -1:
+            message = 'Key validation failed'
+        else:
+            message = f'Key has reached its usage limit ({usage_count}/{max_uses} uses)'
+
+    return {
+        'valid': is_valid,
+        'message': message,
+        'expires_at': key_info.get('expires_at'),
+        'usage_info': _usage_info(key_info)
+    }, 200
+
+def _details(info: Dict[str, Any]) -> Response:
+    """The /key-info answer for a get_key_info() result"""
+    if not info.get('exists', False):
+        return {'error': 'Key not found'}, 404
+
+    return info, 200
+
+def _changes_in(info: Dict[str, Any]) -> Optional[float]:
+    """Seconds until a lookup answer goes stale without any write: the key expiring"""
+    if info.get('is_expired', False) or not info.get('expires_at'):
+        return None
+    return _parse_timestamp(info['expires_at']) - time.time()
+
+# Read-only lookups: endpoint -> (answer when no key is given, answer for a get_key_info() result)
+LOOKUPS = {
+    '/validate-key': (({'valid': False, 'message': 'Key is required'}, 200), _validation),
+    '/key-info': (({'error': 'Key is required'}, 400), _details),
+}
+
+def lookup(endpoint: str, data: Optional[Dict[str, Any]], cache: Optional[ResponseCache] = None,
+           if_none_match: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], int, Dict[str, str]]:
+    """
+    Answer /validate-key or /key-info, from the response cache when it can
+
+    Returns (payload, status, headers). Successful answers carry an ETag;
+    when If-None-Match names it, the payload is None and the status 304.
+    """
+    invalid = _invalid_body(data)
+    if invalid:
+        return (*invalid, {})
+    (missing, missing_status), answer = LOOKUPS[endpoint]
+    user_key = (data or {}).get('key')
+
+    if not user_key:
+        return dict(missing), missing_status, {}
+
+    def compute():
+        info = get_key_info(user_key)
+        payload, status = answer(info)
+        return payload, status, _lookup_outcome(info), _changes_in(info)
+
+    if cache is not None and isinstance(user_key, str):
+        response = cache.fetch(endpoint, user_key, compute)
+    else:
+        response = CachedResponse(*compute()[:3])
+    REQUESTS.inc(endpoint=endpoint, outcome=response.outcome)
+
+    # Conditional requests apply to successful answers only (RFC 7232)
+    if response.status != 200:
+        return response.payload, response.status, {}
+    headers = {'ETag': response.etag}
+    if etag_matches(if_none_match, response.etag):
+        return None, 304, headers
+    return response.payload, response.status, headers
+
+def validate_key(data: Optional[Dict[str, Any]]) -> Response:
+    """Check a key without consuming a use"""
+    payload, status, _ = lookup('/validate-key', data)
+    return payload, status
+
+def key_info(data: Optional[Dict[str, Any]]) -> Response:
+    """Get detailed information about a key"""
+    payload, status, _ = lookup('/key-info', data)
+    return payload, status
@@ -1,117 +1,118 @@
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, g
 import json
 import os
-from totp_generator import generate_totp_code, validate_key, get_key_info
+import time
+import api
+import metrics
+import static_assets
+from key_store import configure_key_store, get_key_store
+from key_sweeper import sweeper_from_env
+from rate_limit import create_rate_limiter, client_address
+from response_cache import response_cache_from_env
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 
+# Hashed, precompressed copies of static/ (python static_assets.py) at /assets, and asset_url() for templates
+static_assets.init_app(app)
+
+# Key storage backend: "json" (keys.json), "snapshot" (keys.snap), "sqlite" or "sqlalchemy" (e.g. PostgreSQL)
+app.config["KEY_STORE_BACKEND"] = os.environ.get("KEY_STORE_BACKEND", "json")
+app.config["KEY_STORE_URL"] = os.environ.get("KEY_STORE_URL")
+key_store = configure_key_store(app.config["KEY_STORE_BACKEND"], app.config["KEY_STORE_URL"])
+
+# Moves expired and depleted keys to the archive file every KEYS_SWEEP_INTERVAL seconds (see key_sweeper.py)
+key_sweeper = sweeper_from_env(key_store)
+
+# Largest number of keys accepted by /get-codes in one request
+app.config["MAX_BATCH_SIZE"] = int(os.environ.get("MAX_BATCH_SIZE", "100"))
+
+# Token buckets per client IP and per key, shared by workers (see rate_limit.py).
+# RATE_LIMIT_TRUST_PROXY is the number of reverse proxies in front of the app
+# (1 on Replit); without it every client shares the proxy's address.
+app.config["RATE_LIMIT_TRUST_PROXY"] = int(os.environ.get("RATE_LIMIT_TRUST_PROXY", "0"))
+rate_limiter = create_rate_limiter()
+API_ROUTES = ('/get-code', '/get-codes', '/validate-key', '/key-info')
+
+# Short-lived /validate-key and /key-info answers, dropped on redemption (see response_cache.py)
+response_cache = response_cache_from_env()
+
+# Sum metrics over all gunicorn workers rather than reporting whichever one answers the scrape
+metrics.share_between_workers()
+
+_key_count = {}
+
+def key_count():
+    """Keys in the store, counted again only once keys have been added or deleted"""
+    store = get_key_store()
+    version = store.membership_version()
+    cached = _key_count.get(store)
+    if cached is None or cached[0] != version:
+        cached = _key_count[store] = (version, store.count())
+    return cached[1]
+
+metrics.GaugeFunction("keyapi_keys", "Number of keys in the key store", key_count)
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def enforce_rate_limit():
+    """Reject over-limit clients before any key store work"""
+    if rate_limiter is None or request.method != 'POST' or request.path not in API_ROUTES:
+        return None
+    client_ip = client_address(request.remote_addr, request.headers.get("X-Forwarded-For"),
+                               app.config["RATE_LIMIT_TRUST_PROXY"])
+    rejected = api.check_rate_limit(rate_limiter, request.path, request.get_json(silent=True),
+                                    client_ip, app.config["MAX_BATCH_SIZE"])
+    if rejected is None:
+        return None
+    payload, status, retry_after = rejected
+    return jsonify(payload), status, {"Retry-After": retry_after}
+
+@app.after_request
+def record_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # Label by route rule, not raw path, so unknown URLs share one series
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/get-code', methods=['POST'])
 def get_code():
-    data = request.json
-    user_key = data.get('key')
-
-    if not user_key:
-        return jsonify({'error': 'Key is required'}), 400
-
-    # Get key info for better error messages
-    key_info = get_key_info(user_key)
-    
-    if not key_info.get('exists', False):
-        return jsonify({'error': 'Invalid key provided'}), 403
-    
-    if not key_info.get('is_valid', False):
-        max_uses = key_info.get('max_uses', 1)
-        usage_count = key_info.get('usage_count', 0)
-        if max_uses == -1:
-            return jsonify({'error': 'Key validation failed'}), 403
-        else:
-            return jsonify({'error': f'Key has reached its usage limit ({usage_count}/{max_uses} uses)'}), 403
-
-    code, error = generate_totp_code(user_key)
-    if error:
-        return jsonify({'error': error}), 500
-    
-    # Get updated key info after usage
-    updated_key_info = get_key_info(user_key)
-    remaining = updated_key_info.get('remaining_uses', 0)
-    
-    response_data = {
-        'code': code, 
-        'success': True,
-        'usage_info': {
-            'max_uses': updated_key_info.get('max_uses'),
-            'usage_count': updated_key_info.get('usage_count'),
-            'remaining_uses': remaining
-        }
-    }
-    
-    return jsonify(response_data)
+    payload, status = api.get_code(request.json, response_cache)
+    return jsonify(payload), status
+
+@app.route('/get-codes', methods=['POST'])
+def get_codes():
+    """Redeem a batch of keys in one store transaction"""
+    payload, status = api.get_codes(request.json, app.config["MAX_BATCH_SIZE"], response_cache)
+    return jsonify(payload), status
+
+def _lookup(endpoint):
+    payload, status, headers = api.lookup(endpoint, request.json, response_cache,
+                                          request.headers.get("If-None-Match"))
+    if payload is None:
+        return "", status, headers
+    return jsonify(payload), status, headers
 
 @app.route('/validate-key', methods=['POST'])
 def validate_key_endpoint():
-    data = request.json
-    user_key = data.get("key")
-    
-    if not user_key:
-        return jsonify({'valid': False, 'message': 'Key is required'})
-    
-    key_info = get_key_info(user_key)
-    
-    if not key_info.get('exists', False):
-        return jsonify({'valid': False, 'message': 'Invalid key provided'})
-    
-    is_valid = key_info.get('is_valid', False)
-    max_uses = key_info.get('max_uses', 1)
-    usage_count = key_info.get('usage_count', 0)
-    remaining = key_info.get('remaining_uses', 0)
-    
-    if is_valid:
-        if max_uses == -1:
-            message = 'Key is valid and has unlimited uses'
-        else:
-            message = f'Key is valid ({remaining} uses remaining out of {max_uses})'
-        return jsonify({
-            'valid': True, 
-            'message': message,
-            'usage_info': {
-                'max_uses': max_uses,
-                'usage_count': usage_count,
-                'remaining_uses': remaining
-            }
-        })
-    else:
-        if max_uses == -1:
-            message = 'Key validation failed'
-        else:
-            message = f'Key has reached its usage limit ({usage_count}/{max_uses} uses)'
-        return jsonify({
-            'valid': False, 
-            'message': message,
-            'usage_info': {
-                'max_uses': max_uses,
-                'usage_count': usage_count,
-                'remaining_uses': remaining
-            }
-        })
+    return _lookup('/validate-key')
 
 @app.route('/key-info', methods=['POST'])
 def key_info_endpoint():
     """Get detailed information about a key"""
-    data = request.json
-    user_key = data.get("key")
-    
-    if not user_key:
-        return jsonify({'error': 'Key is required'}), 400
-    
-    key_info = get_key_info(user_key)
-    
-    if not key_info.get('exists', False):
-        return jsonify({'error': 'Key not found'}), 404
-    
-    return jsonify(key_info)
+    return _lookup('/key-info')
@@ -0,0 +1,182 @@
+"""
+Asynchronous serving mode
+
+Serves /get-code, /get-codes, /validate-key, /key-info and /metrics as a plain ASGI
+application. Requests are parsed on the event loop and key store calls run
+on a bounded thread pool, so a single process can hold thousands of open
+connections while at most STORE_IO_THREADS store operations run at once.
+Handlers are shared with app.py (see api.py), so both modes answer
+identically.
+
+Run with any ASGI server, e.g.:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+    gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:5000 asgi:app
+
+Other paths (the page and static files) are passed to the Flask app.
+Needs the "asgi" extra (uvicorn and asgiref):
+    pip install -e ".[asgi]"
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import api
+import metrics
+from app import app as flask_app, rate_limiter, response_cache
+from rate_limit import client_address
+
+# Upper bound on concurrent key store operations per process
+STORE_IO_THREADS = int(os.environ.get("STORE_IO_THREADS", "32"))
+# Request bodies larger than this are rejected before parsing
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", str(64 * 1024)))
+
+executor = ThreadPoolExecutor(max_workers=STORE_IO_THREADS, thread_name_prefix="store-io")
+
+ROUTES = {
+    "/get-code": lambda data: api.get_code(data, response_cache),
+    "/get-codes": lambda data: api.get_codes(data, flask_app.config["MAX_BATCH_SIZE"], response_cache),
+    # Read-only lookups go through api.lookup() for the response cache and ETags
+    "/validate-key": None,
+    "/key-info": None,
+}
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError as e:
+    raise ImportError('asgi.py needs asgiref to serve the page and static files: pip install -e ".[asgi]"') from e
+
+# The page, static files and anything else not handled here
+fallback = WsgiToAsgi(flask_app)
+
+async def _send_json(send, payload, status, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _send_not_modified(send, headers=()):
+    await send({"type": "http.response.start", "status": 304, "headers": list(headers)})
+    await send({"type": "http.response.body", "body": b""})
+
+# _read_body() result for a body over MAX_BODY_BYTES
+BODY_TOO_LARGE = object()
+
+async def _read_body(receive):
+    """Read the request body; None if the client disconnected, BODY_TOO_LARGE past MAX_BODY_BYTES"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return BODY_TOO_LARGE
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+def _header(scope, name):
+    """The last value of a request header, or None"""
+    found = None
+    for header, value in scope.get("headers", ()):
+        if header == name:
+            found = value.decode("latin-1")
+    return found
+
+def _client_ip(scope):
+    client = scope.get("client")
+    return client_address(client[0] if client else None, _header(scope, b"x-forwarded-for"),
+                          flask_app.config["RATE_LIMIT_TRUST_PROXY"])
+
+def _handle(handler, path, data, client_ip, if_none_match):
+    """Rate limit, then run the handler; returns (payload, status, headers), payload None for 304"""
+    rejected = api.check_rate_limit(rate_limiter, path, data, client_ip, flask_app.config["MAX_BATCH_SIZE"])
+    if rejected is not None:
+        payload, status, retry_after = rejected
+        return payload, status, [(b"retry-after", retry_after.encode())]
+    if handler is None:
+        payload, status, headers = api.lookup(path, data, response_cache, if_none_match)
+        return payload, status, [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    payload, status = handler(data)
+    return payload, status, ()
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/metrics":
+        body = metrics.render().encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", metrics.CONTENT_TYPE.encode()),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    if scope["path"] not in ROUTES:
+        await fallback(scope, receive, send)
+        return
+
+    handler = ROUTES[scope["path"]]
+    if scope["method"] != "POST":
+        await _send_json(send, {"error": "Method not allowed"}, 405, [(b"allow", b"POST")])
+        return
+
+    started = time.perf_counter()
+    body = await _read_body(receive)
+    if body is None:
+        # Nobody is left to answer
+        return
+    if body is BODY_TOO_LARGE:
+        await _send_json(send, {"error": "Request body too large"}, 413)
+        return
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        await _send_json(send, {"error": "Invalid JSON body"}, 400)
+        return
+
+    # Rate limiting and key store I/O run off the event loop on the bounded pool
+    loop = asyncio.get_running_loop()
+    payload, status, headers = await loop.run_in_executor(
+        executor, _handle, handler, scope["path"], data, _client_ip(scope), _header(scope, b"if-none-match"))
+    if payload is None:
+        await _send_not_modified(send, headers)
+    else:
+        await _send_json(send, payload, status, headers)
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=scope["path"])
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("asgi:app", host="0.0.0.0", port=int(os.environ.get("PORT", "5000")))
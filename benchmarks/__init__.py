@@ -0,0 +1 @@
+"""Load, stress and benchmark scripts for the key redemption path."""
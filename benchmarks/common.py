@@ -0,0 +1,100 @@
+"""
+Shared helpers for the benchmark scripts: throwaway key stores, latency
+statistics and machine-readable result files.
+"""
+
+import json
+import os
+import platform
+import socket
+import tempfile
+import time
+from typing import Dict, Any, List, Callable, Optional
+
+SHARED_SECRET = "3YWFIRISX3ZADDKPK2WZXQAVTOGWXT4Y"
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(latencies: List[float], errors: int = 0, elapsed: Optional[float] = None) -> Dict[str, Any]:
+    """Throughput and latency percentiles (milliseconds) for a run"""
+    latencies = sorted(latencies)
+    if elapsed is None:
+        elapsed = sum(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "req_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+    }
+
+def time_calls(func: Callable, args_list: List[tuple]) -> Dict[str, Any]:
+    """Call func once per argument tuple and summarize the latencies"""
+    latencies = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+def key_name(index: int) -> str:
+    return f"bench{index:08d}"
+
+def write_keys_file(path: str, count: int, max_uses: int = -1):
+    """Write a keys.json with `count` keys sharing one secret, streamed to disk"""
+    with open(path, "w") as f:
+        f.write("{\n")
+        for i in range(count):
+            record = {
+                "secret": SHARED_SECRET,
+                "max_uses": max_uses,
+                "usage_count": 0,
+                "created_at": "2025-01-01T00:00:00Z"
+            }
+            separator = ",\n" if i < count - 1 else "\n"
+            f.write(f"  {json.dumps(key_name(i))}: {json.dumps(record)}{separator}")
+        f.write("}\n")
+
+def make_workdir(prefix: str = "bench_") -> str:
+    return tempfile.mkdtemp(prefix=prefix)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"server on port {port} did not start within {timeout}s")
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+def write_results(path: str, suite: str, results: Any):
+    """Merge one suite's results into a JSON results file"""
+    data = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+    data["environment"] = environment()
+    data[suite] = results
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"📝 Wrote {suite} results to {path}")
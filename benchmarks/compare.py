@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files and flag regressions
+
+Walks both files, pairs up every measurement with the same path, and
+reports latency figures (*_ms, *_s) that grew or throughput (req_per_s)
+that dropped by more than --threshold. Exits non-zero on regressions so it
+can gate CI.
+
+Usage:
+    python -m benchmarks.compare baseline.json bench_results.json --threshold 0.25
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, Any, Iterator, Tuple
+
+def _metrics(node: Any, path: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(node, dict):
+        for name, value in node.items():
+            if name == "environment":
+                continue
+            yield from _metrics(value, f"{path}.{name}" if path else name)
+    elif isinstance(node, list):
+        for index, item in enumerate(node):
+            # Identify list entries by their parameters rather than position
+            label = index
+            if isinstance(item, dict):
+                params = [f"{k}={item[k]}" for k in ("keys", "mode", "endpoint", "concurrency") if k in item]
+                label = ",".join(params) or index
+            yield from _metrics(item, f"{path}[{label}]")
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        if path.endswith(("_ms", "_s", "req_per_s")) and not path.endswith(("elapsed_s", "duration_s", "build_s")):
+            yield path, float(node)
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float):
+    """Return (regressions, improvements) as lists of (path, before, after, change)"""
+    before = dict(_metrics(baseline))
+    regressions, improvements = [], []
+    for path, after in _metrics(current):
+        if path not in before or before[path] == 0:
+            continue
+        change = (after - before[path]) / before[path]
+        worse = -change if path.endswith("req_per_s") else change
+        entry = (path, before[path], after, change)
+        if worse > threshold:
+            regressions.append(entry)
+        elif worse < -threshold:
+            improvements.append(entry)
+    return regressions, improvements
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative change that counts (default 0.25)")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions, improvements = compare(baseline, current, args.threshold)
+
+    for title, entries in (("🔴 Regressions", regressions), ("🟢 Improvements", improvements)):
+        if entries:
+            print(f"{title}:")
+            for path, before, after, change in entries:
+                print(f"   {path}: {before:g} -> {after:g} ({change:+.0%})")
+    if not regressions:
+        print(f"✅ No regressions beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Latency of an email code lookup: one folder after another vs pooled, parallel
+
+Runs a stand-in IMAP server (benchmarks/imap_server.py) with injected login
+and per-folder search latency, a few accounts pointing at it, and the
+verification email in a folder only the last account has. Modes:
+- sequential:  the old lookup, a fresh connection and login per account and
+               its folders searched in turn
+- parallel_cold: get_latest_chatgpt_code() with empty pools (logins in parallel)
+- parallel_pooled: get_latest_chatgpt_code() over warm pooled connections
+
+The email is marked unread again before every lookup, so each one has to
+find it.
+
+Usage:
+    python -m benchmarks.email_fetch --accounts 2 --login-delay-ms 150 --folder-delay-ms 50
+"""
+
+import argparse
+import contextlib
+import io
+import sys
+import time
+from typing import Any, Dict
+
+from benchmarks.common import free_port, summarize, write_results
+from benchmarks.imap_server import Mailbox, StandInIMAPServer, verification_email
+
+FOLDERS = ["inbox", "Spam", "Junk"]
+# Where the verification email is: the last account searches it instead of Junk
+HIT_FOLDER = "Archive"
+
+def sequential_lookup(accounts):
+    """A new connection per account and one folder at a time, as email_reader used to"""
+    from email_reader import IMAPPool, account_folders, check_folder
+
+    for account in accounts:
+        pool = IMAPPool(account, size=1)
+        try:
+            for folder in account_folders(account):
+                code = check_folder(pool, folder)
+                if code:
+                    return code
+        finally:
+            pool.close()
+    return None
+
+def main(argv=None):
+    import email_reader
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=2)
+    parser.add_argument("--login-delay-ms", type=float, default=150.0)
+    parser.add_argument("--folder-delay-ms", type=float, default=50.0)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    folder_delay = args.folder_delay_ms / 1000
+    boxes = {folder: Mailbox(delay=folder_delay) for folder in FOLDERS + [HIT_FOLDER]}
+    boxes[HIT_FOLDER].append(verification_email("424242"))
+    port = free_port()
+    server = StandInIMAPServer(("127.0.0.1", port), boxes, login_delay=args.login_delay_ms / 1000)
+    server.start()
+    accounts = [{"label": f"Account{i}", "IMAP_SERVER": "127.0.0.1", "IMAP_PORT": port, "IMAP_SSL": False,
+                 "EMAIL_ACCOUNT": f"user{i}", "EMAIL_PASSWORD": "secret", "FOLDERS": list(FOLDERS)}
+                for i in range(args.accounts)]
+    accounts[-1]["FOLDERS"][-1] = HIT_FOLDER
+
+    modes = {
+        "sequential": lambda: sequential_lookup(accounts),
+        "parallel_cold": lambda: (email_reader.close_pools(), email_reader.get_latest_chatgpt_code(accounts))[1],
+        "parallel_pooled": lambda: email_reader.get_latest_chatgpt_code(accounts),
+    }
+    results: Dict[str, Any] = {"accounts": args.accounts, "folders_per_account": len(FOLDERS),
+                               "login_delay_ms": args.login_delay_ms, "folder_delay_ms": args.folder_delay_ms,
+                               "modes": {}}
+    email_reader.get_latest_chatgpt_code(accounts)  # warm the pools for parallel_pooled
+    for mode, lookup in modes.items():
+        latencies, errors = [], 0
+        logins_before = server.logins
+        for _ in range(args.iterations):
+            boxes[HIT_FOLDER].flags[0].clear()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                code = lookup()
+            latencies.append(time.perf_counter() - started)
+            errors += code != "424242"
+        result = summarize(latencies, errors, sum(latencies))
+        result["logins_per_lookup"] = round((server.logins - logins_before) / args.iterations, 1)
+        results["modes"][mode] = result
+        print(f"⏱️  {mode}: p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms, "
+              f"{result['logins_per_lookup']} logins per lookup", file=sys.stderr)
+    email_reader.close_pools()
+    server.shutdown()
+    write_results(args.output, "email_fetch", results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
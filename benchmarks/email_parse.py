@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Bytes and CPU per email: whole-message fetch vs BODYSTRUCTURE + partial fetch
+
+Builds a corpus of verification emails shaped like real ones: plain text
+and a styled HTML alternative, an inline logo (multipart/related), and for
+some of them an attachment or no plain text at all. It serves them from the
+stand-in IMAP server (benchmarks/imap_server.py) and reads every message's
+code two ways:
+- full:    FETCH BODY.PEEK[], parse the whole MIME tree, walk it for text
+- partial: email_reader.fetch_message(), i.e. BODYSTRUCTURE + headers, then
+           only the text part, capped at EMAIL_BODY_LIMIT
+
+Reported per mode: bytes received per message, client CPU per message (the
+reading thread only; the server runs in another thread) and wall-clock
+latency. A second table times code extraction on the plain-text bodies,
+the HTML bodies with tags stripped, and on the worst case, text without a
+phrase as long as EMAIL_BODY_LIMIT: the substring test +
+precompiled pattern email_reader uses, against a single alternation regex
+over phrases and code.
+
+Usage:
+    python -m benchmarks.email_parse --messages 200
+"""
+
+import argparse
+import email
+import email.policy
+import imaplib
+import os
+import random
+import re
+import sys
+import time
+from email.message import EmailMessage
+from typing import Any, Dict, List
+
+from benchmarks.common import free_port, summarize, write_results
+from benchmarks.imap_server import Mailbox, StandInIMAPServer
+
+HTML_TEMPLATE = """<!DOCTYPE html><html><head><style>{style}</style></head><body>
+<table class="wrapper"><tr><td><img src="cid:logo" alt="OpenAI" width="120">
+<h1>Verify your identity</h1><p>{text}</p><p class="code">{code}</p>
+<p>If you did not request this code, you can ignore this email.</p>{footer}</td></tr></table></body></html>"""
+
+class CountingIMAP4(imaplib.IMAP4):
+    """Plain IMAP4 that counts the bytes it receives"""
+
+    received = 0
+
+    def read(self, size):
+        data = super().read(size)
+        self.received += len(data)
+        return data
+
+    def readline(self):
+        line = super().readline()
+        self.received += len(line)
+        return line
+
+def build_email(rng: random.Random, code: str) -> bytes:
+    from email_reader import VERIFICATION_PHRASES
+
+    text = f"{VERIFICATION_PHRASES[rng.randrange(len(VERIFICATION_PHRASES))].capitalize()}: {code}"
+    style = "".join(f".c{i} {{ font-family: Helvetica, Arial, sans-serif; color: #{rng.randrange(16 ** 6):06x};"
+                    f" padding: {rng.randrange(20)}px; }}\n" for i in range(rng.randint(80, 200)))
+    footer = "".join(f"<p class='c{i}'>OpenAI, 548 Market Street, PMB 97273, San Francisco</p>"
+                     for i in range(rng.randint(5, 20)))
+    msg = EmailMessage()
+    msg["From"] = "OpenAI <noreply@tm.openai.com>"
+    msg["To"] = "me@example.com"
+    msg["Subject"] = "Your ChatGPT code is " + code
+    msg["Date"] = email.utils.formatdate()
+    html = HTML_TEMPLATE.format(style=style, text=text, code=code, footer=footer)
+    if rng.random() < 0.1:
+        msg.set_content(html, subtype="html")
+    else:
+        msg.set_content(f"{text}\n\nIf you did not request this code, you can ignore this email.\n")
+        msg.add_alternative(html, subtype="html")
+        html_part = msg.get_payload()[1]
+        html_part.add_related(rng.randbytes(rng.randint(5_000, 40_000)), maintype="image", subtype="png",
+                              cid="<logo>")
+    if rng.random() < 0.2:
+        msg.add_attachment(rng.randbytes(rng.randint(100_000, 500_000)), maintype="application",
+                           subtype="pdf", filename="receipt.pdf")
+    return msg.as_bytes(policy=email.policy.SMTP)
+
+def read_full(mail: imaplib.IMAP4, number: bytes) -> str:
+    """The code the way email_reader used to read it: the whole message"""
+    from email_reader import extract_code_from_text, message_text
+
+    status, data = mail.fetch(number, "(BODY.PEEK[])")
+    raw = next(part[1] for part in data if isinstance(part, tuple))
+    return extract_code_from_text(message_text(email.message_from_bytes(raw)))
+
+def read_partial(mail: imaplib.IMAP4, number: bytes) -> str:
+    from email_reader import extract_code_from_text, fetch_message
+
+    headers, body = fetch_message(mail, number)
+    return extract_code_from_text(body)
+
+def combined_matcher():
+    """One alternation regex over every phrase and the code, the alternative to email_reader's"""
+    from email_reader import VERIFICATION_PHRASES
+
+    pattern = re.compile("(?P<phrase>" + "|".join(map(re.escape, VERIFICATION_PHRASES)) + r")|(?P<code>\b\d{6}\b)",
+                         re.IGNORECASE)
+
+    def extract(text):
+        code = phrase = None
+        for match in pattern.finditer(text):
+            if match.lastgroup == "phrase":
+                phrase = True
+            elif code is None:
+                code = match.group()
+            if phrase and code:
+                return code
+        return None
+    return extract
+
+def time_extraction(bodies: Dict[str, List[str]], repeat: int) -> Dict[str, Any]:
+    """Microseconds per body for each matcher and kind of body"""
+    from email_reader import extract_code_from_text
+
+    results: Dict[str, Any] = {}
+    for name, extract in (("substring_and_pattern", extract_code_from_text), ("combined_regex", combined_matcher())):
+        results[name] = {}
+        for kind, texts in bodies.items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                for text in texts:
+                    extract(text)
+            results[name][f"{kind}_us_per_body"] = round((time.perf_counter() - started) / (repeat * len(texts)) * 1e6, 2)
+    return results
+
+def main(argv=None):
+    from email_reader import html_to_text
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    codes = [f"{rng.randrange(10 ** 6):06d}" for _ in range(args.messages)]
+    box = Mailbox([build_email(rng, code) for code in codes])
+    sizes = sorted(len(raw) for raw in box.messages)
+    port = free_port()
+    server = StandInIMAPServer(("127.0.0.1", port), {"inbox": box})
+    server.start()
+
+    results: Dict[str, Any] = {"messages": args.messages, "body_limit": int(os.environ.get("EMAIL_BODY_LIMIT", "65536")),
+                               "message_bytes_p50": sizes[len(sizes) // 2], "message_bytes_max": sizes[-1],
+                               "modes": {}}
+    for mode, read in (("full", read_full), ("partial", read_partial)):
+        mail = CountingIMAP4("127.0.0.1", port)
+        mail.login("bench", "bench")
+        mail.select("inbox", readonly=True)
+        received_before, latencies, cpu, errors = mail.received, [], 0.0, 0
+        for number, code in enumerate(codes, 1):
+            started, cpu_started = time.perf_counter(), time.thread_time()
+            found = read(mail, str(number).encode())
+            cpu += time.thread_time() - cpu_started
+            latencies.append(time.perf_counter() - started)
+            errors += found != code
+        result = summarize(latencies, errors, sum(latencies))
+        result["bytes_per_message"] = round((mail.received - received_before) / args.messages)
+        result["cpu_us_per_message"] = round(cpu / args.messages * 1e6, 1)
+        results["modes"][mode] = result
+        mail.logout()
+        print(f"⏱️  {mode}: {result['bytes_per_message']} bytes, {result['cpu_us_per_message']}µs CPU, "
+              f"p50 {result['p50_ms']}ms per message, {errors} wrong", file=sys.stderr)
+    server.shutdown()
+
+    bodies: Dict[str, List[str]] = {"plain": [], "html": []}
+    for msg in box.parsed:
+        for part in msg.walk():
+            if part.get_content_type() in ("text/plain", "text/html"):
+                text = part.get_payload(decode=True).decode(errors="ignore")
+                bodies[part.get_content_subtype()].append(html_to_text(text) if part.get_content_subtype() == "html"
+                                                           else text)
+    filler = " ".join(text for text in bodies["html"] if "verify" not in text.lower()) or "lorem ipsum " * 100
+    filler = re.sub(r"\d", "x", filler)
+    bodies["limit"] = [(filler * (results["body_limit"] // len(filler) + 1))[:results["body_limit"]]]
+    results["extraction"] = time_extraction(bodies, repeat=20)
+    for name, timing in results["extraction"].items():
+        print(f"⏱️  extract with {name}: {timing['plain_us_per_body']}µs per plain body, "
+              f"{timing['html_us_per_body']}µs per HTML body, {timing['limit_us_per_body']}µs at the size limit",
+              file=sys.stderr)
+    write_results(args.output, "email_parse", results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
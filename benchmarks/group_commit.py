@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Throughput of redemptions with and without group commit
+
+Concurrent threads redeem unlimited keys against one store with durable
+writes (KEYS_SYNC_WRITES=1), first calling the store directly (one fsync
+per redemption), then through GroupCommit (one fsync per batch). Reported
+per concurrency level and mode: requests/s, latency percentiles and the
+mean batch size.
+
+Usage:
+    python -m benchmarks.group_commit --concurrency 1,16,64 --duration 3
+    python -m benchmarks.group_commit --backend sqlite --window-ms 1 --max-batch 32
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+# Read by key_store at import
+os.environ.setdefault("KEYS_SYNC_WRITES", "1")
+os.environ.setdefault("KEY_FILTER", "off")
+# Keep compaction out of the measurement
+os.environ.setdefault("KEYS_JOURNAL_COMPACT_THRESHOLD", "100000000")
+
+from benchmarks.common import key_name, make_workdir, summarize, write_keys_file, write_results
+
+def build_store(backend: str, workdir: str, keys: int):
+    import json
+    from key_store import create_key_store
+
+    keys_file = os.path.join(workdir, "keys.json")
+    write_keys_file(keys_file, keys)
+    if backend == "json":
+        return create_key_store("json", keys_file)
+    store = create_key_store(backend, os.path.join(workdir, "keys.snap" if backend == "snapshot" else "keys.db"))
+    with open(keys_file) as f:
+        records = json.load(f)
+    if backend == "snapshot":
+        store.save(records)
+    else:
+        store.bulk_add(records)
+    return store
+
+def run(redeem, threads: int, duration: float, keys: int) -> Dict[str, Any]:
+    latencies: List[List[float]] = [[] for _ in range(threads)]
+    errors = [0] * threads
+    deadline = time.perf_counter() + duration
+
+    def worker(index: int):
+        own, perf_counter = latencies[index], time.perf_counter
+        i = index
+        while perf_counter() < deadline:
+            started = perf_counter()
+            _, error = redeem(key_name(i % keys))
+            own.append(perf_counter() - started)
+            if error:
+                errors[index] += 1
+            i += threads
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return summarize([value for own in latencies for value in own], sum(errors), time.perf_counter() - started)
+
+def main(argv=None):
+    from group_commit import GROUP_COMMIT_BATCH, GroupCommit
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["json", "snapshot", "sqlite"], default="json")
+    parser.add_argument("--concurrency", default="1,16,64", help="comma-separated thread counts")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per run")
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    store = build_store(args.backend, make_workdir(), args.keys)
+    group = GroupCommit(store, window_ms=args.window_ms, max_batch=args.max_batch)
+    batches = GROUP_COMMIT_BATCH.labels()
+    results = {"backend": args.backend, "window_ms": args.window_ms, "max_batch": args.max_batch, "runs": []}
+    for threads in [int(value) for value in args.concurrency.split(",")]:
+        for mode, redeem in (("direct", store.redeem), ("group", group.redeem)):
+            print(f"⏱️  {mode}, {threads} threads...", file=sys.stderr, flush=True)
+            count_before, sum_before = sum(batches.counts), batches.sum
+            result = run(redeem, threads, args.duration, args.keys)
+            if mode == "group":
+                committed = sum(batches.counts) - count_before
+                result["mean_batch"] = round((batches.sum - sum_before) / committed, 1) if committed else 0.0
+            result.update(mode=mode, concurrency=threads)
+            results["runs"].append(result)
+            print(f"   {result['req_per_s']} req/s, p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms",
+                  file=sys.stderr, flush=True)
+    write_results(args.output, f"group_commit_{args.backend}", results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+HTTP benchmarks for the redemption API
+
+Drives /validate-key and /get-code at configurable concurrency through:
+- the Flask test client (in-process, one thread per concurrent client)
+- a real local gunicorn with sync workers, via benchmarks.load_test
+
+Each run reports req/s and p50/p95/p99 latency.
+
+Usage:
+    python -m benchmarks.http_bench --keys 10000 --concurrency 1,16,64 --duration 5
+    python -m benchmarks.http_bench --mode gunicorn --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Any, List
+
+from benchmarks.common import (
+    make_workdir, write_keys_file, key_name, summarize, write_results, free_port, wait_for_port,
+)
+from benchmarks.load_test import run_load
+
+ENDPOINTS = ("/validate-key", "/get-code")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Every benchmark request comes from one IP; measure the API, not the limiter.
+# Inherited by the gunicorn server's environment too.
+os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+
+def bench_test_client(keys_file: str, endpoint: str, key_count: int,
+                      concurrency: int, duration: float) -> Dict[str, Any]:
+    """Run `concurrency` threads, each with its own Flask test client"""
+    from key_store import configure_key_store
+    from app import app
+
+    configure_key_store("json", keys_file)
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client_loop(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        local, local_errors = [], 0
+        while time.perf_counter() < deadline:
+            payload = {"key": key_name(rng.randrange(key_count))}
+            started = time.perf_counter()
+            response = client.post(endpoint, json=payload)
+            local.append(time.perf_counter() - started)
+            if response.status_code >= 500:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_loop, args=(seed,)) for seed in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+def bench_gunicorn(keys_file: str, endpoint: str, concurrency: int, duration: float,
+                   workers: int, worker_class: str) -> Dict[str, Any]:
+    """Start gunicorn on a free port and drive it with benchmarks.load_test"""
+    port = free_port()
+    env = dict(os.environ, KEY_STORE_BACKEND="json", KEY_STORE_URL=keys_file)
+    server = subprocess.Popen(
+        ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+         "--worker-class", worker_class, "--log-level", "warning", "main:app"],
+        cwd=REPO_ROOT, env=env,
+    )
+    try:
+        wait_for_port(port)
+        # Every connection uses the same key; unlimited keys never deplete
+        return asyncio.run(run_load(f"http://127.0.0.1:{port}{endpoint}",
+                                    {"key": key_name(0)}, concurrency, duration))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["test-client", "gunicorn", "all"], default="all")
+    parser.add_argument("--keys", type=int, default=10000, help="keys in the throwaway store")
+    parser.add_argument("--concurrency", default="1,16,64", help="comma-separated client counts")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--worker-class", default="sync", help="gunicorn worker class")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    workdir = make_workdir()
+    keys_file = os.path.join(workdir, "keys.json")
+    write_keys_file(keys_file, args.keys)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    modes = ["test-client", "gunicorn"] if args.mode == "all" else [args.mode]
+
+    results = {"keys": args.keys, "duration_s": args.duration, "runs": []}
+    for mode in modes:
+        for endpoint in ENDPOINTS:
+            for concurrency in levels:
+                if mode == "test-client":
+                    summary = bench_test_client(keys_file, endpoint, args.keys, concurrency, args.duration)
+                else:
+                    summary = bench_gunicorn(keys_file, endpoint, concurrency, args.duration,
+                                             args.workers, args.worker_class)
+                run = {"mode": mode, "endpoint": endpoint, "concurrency": concurrency, **summary}
+                if mode == "gunicorn":
+                    run.update(workers=args.workers, worker_class=args.worker_class)
+                results["runs"].append(run)
+                print(f"⏱️  {mode:11s} {endpoint:13s} c={concurrency:<4d} {summary['req_per_s']:>8} req/s  "
+                      f"p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  p99 {summary['p99_ms']}ms",
+                      file=sys.stderr, flush=True)
+
+    write_results(args.output, "http", results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+A local stand-in IMAP server for exercising email_reader without real mail
+accounts
+
+Speaks the subset of IMAP4rev1 that email_reader uses, in plain text (point
+an account at it with "IMAP_SSL": false): LOGIN, SELECT/EXAMINE, SEARCH
+(ALL, UNSEEN, SEEN, FROM), FETCH (RFC822, FLAGS, BODYSTRUCTURE, and BODY[...] /
+BODY.PEEK[...] of the whole message, HEADER, HEADER.FIELDS, TEXT or a part
+number, with an optional <origin.length>), STORE of flags, their UID forms, IDLE, NOOP, CAPABILITY and LOGOUT. Any user
+name and password log in; every user sees the same mailboxes. Messages are
+never expunged, so a message's UID is its sequence number. Latency can be
+injected per login and per folder search to model a remote server, and
+deliver() adds a message and tells IDLE sessions on that folder.
+
+Standalone, with a sample verification email in the first folder:
+    python -m benchmarks.imap_server --port 1143 --folder-delay-ms 200
+    python -m benchmarks.imap_server --port 1143 --deliver-every 10   # a new code every 10s
+    echo '[{"label": "Local", "IMAP_SERVER": "127.0.0.1", "IMAP_PORT": 1143,
+            "IMAP_SSL": false, "EMAIL_ACCOUNT": "me", "EMAIL_PASSWORD": "x"}]' > accounts.json
+    EMAIL_ACCOUNTS_FILE=accounts.json python email_reader.py
+"""
+
+import argparse
+import email
+import email.policy
+import random
+import re
+import socketserver
+import sys
+import threading
+import time
+from email.message import EmailMessage, Message
+from typing import Dict, List, Optional
+
+CODE_TEMPLATE = "Please use the following code to help verify your identity: {code}"
+
+def verification_email(code: str, sender: str = "noreply@tm.openai.com", padding: int = 0) -> bytes:
+    """A multipart verification email, with `padding` bytes of attachment"""
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = "me@example.com"
+    msg["Subject"] = "Your verification code"
+    msg.set_content(CODE_TEMPLATE.format(code=code))
+    msg.add_alternative(f"<html><body><p>{CODE_TEMPLATE.format(code=code)}</p></body></html>", subtype="html")
+    if padding:
+        msg.add_attachment(b"\0" * padding, maintype="application", subtype="octet-stream", filename="logo.bin")
+    return msg.as_bytes(policy=email.policy.SMTP)
+
+class Mailbox:
+    """Messages of one folder: raw bytes plus flags, numbered from 1"""
+
+    def __init__(self, messages: Optional[List[bytes]] = None, delay: float = 0.0):
+        self.messages: List[bytes] = []
+        self.parsed: List[Message] = []
+        self.flags: List[set] = []
+        self.senders: List[str] = []
+        self.delay = delay
+        for raw in messages or []:
+            self.append(raw)
+
+    def append(self, raw: bytes, flags=()):
+        msg = email.message_from_bytes(raw)
+        self.messages.append(raw)
+        self.parsed.append(msg)
+        self.flags.append(set(flags))
+        self.senders.append((msg.get("From") or "").lower())
+
+class StandInIMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, mailboxes: Dict[str, Mailbox], login_delay: float = 0.0):
+        super().__init__(address, _Session)
+        # Folder names are case-insensitive for INBOX only, as in RFC 3501
+        self.mailboxes = {("INBOX" if name.upper() == "INBOX" else name): box for name, box in mailboxes.items()}
+        self.login_delay = login_delay
+        self.lock = threading.Lock()
+        self.logins = 0
+        # Mailbox id -> sessions in IDLE with it selected
+        self.idlers: Dict[int, set] = {}
+
+    def mailbox(self, name: str) -> Optional[Mailbox]:
+        return self.mailboxes.get("INBOX" if name.upper() == "INBOX" else name)
+
+    def deliver(self, folder: str, raw: bytes):
+        """Add a message to a folder and send EXISTS to the sessions idling on it"""
+        box = self.mailbox(folder)
+        with self.lock:
+            box.append(raw)
+            idlers = list(self.idlers.get(id(box), ()))
+        for session in idlers:
+            try:
+                session.send(b"* %d EXISTS\r\n" % len(box.messages))
+            except OSError:
+                pass
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name="imap-stand-in", daemon=True)
+        thread.start()
+        return thread
+
+_TOKEN = re.compile(rb'"((?:[^"\\]|\\.)*)"|(\()|(\))|([^\s()"]+)')
+
+def _tokens(line: bytes) -> List:
+    """Atoms and quoted strings as str, parenthesized lists as nested lists"""
+    stack: List[list] = [[]]
+    for quoted, opened, closed, atom in _TOKEN.findall(line):
+        if opened:
+            stack.append([])
+        elif closed and len(stack) > 1:
+            inner = stack.pop()
+            stack[-1].append(inner)
+        elif atom:
+            stack[-1].append(atom.decode())
+        else:
+            stack[-1].append(re.sub(rb"\\(.)", rb"\1", quoted).decode())
+    return stack[0]
+
+def _flatten(tokens) -> List[str]:
+    out = []
+    for token in tokens:
+        out.extend(_flatten(token) if isinstance(token, list) else [token])
+    return out
+
+_FETCH_ITEM = re.compile(r"[A-Z0-9.]+(?:\[[^\]]*\])?(?:<\d+(?:\.\d+)?>)?", re.IGNORECASE)
+_BODY_ITEM = re.compile(r"BODY(\.PEEK)?\[([^\]]*)\](?:<(\d+)(?:\.(\d+))?>)?", re.IGNORECASE)
+
+def _split_body(raw: bytes):
+    """(header block including the blank line, body) of a message or part"""
+    for separator in (b"\r\n\r\n", b"\n\n"):
+        index = raw.find(separator)
+        if index >= 0:
+            return raw[:index + len(separator)], raw[index + len(separator):]
+    return raw, b""
+
+def _part_body(part: Message) -> bytes:
+    return _split_body(part.as_bytes(policy=email.policy.SMTP))[1]
+
+def _section_part(msg: Message, section: str) -> Message:
+    part = msg
+    for number in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+        elif number != "1":
+            raise ValueError(f"no part {section}")
+    return part
+
+def _string(value: Optional[str]) -> bytes:
+    if value is None:
+        return b"NIL"
+    return b'"' + str(value).replace("\\", "\\\\").replace('"', '\\"').encode() + b'"'
+
+def _params(pairs) -> bytes:
+    if not pairs:
+        return b"NIL"
+    return b"(" + b" ".join(_string(name.upper()) + b" " + _string(value) for name, value in pairs) + b")"
+
+def bodystructure(part: Message) -> bytes:
+    """The BODYSTRUCTURE of a message (message/rfc822 parts are described as opaque)"""
+    if part.is_multipart():
+        return (b"(" + b"".join(bodystructure(child) for child in part.get_payload()) + b" "
+                + _string(part.get_content_subtype().upper()) + b" "
+                + _params([(name, value) for name, value in part.get_params()[1:] if name == "boundary"])
+                + b" NIL NIL NIL)")
+    body = _part_body(part)
+    fields = [_string(part.get_content_maintype().upper()), _string(part.get_content_subtype().upper()),
+              _params(part.get_params()[1:] if part.get_params() else None), b"NIL", b"NIL",
+              _string((part.get("Content-Transfer-Encoding") or "7BIT").upper()), b"%d" % len(body)]
+    if part.get_content_maintype() == "text":
+        fields.append(b"%d" % body.count(b"\n"))
+    disposition = part.get_content_disposition()
+    filename = part.get_filename()
+    fields += [b"NIL", (b"(" + _string(disposition.upper()) + b" "
+                        + _params([("filename", filename)] if filename else None) + b")") if disposition else b"NIL",
+               b"NIL", b"NIL"]
+    return b"(" + b" ".join(fields) + b")"
+
+def _message_set(spec: str, count: int) -> List[int]:
+    numbers = []
+    for part in spec.split(","):
+        low, _, high = part.partition(":")
+        low_n = count if low == "*" else int(low)
+        high_n = low_n if not high else (count if high == "*" else int(high))
+        numbers.extend(range(min(low_n, high_n), max(low_n, high_n) + 1))
+    return [n for n in numbers if 1 <= n <= count]
+
+class _Session(socketserver.StreamRequestHandler):
+    server: StandInIMAPServer
+    # Responses go out in several writes; don't let Nagle hold them back
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.selected: Optional[Mailbox] = None
+        self.readonly = False
+        # deliver() writes from another thread while the session is in IDLE
+        self.write_lock = threading.Lock()
+
+    def send(self, data: bytes):
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def handle(self):
+        self.send(b"* OK [CAPABILITY IMAP4rev1 IDLE] stand-in IMAP server ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.rstrip(b"\r\n").partition(b" ")
+            command, _, args = rest.partition(b" ")
+            handler = getattr(self, "do_" + command.decode(errors="replace").upper(), None)
+            if handler is None:
+                self.send(tag + b" BAD unknown command\r\n")
+                continue
+            try:
+                if handler(tag, args) is False:
+                    return
+            except (ValueError, IndexError) as e:
+                self.send(tag + b" BAD " + str(e).encode() + b"\r\n")
+
+    def do_CAPABILITY(self, tag, args):
+        self.send(b"* CAPABILITY IMAP4rev1 IDLE\r\n" + tag + b" OK CAPABILITY completed\r\n")
+
+    def do_NOOP(self, tag, args):
+        self.send(tag + b" OK NOOP completed\r\n")
+
+    def do_LOGIN(self, tag, args):
+        time.sleep(self.server.login_delay)
+        with self.server.lock:
+            self.server.logins += 1
+        self.send(tag + b" OK LOGIN completed\r\n")
+
+    def do_LOGOUT(self, tag, args):
+        self.send(b"* BYE logging out\r\n" + tag + b" OK LOGOUT completed\r\n")
+        return False
+
+    def do_SELECT(self, tag, args, readonly=False):
+        name = _tokens(args)[0]
+        box = self.server.mailbox(name)
+        if box is None:
+            self.selected = None
+            self.send(tag + b" NO no such mailbox\r\n")
+            return
+        self.selected, self.readonly = box, readonly
+        mode = b"READ-ONLY" if readonly else b"READ-WRITE"
+        self.send(b"* FLAGS (\\Seen)\r\n* %d EXISTS\r\n* 0 RECENT\r\n%s OK [%s] selected\r\n"
+                  % (len(box.messages), tag, mode))
+
+    def do_EXAMINE(self, tag, args):
+        return self.do_SELECT(tag, args, readonly=True)
+
+    def _need_selected(self, tag) -> bool:
+        if self.selected is None:
+            self.send(tag + b" BAD no mailbox selected\r\n")
+            return False
+        return True
+
+    def do_IDLE(self, tag, args):
+        if not self._need_selected(tag):
+            return
+        with self.server.lock:
+            idlers = self.server.idlers.setdefault(id(self.selected), set())
+            idlers.add(self)
+        try:
+            self.send(b"+ idling\r\n")
+            line = self.rfile.readline()
+        finally:
+            with self.server.lock:
+                idlers.discard(self)
+        if not line:
+            return False
+        if line.strip().upper() != b"DONE":
+            self.send(tag + b" BAD expected DONE\r\n")
+            return
+        self.send(tag + b" OK IDLE terminated\r\n")
+
+    def do_UID(self, tag, args):
+        command, _, rest = args.partition(b" ")
+        command = command.upper()
+        if command not in (b"FETCH", b"STORE", b"SEARCH"):
+            raise ValueError("unsupported UID command")
+        # UIDs equal sequence numbers here; FETCH responses just add the UID item
+        return getattr(self, "do_" + command.decode())(tag, rest, uid=command == b"FETCH")
+
+    def do_SEARCH(self, tag, args, uid=False):
+        if not self._need_selected(tag):
+            return
+        box = self.selected
+        time.sleep(box.delay)
+        tokens = _flatten(_tokens(args))
+        matches = []
+        for number in range(1, len(box.messages) + 1):
+            index, ok = 0, True
+            while index < len(tokens) and ok:
+                key = tokens[index].upper()
+                if key == "UNSEEN":
+                    ok = "\\Seen" not in box.flags[number - 1]
+                elif key == "SEEN":
+                    ok = "\\Seen" in box.flags[number - 1]
+                elif key == "FROM":
+                    index += 1
+                    ok = tokens[index].lower() in box.senders[number - 1]
+                elif key not in ("ALL", "CHARSET", "US-ASCII", "UTF-8"):
+                    raise ValueError(f"unsupported search key {key}")
+                index += 1
+            if ok:
+                matches.append(number)
+        self.send(b"* SEARCH" + b"".join(b" %d" % n for n in matches) + b"\r\n" + tag + b" OK SEARCH completed\r\n")
+
+    def _fetch_items(self, number: int, items: List[str], uid: bool = False) -> bytes:
+        box = self.selected
+        raw = box.messages[number - 1]
+        parts = [b"UID %d" % number] if uid else []
+        for item in items:
+            name = item.upper()
+            body = _BODY_ITEM.fullmatch(item)
+            if name == "RFC822":
+                parts.append(b"RFC822 {%d}\r\n" % len(raw) + raw)
+                if not self.readonly:
+                    box.flags[number - 1].add("\\Seen")
+            elif body:
+                peek, section, origin, length = body.groups()
+                data = self._section(number, section)
+                label = f"BODY[{section}]"
+                if origin is not None:
+                    start = int(origin)
+                    data = data[start:start + int(length)] if length else data[start:]
+                    label += f"<{start}>"
+                parts.append(label.encode() + b" {%d}\r\n" % len(data) + data)
+                if not peek and not self.readonly:
+                    box.flags[number - 1].add("\\Seen")
+            elif name == "BODYSTRUCTURE":
+                parts.append(b"BODYSTRUCTURE " + bodystructure(box.parsed[number - 1]))
+            elif name == "UID":
+                if not uid:
+                    parts.append(b"UID %d" % number)
+            elif name == "FLAGS":
+                parts.append(b"FLAGS (" + " ".join(sorted(box.flags[number - 1])).encode() + b")")
+            else:
+                raise ValueError(f"unsupported fetch item {item}")
+        return b"* %d FETCH (" % number + b" ".join(parts) + b")\r\n"
+
+    def _section(self, number: int, section: str) -> bytes:
+        raw = self.selected.messages[number - 1]
+        spec = section.upper()
+        if not spec:
+            return raw
+        header, text = _split_body(raw)
+        if spec == "HEADER":
+            return header
+        if spec == "TEXT":
+            return text
+        if spec.startswith("HEADER.FIELDS"):
+            wanted = {field.lower() for field in re.findall(r"[^\s()]+", spec[len("HEADER.FIELDS"):])}
+            msg = self.selected.parsed[number - 1]
+            return b"".join(f"{name}: {value}\r\n".encode() for name, value in msg.items()
+                            if name.lower() in wanted) + b"\r\n"
+        return _part_body(_section_part(self.selected.parsed[number - 1], section))
+
+    def do_FETCH(self, tag, args, uid=False):
+        if not self._need_selected(tag):
+            return
+        spec, _, items = args.partition(b" ")
+        names = _FETCH_ITEM.findall(items.decode())
+        for number in _message_set(spec.decode(), len(self.selected.messages)):
+            self.send(self._fetch_items(number, names, uid))
+        self.send(tag + b" OK FETCH completed\r\n")
+
+    def do_STORE(self, tag, args, uid=False):
+        if not self._need_selected(tag):
+            return
+        tokens = _tokens(args)
+        spec, action, flags = tokens[0], tokens[1].upper(), _flatten(tokens[2:])
+        box = self.selected
+        for number in _message_set(spec, len(box.messages)):
+            current = box.flags[number - 1]
+            if action.startswith("+FLAGS"):
+                current.update(flags)
+            elif action.startswith("-FLAGS"):
+                current.difference_update(flags)
+            else:
+                current.clear()
+                current.update(flags)
+            if not action.endswith(".SILENT"):
+                self.send(b"* %d FETCH (FLAGS (%s))\r\n" % (number, " ".join(sorted(current)).encode()))
+        self.send(tag + b" OK STORE completed\r\n")
+
+def sample_mailboxes(folders: List[str], delay: float = 0.0) -> Dict[str, Mailbox]:
+    """`folders`, each holding one newsletter; the first also an unread verification email"""
+    newsletter = EmailMessage()
+    newsletter["From"] = "news@example.com"
+    newsletter["Subject"] = "Weekly news"
+    newsletter.set_content("Nothing to verify here.")
+    boxes = {folder: Mailbox([newsletter.as_bytes()], delay=delay) for folder in folders}
+    boxes[folders[0]].append(verification_email("123456"))
+    return boxes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1143)
+    parser.add_argument("--folders", default="inbox,Spam,Junk", help="comma-separated folder names")
+    parser.add_argument("--login-delay-ms", type=float, default=0.0, help="added latency per LOGIN")
+    parser.add_argument("--folder-delay-ms", type=float, default=0.0, help="added latency per SEARCH")
+    parser.add_argument("--deliver-every", type=float, default=0.0, metavar="SECONDS",
+                        help="deliver a verification email with a random code to the first folder this often")
+    args = parser.parse_args(argv)
+
+    folders = args.folders.split(",")
+    boxes = sample_mailboxes(folders, args.folder_delay_ms / 1000)
+    server = StandInIMAPServer((args.host, args.port), boxes, login_delay=args.login_delay_ms / 1000)
+    print(f"📬 Stand-in IMAP server on {args.host}:{args.port} with folders {args.folders}", file=sys.stderr)
+    server.start()
+    try:
+        while True:
+            time.sleep(args.deliver_every or 3600)
+            if args.deliver_every:
+                code = f"{random.randrange(10 ** 6):06d}"
+                server.deliver(folders[0], verification_email(code))
+                print(f"✉️  Delivered code {code} to {folders[0]}", file=sys.stderr)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
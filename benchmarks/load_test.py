@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+HTTP load generator for the key API
+
+Opens `--concurrency` keep-alive connections to a running server and
+POSTs to one endpoint for `--duration` seconds, then reports throughput
+and latency percentiles. Uses raw asyncio streams, so it needs no
+third-party client library and can hold thousands of connections from one
+process.
+
+Usage:
+    python -m benchmarks.load_test http://127.0.0.1:5000/validate-key --concurrency 200
+    python -m benchmarks.load_test http://127.0.0.1:5000/get-code --key UNLIMITED_KEY_001
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Dict, Any, List
+from urllib.parse import urlsplit
+
+from benchmarks.common import summarize
+
+async def _read_response(reader: asyncio.StreamReader):
+    """Read one response; returns (status, server_closed_connection)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = 0
+    close = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value.strip())
+        elif name == "connection" and value.strip().lower() == "close":
+            close = True
+    if length:
+        await reader.readexactly(length)
+    return status, close
+
+async def _connection(host, port, request, deadline, latencies, counters):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, closed = await _read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status >= 500:
+                counters["errors"] += 1
+            if closed:
+                # Sync workers close after every response; reconnect
+                writer.close()
+                reader = writer = None
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            counters["errors"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+async def run_load(url: str, payload: Dict[str, Any], concurrency: int, duration: float) -> Dict[str, Any]:
+    """Drive `url` with `concurrency` connections for `duration` seconds"""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    body = json.dumps(payload).encode()
+    request = (
+        f"POST {parts.path or '/'} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: keep-alive\r\n\r\n"
+    ).encode() + body
+
+    latencies: List[float] = []
+    counters = {"errors": 0}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*[
+        _connection(host, port, request, deadline, latencies, counters)
+        for _ in range(concurrency)
+    ])
+    return summarize(latencies, counters["errors"], time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("url")
+    parser.add_argument("--key", default="UNLIMITED_KEY_001")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load(args.url, {"key": args.key}, args.concurrency, args.duration))
+    print(json.dumps(result, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Repeat /validate-key lookups with and without the response cache
+
+Replays what the page does while a user types: the same few keys are
+validated over and over, now and then interleaved with a /get-code of
+another key (--redeem-every). Runs the Flask test client against a
+throwaway JSON or SQLite store in three modes:
+- no_cache:  RESPONSE_CACHE_TTL=0, every lookup reads the store
+- cache:     the response cache, full 200 answers
+- cache_etag: the response cache, with If-None-Match from the last answer,
+              so unchanged answers are 304s with no body
+
+Reported per mode: req/s and latency percentiles through Flask, the time
+spent in api.lookup() itself, the share of lookups that read the store and
+the bytes of response body sent.
+
+Usage:
+    python -m benchmarks.lookup_cache --backend json --keys 10000 --requests 5000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Any, Dict
+
+from benchmarks.common import key_name, make_workdir, summarize, write_keys_file, write_results
+
+# Every benchmark request comes from one IP; measure the cache, not the limiter
+os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+
+def run(client, keys, requests: int, redeem_every: int, conditional: bool, redeem_key: str) -> Dict[str, Any]:
+    rng = random.Random(1)
+    etags: Dict[str, str] = {}
+    latencies, errors, body_bytes = [], 0, 0
+    for i in range(requests):
+        if redeem_every and i % redeem_every == redeem_every - 1:
+            client.post("/get-code", json={"key": redeem_key})
+        key = rng.choice(keys)
+        headers = {"If-None-Match": etags[key]} if conditional and key in etags else {}
+        started = time.perf_counter()
+        response = client.post("/validate-key", json={"key": key}, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code not in (200, 304):
+            errors += 1
+        if response.headers.get("ETag"):
+            etags[key] = response.headers["ETag"]
+        body_bytes += len(response.data)
+    result = summarize(latencies, errors)
+    result["body_bytes"] = body_bytes
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--keys", type=int, default=10000, help="keys in the throwaway store")
+    parser.add_argument("--hot-keys", type=int, default=5, help="distinct keys being typed")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--redeem-every", type=int, default=50, help="a /get-code every N lookups (0: none)")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    import api
+    import app as app_module
+    from key_store import configure_key_store, create_key_store
+    from response_cache import ResponseCache
+
+    workdir = make_workdir()
+    keys_file = os.path.join(workdir, "keys.json")
+    write_keys_file(keys_file, args.keys)
+    if args.backend == "sqlite":
+        location = os.path.join(workdir, "keys.db")
+        store = create_key_store("sqlite", location)
+        store.bulk_add(create_key_store("json", keys_file).all())
+    else:
+        location = keys_file
+    configure_key_store(args.backend, location)
+
+    # Count lookups that reach the store, and time the handler without Flask
+    reads, handler_time = [0], [0.0]
+    get_key_info, lookup = api.get_key_info, api.lookup
+
+    def counting_get_key_info(key):
+        reads[0] += 1
+        return get_key_info(key)
+
+    def timed_lookup(*args):
+        started = time.perf_counter()
+        try:
+            return lookup(*args)
+        finally:
+            handler_time[0] += time.perf_counter() - started
+    api.get_key_info, api.lookup = counting_get_key_info, timed_lookup
+
+    client = app_module.app.test_client()
+    keys = [key_name(i) for i in range(args.hot_keys)]
+    results: Dict[str, Any] = {"backend": args.backend, "keys": args.keys, "hot_keys": args.hot_keys,
+                               "redeem_every": args.redeem_every, "modes": {}}
+    for mode, cache, conditional in (("no_cache", None, False), ("cache", ResponseCache(2.0), False),
+                                     ("cache_etag", ResponseCache(2.0), True)):
+        app_module.response_cache = cache
+        reads[0], handler_time[0] = 0, 0.0
+        result = run(client, keys, args.requests, args.redeem_every, conditional, key_name(args.keys - 1))
+        result["store_reads_per_lookup"] = round(reads[0] / args.requests, 3)
+        result["handler_us"] = round(handler_time[0] / args.requests * 1e6, 1)
+        results["modes"][mode] = result
+        print(f"⏱️  {mode:10s} {result['req_per_s']:>8} req/s  p50 {result['p50_ms']}ms  "
+              f"p99 {result['p99_ms']}ms  handler {result['handler_us']}µs  "
+              f"{result['store_reads_per_lookup']} store reads and "
+              f"{result['body_bytes'] // args.requests} body bytes per lookup", file=sys.stderr)
+    write_results(args.output, "lookup_cache", results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Memory footprint of the in-memory key representation
+
+For each store size, writes a keys.json and compares the memory held by:
+- dict: the parsed file as a dict of dicts (the old KeyCache contents)
+- table: the same keys in a key_table.KeyTable (the current KeyCache)
+
+Memory is measured with tracemalloc, so it counts Python allocations only
+and is independent of what else the process holds. Lookup latency for both
+is reported alongside.
+
+Usage:
+    python -m benchmarks.memory --sizes 1000000
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict
+
+from benchmarks.common import key_name, make_workdir, time_calls, write_keys_file, write_results
+
+def _measure(build):
+    """(result, bytes still allocated by it, seconds taken)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+def bench_size(size: int, calls: int, workdir: str) -> Dict[str, Any]:
+    from key_table import KeyTable
+
+    keys_file = os.path.join(workdir, f"keys_{size}.json")
+    write_keys_file(keys_file, size, max_uses=5)
+
+    def load_dict():
+        with open(keys_file) as f:
+            return json.load(f)
+
+    records, dict_bytes, dict_s = _measure(load_dict)
+    table, table_bytes, table_s = _measure(lambda: KeyTable(records))
+    assert len(table) == size and not table.overflow
+
+    rng = random.Random(size)
+    sample = [(key_name(rng.randrange(size)),) for _ in range(calls)]
+    dict_get = time_calls(records.get, sample)
+    table_get = time_calls(table.get, sample)
+    del records
+
+    return {
+        "keys": size,
+        "dict_bytes_per_key": round(dict_bytes / size, 1),
+        "table_bytes_per_key": round(table_bytes / size, 1),
+        "reduction": round(dict_bytes / table_bytes, 1),
+        "json_load_s": round(dict_s, 3),
+        "table_build_s": round(table_s, 3),
+        "dict_get": dict_get,
+        "table_get": table_get,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000000", help="comma-separated key counts")
+    parser.add_argument("--calls", type=int, default=20000, help="lookups timed per size")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    workdir = make_workdir()
+    results = {"sizes": []}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"⏱️  {size} keys...", file=sys.stderr, flush=True)
+        result = bench_size(size, args.calls, workdir)
+        results["sizes"].append(result)
+        print(f"   dict {result['dict_bytes_per_key']} B/key, table {result['table_bytes_per_key']} B/key "
+              f"({result['reduction']}x smaller); get p50 {result['dict_get']['p50_ms']}ms "
+              f"vs {result['table_get']['p50_ms']}ms", file=sys.stderr, flush=True)
+    write_results(args.output, "memory", results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
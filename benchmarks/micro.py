@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the totp_generator read and redemption paths
+
+For each store size, builds a throwaway key store and measures:
+- load_keys: cold (first parse) and warm (cached) full loads
+- get_key_info: per-call latency for random existing keys
+- generate_totp_code: per-call latency of a redemption (unlimited keys)
+
+Usage:
+    python -m benchmarks.micro --sizes 1000,100000,1000000 --output bench_results.json
+    python -m benchmarks.micro --backend sqlite --sizes 1000,100000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, Any
+
+from benchmarks.common import make_workdir, write_keys_file, key_name, time_calls, write_results
+
+def build_store(backend: str, workdir: str, size: int):
+    """Create a store of `size` unlimited keys and make it the process default"""
+    from key_store import configure_key_store, create_key_store
+
+    keys_file = os.path.join(workdir, f"keys_{size}.json")
+    write_keys_file(keys_file, size)
+    if backend == "json":
+        return configure_key_store("json", keys_file)
+    if backend == "snapshot":
+        import snapshot
+        from key_store import _write_atomic
+        with open(keys_file) as f:
+            snap_file = os.path.join(workdir, f"keys_{size}.snap")
+            _write_atomic(snap_file, snapshot.dump(json.load(f)))
+        return configure_key_store("snapshot", snap_file)
+    location = {
+        "sqlite": os.path.join(workdir, f"keys_{size}.db"),
+        "sqlalchemy": f"sqlite:///{os.path.join(workdir, f'keys_{size}_sa.db')}",
+    }[backend]
+    from bulk_keys import import_keys
+    import_keys(keys_file, create_key_store(backend, location), fmt="json", chunk_size=50000)
+    return configure_key_store(backend, location)
+
+def bench_size(backend: str, size: int, calls: int, workdir: str) -> Dict[str, Any]:
+    import totp_generator
+    from key_store import configure_key_store
+
+    build_started = time.perf_counter()
+    store = build_store(backend, workdir, size)
+    build_s = time.perf_counter() - build_started
+    if backend == "sqlalchemy":
+        location = store.engine.url.render_as_string(hide_password=False)
+    else:
+        location = store.path
+
+    # A fresh store instance has an empty cache, so the first load is cold
+    configure_key_store(backend, location)
+    started = time.perf_counter()
+    loaded = totp_generator.load_keys()
+    cold_s = time.perf_counter() - started
+    assert len(loaded) == size
+    del loaded
+
+    started = time.perf_counter()
+    totp_generator.load_keys()
+    warm_s = time.perf_counter() - started
+
+    rng = random.Random(size)
+    sample = [(key_name(rng.randrange(size)),) for _ in range(calls)]
+    info = time_calls(totp_generator.get_key_info, sample)
+    redeem = time_calls(totp_generator.generate_totp_code, sample)
+
+    return {
+        "keys": size,
+        "build_s": round(build_s, 3),
+        "load_keys_cold_s": round(cold_s, 4),
+        "load_keys_warm_s": round(warm_s, 4),
+        "get_key_info": info,
+        "generate_totp_code": redeem,
+    }
+
+def run(backend: str, sizes, calls: int) -> Dict[str, Any]:
+    workdir = make_workdir()
+    results = {"backend": backend, "calls_per_size": calls, "sizes": []}
+    for size in sizes:
+        print(f"⏱️  {backend}: {size} keys...", file=sys.stderr, flush=True)
+        result = bench_size(backend, size, calls, workdir)
+        results["sizes"].append(result)
+        print(f"   load cold {result['load_keys_cold_s']}s, "
+              f"get_key_info p50 {result['get_key_info']['p50_ms']}ms, "
+              f"generate_totp_code p50 {result['generate_totp_code']['p50_ms']}ms",
+              file=sys.stderr, flush=True)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["json", "snapshot", "sqlite", "sqlalchemy"], default="json")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma-separated key counts")
+    parser.add_argument("--calls", type=int, default=2000, help="calls per timed function and size")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(args.backend, sizes, args.calls)
+    write_results(args.output, f"micro_{args.backend}", results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Cold-start cost of the JSON and binary snapshot formats
+
+For each store size, writes keys.json and the equivalent keys.snap, then
+starts fresh Python processes that open the store and look up one key, the
+way a newly forked worker does. Reported per format:
+- open_s:   KeyStore creation plus the first lookup (parse or mmap)
+- rss_mb:   resident memory of the process afterwards (for the snapshot
+            this includes mapped pages touched by the lookups, which are
+            shared page cache rather than per-worker memory)
+- get:      per-call latency of further lookups in the same process
+
+Each measurement runs in its own interpreter so nothing is cached between
+them except the OS page cache, which a real restart would also have.
+
+Usage:
+    python -m benchmarks.startup --sizes 1000,100000,1000000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict
+
+from benchmarks.common import make_workdir, write_keys_file, write_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process: argv = backend, path, size, calls
+CHILD = """
+import json, random, sys, time
+started = time.perf_counter()
+from key_store import create_key_store
+store = create_key_store(sys.argv[1], sys.argv[2])
+assert store.get("bench00000000") is not None
+open_s = time.perf_counter() - started
+
+from benchmarks.common import key_name, time_calls
+rng = random.Random(1)
+size, calls = int(sys.argv[3]), int(sys.argv[4])
+get = time_calls(store.get, [(key_name(rng.randrange(size)),) for _ in range(calls)])
+# VmRSS rather than ru_maxrss, which Linux carries over from the parent across exec
+with open("/proc/self/status") as f:
+    rss_mb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:")) / 1024
+print(json.dumps({"open_s": round(open_s, 4), "rss_mb": round(rss_mb, 1), "get": get}))
+"""
+
+def run_child(backend: str, path: str, size: int, calls: int) -> Dict[str, Any]:
+    env = dict(os.environ, KEY_FILTER="off", PYTHONPATH=ROOT)
+    output = subprocess.run([sys.executable, "-c", CHILD, backend, path, str(size), str(calls)],
+                            cwd=ROOT, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def bench_size(size: int, calls: int, repeat: int, workdir: str) -> Dict[str, Any]:
+    import snapshot
+    from key_store import _write_atomic
+
+    json_file = os.path.join(workdir, f"keys_{size}.json")
+    snap_file = os.path.join(workdir, f"keys_{size}.snap")
+    write_keys_file(json_file, size, max_uses=5)
+    with open(json_file) as f:
+        _write_atomic(snap_file, snapshot.dump(json.load(f)))
+
+    result: Dict[str, Any] = {
+        "keys": size,
+        "json_file_bytes": os.path.getsize(json_file),
+        "snapshot_file_bytes": os.path.getsize(snap_file),
+    }
+    for backend, path in (("json", json_file), ("snapshot", snap_file)):
+        # Keep the fastest open: the others mostly measure scheduling noise
+        runs = [run_child(backend, path, size, calls) for _ in range(repeat)]
+        result[backend] = min(runs, key=lambda run: run["open_s"])
+    result["speedup"] = round(result["json"]["open_s"] / result["snapshot"]["open_s"], 1)
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma-separated key counts")
+    parser.add_argument("--calls", type=int, default=5000, help="lookups timed per process")
+    parser.add_argument("--repeat", type=int, default=3, help="processes started per format and size")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    workdir = make_workdir()
+    results = {"sizes": []}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"⏱️  {size} keys...", file=sys.stderr, flush=True)
+        result = bench_size(size, args.calls, args.repeat, workdir)
+        results["sizes"].append(result)
+        print(f"   open json {result['json']['open_s']}s ({result['json']['rss_mb']} MB), "
+              f"snapshot {result['snapshot']['open_s']}s ({result['snapshot']['rss_mb']} MB), "
+              f"{result['speedup']}x faster", file=sys.stderr, flush=True)
+    write_results(args.output, "startup", results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Page weight and worker time for static files: /static/ vs built /assets/
+
+Builds a copy of static/ with static_assets.build() and serves both through
+a Flask app configured like app.py. For the page's stylesheet, script and
+background image it reports:
+- bytes sent on a first visit, uncompressed from /static/ vs the smallest
+  variant from /assets/ for a browser sending Accept-Encoding: br, gzip
+- worker CPU time per request, the file read through the response
+  iterator as a server would
+- a repeat visit: /static/ files are revalidated on every page load (Flask
+  sends no max-age), costing a 304 request each; /assets/ ones are
+  immutable and not requested at all
+- how long sending a first visit's files keeps a sync worker busy for a
+  client on a --client-mbps link (an estimate: bytes over bandwidth, for a
+  server without a buffering proxy in front)
+
+Usage:
+    python -m benchmarks.static_assets --requests 500
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+from typing import Any, Dict
+
+from benchmarks.common import make_workdir, summarize, write_results
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE_ASSETS = ("style.css", "script.js", "background.jpg")
+
+def time_requests(client, url: str, headers: Dict[str, str], requests: int) -> Dict[str, Any]:
+    latencies, cpu, sent = [], 0.0, 0
+    for _ in range(requests):
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        response = client.get(url, headers=headers)
+        sent = sum(len(chunk) for chunk in response.response)
+        response.close()
+        cpu += time.thread_time() - cpu_started
+        latencies.append(time.perf_counter() - started)
+    result = summarize(latencies)
+    result["cpu_us_per_request"] = round(cpu / requests * 1e6, 1)
+    result["bytes"] = sent
+    return result
+
+def main(argv=None):
+    from flask import Flask
+
+    import static_assets
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="requests per file and mode")
+    parser.add_argument("--client-mbps", type=float, default=10.0, help="client bandwidth for the send estimate")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    static_dir = os.path.join(make_workdir(), "static")
+    shutil.copytree(os.path.join(REPO_ROOT, "static"), static_dir, ignore=shutil.ignore_patterns("dist"))
+    manifest = static_assets.build(static_dir)
+    app = Flask(__name__, static_folder=static_dir)
+    static_assets.init_app(app)
+    client = app.test_client()
+    accept = {"Accept-Encoding": "br, gzip"}
+
+    results: Dict[str, Any] = {"brotli": static_assets.brotli is not None,
+                               "pillow": static_assets.Image is not None, "files": {}}
+    totals = {"static": 0, "assets": 0}
+    revalidation_cpu = 0.0
+    for name in PAGE_ASSETS:
+        etag = client.get(f"/static/{name}").headers["ETag"]
+        file_results = {
+            "static": time_requests(client, f"/static/{name}", accept, args.requests),
+            "assets": time_requests(client, static_assets.asset_path(manifest["assets"], name), accept, args.requests),
+            "static_revalidate": time_requests(client, f"/static/{name}", {**accept, "If-None-Match": etag},
+                                               args.requests),
+        }
+        results["files"][name] = file_results
+        revalidation_cpu += file_results["static_revalidate"]["cpu_us_per_request"]
+        for mode, result in file_results.items():
+            totals[mode] = totals.get(mode, 0) + result["bytes"]
+            print(f"⏱️  {name:15s} {mode:17s} {result['bytes']:>8} bytes  {result['cpu_us_per_request']:>7}µs CPU  "
+                  f"p50 {result['p50_ms']}ms", file=sys.stderr)
+    bytes_per_ms = args.client_mbps * 1e6 / 8 / 1000
+    results["first_visit"] = {mode: {"bytes": totals[mode], "send_ms": round(totals[mode] / bytes_per_ms, 1)}
+                              for mode in ("static", "assets")}
+    results["repeat_visit"] = {"static": {"requests": len(PAGE_ASSETS), "cpu_us": round(revalidation_cpu, 1)},
+                               "assets": {"requests": 0, "cpu_us": 0.0}}
+    for mode in ("static", "assets"):
+        first, repeat = results["first_visit"][mode], results["repeat_visit"][mode]
+        print(f"⏱️  /{mode}/: first visit {first['bytes']} bytes, ~{first['send_ms']}ms to send at "
+              f"{args.client_mbps:g} Mbit/s; repeat visit {repeat['requests']} requests, {repeat['cpu_us']}µs CPU",
+              file=sys.stderr)
+    write_results(args.output, "static_assets", results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test for key redemption
+
+Creates a throwaway key store, fires thousands of redemptions at it from
+many processes at once and checks that no key was redeemed more often than
+its max_uses allows and that the persisted usage counts match the number of
+codes actually handed out.
+
+Usage:
+    python -m benchmarks.stress_redemption --processes 16 --requests 5000
+    python -m benchmarks.stress_redemption --backend sqlite
+    python -m benchmarks.stress_redemption --backend sqlalchemy --url postgresql://localhost/stress
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+def build_keys(count, max_uses):
+    """Build a key dict with `count` keys that all share one secret"""
+    secret = "3YWFIRISX3ZADDKPK2WZXQAVTOGWXT4Y"
+    return {
+        f"stress{i:06d}": {
+            "secret": secret,
+            "max_uses": max_uses,
+            "usage_count": 0,
+            "created_at": "2025-01-01T00:00:00Z"
+        }
+        for i in range(count)
+    }
+
+def redeem_batch(args):
+    """Worker: redeem random keys and report which redemptions succeeded"""
+    key_names, requests, seed = args
+    # Imported here so each worker process gets its own key cache
+    from totp_generator import generate_totp_code
+
+    rng = random.Random(seed)
+    successes = Counter()
+    for _ in range(requests):
+        key = rng.choice(key_names)
+        code, error = generate_totp_code(key)
+        if code:
+            successes[key] += 1
+        elif "usage limit" not in error:
+            raise RuntimeError(f"Unexpected redemption error for {key}: {error}")
+    return successes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=5000, help="total redemptions to attempt")
+    parser.add_argument("--keys", type=int, default=200)
+    parser.add_argument("--max-uses", type=int, default=2)
+    parser.add_argument("--backend", choices=["json", "snapshot", "sqlite", "sqlalchemy"], default="json")
+    parser.add_argument("--url", help="database URL for the sqlalchemy backend (default: a temp SQLite file)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stress_keys_")
+    default_locations = {
+        "json": os.path.join(workdir, "keys.json"),
+        "snapshot": os.path.join(workdir, "keys.snap"),
+        "sqlite": os.path.join(workdir, "keys.db"),
+        "sqlalchemy": f"sqlite:///{os.path.join(workdir, 'keys.db')}",
+    }
+    location = args.url or default_locations[args.backend]
+    # Set before any worker imports key_store
+    os.environ["KEY_STORE_BACKEND"] = args.backend
+    os.environ["KEY_STORE_URL"] = location
+    os.environ.setdefault("KEYS_JOURNAL_COMPACT_THRESHOLD", "250")
+
+    from key_store import create_key_store
+    keys = build_keys(args.keys, args.max_uses)
+    if args.backend in ("json", "snapshot"):
+        create_key_store().save(keys)
+    else:
+        create_key_store().bulk_add(keys)
+
+    key_names = list(keys)
+    per_process = args.requests // args.processes
+    jobs = [(key_names, per_process, seed) for seed in range(args.processes)]
+
+    start = time.perf_counter()
+    with Pool(args.processes) as pool:
+        results = pool.map(redeem_batch, jobs)
+    elapsed = time.perf_counter() - start
+
+    successes = Counter()
+    for result in results:
+        successes.update(result)
+
+    stored = create_key_store().all()
+
+    failures = []
+    for key in key_names:
+        granted = successes.get(key, 0)
+        usage_count = stored[key]["usage_count"]
+        if granted > args.max_uses:
+            failures.append(f"{key}: {granted} codes issued, limit {args.max_uses}")
+        if usage_count != granted:
+            failures.append(f"{key}: usage_count {usage_count} but {granted} codes issued")
+
+    attempted = per_process * args.processes
+    print(f"Attempted {attempted} redemptions across {args.processes} processes in {elapsed:.2f}s "
+          f"({attempted / elapsed:.0f} req/s)")
+    print(f"Issued {sum(successes.values())} codes for {len(key_names)} keys "
+          f"(capacity {len(key_names) * args.max_uses})")
+    print(f"Store kept at {location}")
+
+    if failures:
+        print(f"❌ {len(failures)} limit violations:")
+        for failure in failures[:20]:
+            print(f"   {failure}")
+        return 1
+    print("✅ No key exceeded its usage limit")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Bulk key import/export for the 2FA TOTP system
+
+Streams keys between CSV / JSON Lines files and the configured key store.
+Input is read one row at a time, secrets are validated as base32, and rows
+go to the store through KeyStore.bulk_add, which skips keys that already
+exist using the store's own index (dict lookup or primary key). The
+database backends commit in chunks, so memory stays flat however large the
+input. The json and snapshot backends rewrite their whole file on every
+bulk_add, so by default they buffer every valid row of the input and
+commit once at the end: memory grows with the input, and nothing is
+stored if the import is interrupted.
+
+Examples:
+    python bulk_keys.py import new_keys.csv --max-uses 2
+    python bulk_keys.py import keys.jsonl --backend sqlite --url keys.db
+    python bulk_keys.py import keys_backup.json --generate-secrets
+    python bulk_keys.py export all_keys.jsonl
+
+CSV files need a header with at least a "key" column; "secret",
+"max_uses", "usage_count", "created_at", "last_used", the expiry fields
+"expires_at", "ttl_after_first_use" (seconds) and "first_used_at", and the
+legacy "used" flag are optional; times are stored in UTC in the format
+normalize_timestamp() gives. Lines of the sweeper's archive
+(keys.archive.jsonl) import as they are. JSON Lines rows are objects with the same fields or bare
+key strings. A .json file may be a keys.json-style object or a list of keys
+(as in keys_backup.json) whose items may also be row objects; it is loaded
+whole rather than streamed.
+"""
+
+import argparse
+import base64
+import binascii
+import csv
+import json
+import sys
+import time
+from functools import lru_cache
+from typing import Iterator, Tuple, Optional, Dict, Any, IO
+
+import pyotp
+from key_store import create_key_store, normalize_timestamp, utc_timestamp, KeyRecord
+
+FIELDS = ("key", "secret", "max_uses", "usage_count", "created_at", "last_used",
+          "expires_at", "ttl_after_first_use", "first_used_at")
+
+# Each json/snapshot commit rewrites the whole file, so those buffer the whole
+# input and commit once at the end; --chunk-size trades that memory for rewrites
+DEFAULT_CHUNK_SIZES = {"json": 0, "snapshot": 0, "sqlite": 10000, "sqlalchemy": 5000}
+
+class InvalidRow(ValueError):
+    """A row that cannot be turned into a key record"""
+
+@lru_cache(maxsize=65536)
+def normalize_secret(secret: str) -> str:
+    """Upper-case a base32 secret and check that it decodes"""
+    secret = secret.replace(" ", "").upper()
+    if not secret:
+        raise InvalidRow("empty secret")
+    try:
+        base64.b32decode(secret + "=" * (-len(secret) % 8))
+    except (binascii.Error, ValueError):
+        raise InvalidRow(f"secret is not valid base32: {secret!r}")
+    return secret
+
+def _int_field(row: Dict[str, Any], name: str, default: int) -> int:
+    value = row.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidRow(f"{name} is not an integer: {value!r}")
+
+def _timestamp_field(row: Dict[str, Any], name: str) -> Optional[str]:
+    value = row.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return normalize_timestamp(str(value))
+    except ValueError:
+        raise InvalidRow(f"{name} is not an ISO 8601 time: {value!r}")
+
+def _truthy(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
+
+def build_record(row: Dict[str, Any], defaults: Dict[str, Any]) -> Tuple[str, KeyRecord]:
+    """Validate one input row and build its key record"""
+    key = str(row.get("key") or "").strip()
+    if not key:
+        raise InvalidRow("missing key")
+
+    secret = row.get("secret")
+    if secret:
+        secret = normalize_secret(str(secret))
+    elif defaults["generate_secrets"]:
+        secret = pyotp.random_base32()
+    else:
+        raise InvalidRow("missing secret (use --generate-secrets)")
+
+    max_uses = _int_field(row, "max_uses", defaults["max_uses"])
+    if max_uses < -1 or max_uses == 0:
+        raise InvalidRow(f"max_uses must be -1 or positive: {max_uses}")
+    if "usage_count" in row and row["usage_count"] not in (None, ""):
+        usage_count = _int_field(row, "usage_count", 0)
+        if usage_count < 0:
+            raise InvalidRow(f"usage_count must not be negative: {usage_count}")
+        if max_uses > 0 and usage_count > max_uses:
+            raise InvalidRow(f"usage_count {usage_count} exceeds max_uses {max_uses}")
+    elif _truthy(row.get("used")):
+        # Legacy boolean format: a used key has consumed all of its uses
+        usage_count = max_uses if max_uses > 0 else 1
+    else:
+        usage_count = 0
+
+    record = {
+        "secret": secret,
+        "max_uses": max_uses,
+        "usage_count": usage_count,
+        "created_at": _timestamp_field(row, "created_at") or defaults["created_at"]
+    }
+    last_used = _timestamp_field(row, "last_used")
+    if last_used:
+        record["last_used"] = last_used
+    expires_at = _timestamp_field(row, "expires_at")
+    if expires_at:
+        record["expires_at"] = expires_at
+    if row.get("ttl_after_first_use") not in (None, ""):
+        ttl = _int_field(row, "ttl_after_first_use", 0)
+        if ttl <= 0:
+            raise InvalidRow(f"ttl_after_first_use must be positive: {ttl}")
+        record["ttl_after_first_use"] = ttl
+        first_used_at = _timestamp_field(row, "first_used_at")
+        if first_used_at:
+            record["first_used_at"] = first_used_at
+    return key, record
+
+def _read_csv(stream: IO[str]) -> Iterator[Dict[str, Any]]:
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or "key" not in reader.fieldnames:
+        raise SystemExit("❌ CSV input needs a header row with a 'key' column")
+    yield from reader
+
+def _read_jsonl(stream: IO[str]) -> Iterator[Dict[str, Any]]:
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"__error__": f"invalid JSON: {e}"}
+            continue
+        yield _row(row)
+
+def _row(value) -> Dict[str, Any]:
+    """One parsed JSON value as an input row: an object of fields or a bare key string"""
+    if isinstance(value, str):
+        return {"key": value}
+    if isinstance(value, dict):
+        return value
+    return {"__error__": "expected an object or a key string"}
+
+def _read_json(stream: IO[str]) -> Iterator[Dict[str, Any]]:
+    data = json.load(stream)
+    if isinstance(data, dict):
+        for key, fields in data.items():
+            if isinstance(fields, dict):
+                yield dict(fields, key=key)
+            else:
+                yield {"key": key, "__error__": f"expected an object of key fields for {key!r}"}
+    elif isinstance(data, list):
+        for value in data:
+            yield _row(value)
+    else:
+        yield {"__error__": "expected an object of keys or a list of keys"}
+
+READERS = {"csv": _read_csv, "jsonl": _read_jsonl, "json": _read_json}
+
+def detect_format(path: str) -> str:
+    if path.endswith(".csv"):
+        return "csv"
+    if path.endswith(".json"):
+        return "json"
+    return "jsonl"
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    return open(path, mode, newline="" if path.endswith(".csv") else None, encoding="utf-8")
+
+class Progress:
+    """Periodic progress line on stderr"""
+
+    def __init__(self, every: float = 1.0):
+        self.every = every
+        self.started = time.perf_counter()
+        self._last = self.started
+
+    def report(self, message: str, force: bool = False):
+        now = time.perf_counter()
+        if force or now - self._last >= self.every:
+            self._last = now
+            elapsed = now - self.started
+            print(f"⏳ {message} [{elapsed:.1f}s]", file=sys.stderr, flush=True)
+
+def import_keys(path: str, store, fmt: Optional[str] = None, chunk_size: int = 10000,
+                max_uses: int = 1, generate_secrets: bool = False,
+                max_errors_shown: int = 10) -> Dict[str, int]:
+    """
+    Stream keys from a file into a key store
+
+    Args:
+        path: Input file, or "-" for stdin
+        store: Target KeyStore
+        fmt: "csv", "jsonl" or "json"; detected from the extension if omitted
+        chunk_size: Rows per bulk_add commit; 0 buffers the whole input and
+            commits once at the end
+        max_uses: Default usage limit for rows without one
+        generate_secrets: Generate a random secret for rows without one
+
+    Returns:
+        Counts of rows read, keys added, existing keys skipped and invalid rows
+    """
+    fmt = fmt or detect_format(path)
+    defaults = {
+        "max_uses": max_uses,
+        "generate_secrets": generate_secrets,
+        "created_at": utc_timestamp()
+    }
+    stats = {"read": 0, "added": 0, "existing": 0, "invalid": 0}
+    progress = Progress()
+    chunk: Dict[str, KeyRecord] = {}
+
+    def commit():
+        added = store.bulk_add(chunk)
+        stats["added"] += added
+        stats["existing"] += len(chunk) - added
+        chunk.clear()
+
+    with _open(path, "r") as stream:
+        for line_number, row in enumerate(READERS[fmt](stream), start=1):
+            stats["read"] += 1
+            try:
+                if "__error__" in row:
+                    raise InvalidRow(row["__error__"])
+                key, record = build_record(row, defaults)
+            except InvalidRow as e:
+                stats["invalid"] += 1
+                if stats["invalid"] <= max_errors_shown:
+                    print(f"⚠️  Row {line_number}: {e}", file=sys.stderr)
+                continue
+            if key in chunk:
+                # Repeated within the chunk; the first occurrence wins, like a key already stored
+                stats["existing"] += 1
+                continue
+            chunk[key] = record
+            if chunk_size and len(chunk) >= chunk_size:
+                commit()
+            progress.report(f"{stats['read']} read, {stats['added']} added, "
+                            f"{stats['existing']} existing, {stats['invalid']} invalid")
+    if chunk:
+        commit()
+    progress.report(f"{stats['read']} read, {stats['added']} added, "
+                    f"{stats['existing']} existing, {stats['invalid']} invalid", force=True)
+    return stats
+
+def export_keys(path: str, store, fmt: Optional[str] = None) -> int:
+    """Stream every key in the store to a CSV or JSON Lines file; returns the count"""
+    fmt = fmt or detect_format(path)
+    if fmt not in ("csv", "jsonl"):
+        raise SystemExit("❌ Export supports csv and jsonl")
+    progress = Progress()
+    count = 0
+    with _open(path, "w") as stream:
+        writer = csv.DictWriter(stream, fieldnames=FIELDS) if fmt == "csv" else None
+        if writer:
+            writer.writeheader()
+        for key, record in store.items():
+            row = {"key": key, **{field: record.get(field) for field in FIELDS[1:]}}
+            if writer:
+                writer.writerow(row)
+            else:
+                stream.write(json.dumps(row) + "\n")
+            count += 1
+            progress.report(f"{count} exported")
+    progress.report(f"{count} exported", force=True)
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["json", "snapshot", "sqlite", "sqlalchemy"],
+                        help="key store backend (default: KEY_STORE_BACKEND or json)")
+    parser.add_argument("--url", help="key store file or database URL (default: KEY_STORE_URL)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="import keys from CSV, JSON Lines or JSON")
+    import_parser.add_argument("path", help="input file, or - for stdin")
+    import_parser.add_argument("--format", choices=sorted(READERS))
+    import_parser.add_argument("--chunk-size", type=int,
+                               help="rows per commit, 0 to buffer the input and commit once "
+                                    "(default: 0 for json/snapshot, which rewrite the file per commit)")
+    import_parser.add_argument("--max-uses", type=int, default=1, help="default usage limit (-1 for unlimited)")
+    import_parser.add_argument("--generate-secrets", action="store_true",
+                               help="generate a random secret for rows without one")
+
+    export_parser = commands.add_parser("export", help="export keys to CSV or JSON Lines")
+    export_parser.add_argument("path", help="output file, or - for stdout")
+    export_parser.add_argument("--format", choices=["csv", "jsonl"])
+
+    args = parser.parse_args(argv)
+    store = create_key_store(args.backend, args.url)
+
+    if args.command == "import":
+        chunk_size = args.chunk_size
+        if chunk_size is None:
+            chunk_size = DEFAULT_CHUNK_SIZES.get(store.backend, 10000)
+        started = time.perf_counter()
+        stats = import_keys(args.path, store, args.format, chunk_size, args.max_uses, args.generate_secrets)
+        elapsed = time.perf_counter() - started
+        print(f"✅ Imported {stats['added']} keys in {elapsed:.2f}s "
+              f"({stats['read']} rows read, {stats['existing']} already existed, {stats['invalid']} invalid)")
+        return 1 if stats["invalid"] else 0
+
+    count = export_keys(args.path, store, args.format)
+    if args.path != "-":
+        print(f"✅ Exported {count} keys to {args.path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,82 @@
 """
-DEPRECATED: This email-based 2FA code fetching functionality has been replaced
-with a key-based TOTP (Time-based One-Time Password) generation system.
+Verification codes from email, the fallback code source for accounts whose
+codes still arrive by mail rather than from a TOTP key (totp_generator.py)
 
-The new system uses totp_generator.py to generate TOTP codes using secret keys
-instead of fetching codes from email inboxes.
+Every account in ACCOUNTS keeps a small pool of logged-in IMAP connections
+(IMAPPool), so a lookup does not pay for a TLS handshake and login each
+time. get_latest_chatgpt_code() searches every folder of every account at
+once, one pooled connection per folder, and returns the first code found:
+a lookup takes as long as the slowest folder, not the sum of all of them.
+Connections the server has dropped are noticed (NOOP after sitting idle,
+or an abort mid-command) and replaced with a fresh login.
 
-This file is kept for reference but is no longer used in the application.
+Messages are not downloaded whole: fetch_message() reads the
+BODYSTRUCTURE and the Subject/Date headers, then only the text/plain part
+(or text/html when there is none), at most EMAIL_BODY_LIMIT bytes of it.
+Attachments and inline images are never transferred.
+
+Only the message whose code is returned is marked \\Seen. A code that a
+slower folder finds after another folder has already answered stays
+unread for the next lookup.
+
+With an email_watcher.EmailWatcher started in this process, lookups read
+the codes its IDLE sessions have already collected and do not search at all.
+Both paths record every code they return in `handed_out`, by account,
+folder and UID, and skip emails already recorded there. A search while the
+watcher reconnects therefore never returns a code the watcher handed out
+before its \\Seen flag landed, and the watcher never returns one a search
+already returned.
+
+Credentials are never in source: ACCOUNTS reads them from EMAIL_ACCOUNT /
+EMAIL_PASSWORD (Gmail) and HOSTINGER_EMAIL_ACCOUNT /
+HOSTINGER_EMAIL_PASSWORD. Accounts without them are skipped, and a lookup
+with no account configured raises RuntimeError.
+
+Knobs:
+    EMAIL_ACCOUNTS_FILE   JSON list of accounts replacing ACCOUNTS, e.g. a
+                          local stand-in server (benchmarks/imap_server.py)
+                          with "IMAP_SSL": false
+    EMAIL_POOL_SIZE       connections per account (default: one per folder)
+    EMAIL_IMAP_TIMEOUT    socket timeout per connection, seconds (default 10)
+    EMAIL_POOL_IDLE_CHECK check a connection idle this long before reuse (default 60)
+    EMAIL_SEARCH_TIMEOUT  give up on a lookup after this many seconds (default 30)
+    EMAIL_WORKERS         folders searched at once over all accounts (default 16)
+    EMAIL_BODY_LIMIT      bytes of a text part fetched at most (default 65536)
 """
 
 import imaplib
 import email
 from email.header import decode_header
+import atexit
+import binascii
+import itertools
+import json
+import quopri
 import re
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from contextlib import contextmanager
+from email.message import Message
+from typing import Any, Dict, List, Optional, Tuple
 
-# Email account configurations
+# Email account configurations; credentials come from the environment only
 ACCOUNTS = [
     {
         "label": "Gmail",
         "IMAP_SERVER": "imap.gmail.com",
         "IMAP_PORT": 993,
-        "EMAIL_ACCOUNT": os.getenv("EMAIL_ACCOUNT", "gaming.queue123@gmail.com"),
-        "EMAIL_PASSWORD": os.getenv("EMAIL_PASSWORD", "qedv ienj pmmg nhyc"),
+        "EMAIL_ACCOUNT": os.getenv("EMAIL_ACCOUNT"),
+        # An app password when 2FA is enabled
+        "EMAIL_PASSWORD": os.getenv("EMAIL_PASSWORD"),
     },
     {
         "label": "Hostinger",
         "IMAP_SERVER": "imap.hostinger.com",
         "IMAP_PORT": 993,
-        "EMAIL_ACCOUNT": "contact@conexzo.com",
-        "EMAIL_PASSWORD": "Blikk@123444",
+        "EMAIL_ACCOUNT": os.getenv("HOSTINGER_EMAIL_ACCOUNT"),
+        "EMAIL_PASSWORD": os.getenv("HOSTINGER_EMAIL_PASSWORD"),
     },
 ]
 
@@ -39,91 +87,496 @@ VERIFICATION_PHRASES = [
     "enter this code to verify it's you",
 ]
 
+SEARCH_CRITERIA = '(UNSEEN FROM "openai.com")'
+
+# Phrases are found with substring tests on the lowercased text and only
+# the code is a pattern. A single alternation regex for both saves about a
+# microsecond on a typical body but is ~60x slower on a long one without a
+# phrase, as CPython's re has no multi-string search (benchmarks/email_parse.py)
+CODE_PATTERN = re.compile(r"\b\d{6}\b")
+HTML_TAG = re.compile('<[^<]+?>')
+# Style sheets are full of six-digit colours that would pass for a code
+HTML_NOISE = re.compile(r"<(style|script)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+
+POOL_SIZE = int(os.environ.get("EMAIL_POOL_SIZE", "0"))
+IMAP_TIMEOUT = float(os.environ.get("EMAIL_IMAP_TIMEOUT", "10"))
+IDLE_CHECK = float(os.environ.get("EMAIL_POOL_IDLE_CHECK", "60"))
+SEARCH_TIMEOUT = float(os.environ.get("EMAIL_SEARCH_TIMEOUT", "30"))
+WORKERS = int(os.environ.get("EMAIL_WORKERS", "16"))
+# Seconds a code stays usable after its email was sent (see email_watcher.py)
+CODE_TTL = float(os.environ.get("EMAIL_CODE_TTL", "600"))
+BODY_LIMIT = int(os.environ.get("EMAIL_BODY_LIMIT", "65536"))
+
+# Fetched with the BODYSTRUCTURE, for logging and the watcher's expiry
+HEADER_ITEM = "BODY.PEEK[HEADER.FIELDS (SUBJECT DATE)]"
+
+# A dropped connection: replace it rather than put it back in the pool
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError)
+
+def load_accounts() -> List[Dict]:
+    """
+    The accounts in EMAIL_ACCOUNTS_FILE when set, otherwise those in
+    ACCOUNTS whose credentials are in the environment
+
+    Raises RuntimeError if no account has credentials, so nothing ever
+    logs in without them.
+    """
+    path = os.environ.get("EMAIL_ACCOUNTS_FILE")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            accounts = json.load(f)
+    else:
+        accounts = ACCOUNTS
+    configured = [account for account in accounts
+                  if account.get("EMAIL_ACCOUNT") and account.get("EMAIL_PASSWORD")]
+    if not configured:
+        raise RuntimeError("No email account credentials: set EMAIL_ACCOUNT/EMAIL_PASSWORD, "
+                           "HOSTINGER_EMAIL_ACCOUNT/HOSTINGER_EMAIL_PASSWORD or EMAIL_ACCOUNTS_FILE")
+    return configured
+
+def account_folders(account) -> List[str]:
+    if account.get("FOLDERS"):
+        return account["FOLDERS"]
+    return ["inbox", "[Gmail]/Spam", "Junk"] if account["label"] == "Gmail" else ["inbox", "Spam", "Junk"]
+
 def extract_code_from_text(text):
     lower_text = text.lower()
     if any(phrase in lower_text for phrase in VERIFICATION_PHRASES):
-        match = re.search(r"\b\d{6}\b", text)
+        match = CODE_PATTERN.search(text)
         if match:
             return match.group(0)
     return None
 
-def check_account_for_code(account):
+def html_to_text(html: str) -> str:
+    return HTML_TAG.sub(' ', HTML_NOISE.sub(' ', html))
+
+def message_text(msg) -> str:
+    """The plain-text body of a message, or its HTML body with the tags stripped"""
+    body = ""
+    if msg.is_multipart():
+        for part in msg.walk():
+            if part.get_content_type() == "text/plain" and "attachment" not in str(part.get("Content-Disposition")):
+                body = part.get_payload(decode=True).decode(errors="ignore")
+                break
+    else:
+        body = msg.get_payload(decode=True).decode(errors="ignore")
+        if msg.get_content_type() == "text/html":
+            body = html_to_text(body)
+
+    # Fallback to HTML if plain not found
+    if not body.strip():
+        for part in msg.walk():
+            if part.get_content_type() == "text/html":
+                html_body = part.get_payload(decode=True).decode(errors="ignore")
+                body = html_to_text(html_body)
+                break
+    return body
+
+def connect(account, timeout: float = IMAP_TIMEOUT) -> imaplib.IMAP4:
+    """A new logged-in connection to an account"""
+    imap_class = imaplib.IMAP4_SSL if account.get("IMAP_SSL", True) else imaplib.IMAP4
+    mail = imap_class(account["IMAP_SERVER"], account["IMAP_PORT"], timeout=timeout)
     try:
-        mail = imaplib.IMAP4_SSL(account["IMAP_SERVER"], account["IMAP_PORT"])
         mail.login(account["EMAIL_ACCOUNT"], account["EMAIL_PASSWORD"])
-        
-        folders = ["inbox", "[Gmail]/Spam", "Junk"] if account["label"] == "Gmail" else ["inbox", "Spam", "Junk"]
-        for folder in folders:
+    except BaseException:
+        mail.shutdown()
+        raise
+    return mail
+
+_FETCH_TOKEN = re.compile(rb'(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}\s*$|([^\s()"\[\]]+(?:\[[^\]]*\](?:<\d+>)?)?|\S)')
+
+def _lex(data: bytes, literal: Optional[bytes] = None) -> List[Any]:
+    tokens: List[Any] = []
+    for opened, closed, quoted, size, atom in _FETCH_TOKEN.findall(data):
+        if opened:
+            tokens.append("(")
+        elif closed:
+            tokens.append(")")
+        elif size:
+            # imaplib hands the literal over next to the line announcing it
+            tokens.append(literal)
+        elif atom:
+            text = atom.decode("utf-8", "replace")
+            tokens.append(None if text.upper() == "NIL" else text)
+        else:
+            tokens.append(re.sub(rb"\\(.)", rb"\1", quoted).decode("utf-8", "replace"))
+    return tokens
+
+def parse_fetch_items(data: list) -> Dict[str, Any]:
+    """
+    The data items of FETCH responses, as imaplib returns them, by upper-case name
+
+    Lists become nested lists, NIL None, strings str and literals bytes,
+    e.g. {"BODYSTRUCTURE": [...], "BODY[1]<0>": b"..."}.
+    """
+    tokens: List[Any] = []
+    for piece in data:
+        if isinstance(piece, tuple):
+            tokens.extend(_lex(piece[0], piece[1]))
+        elif piece:
+            tokens.extend(_lex(piece))
+    stack: List[list] = [[]]
+    for token in tokens:
+        if token == "(":
+            stack.append([])
+        elif token == ")" and len(stack) > 1:
+            inner = stack.pop()
+            stack[-1].append(inner)
+        else:
+            stack[-1].append(token)
+    items: Dict[str, Any] = {}
+    # Each response is a message number followed by its (name value ...) list
+    for response in stack[0]:
+        if isinstance(response, list):
+            for index in range(0, len(response) - 1, 2):
+                if isinstance(response[index], str):
+                    items[response[index].upper()] = response[index + 1]
+    return items
+
+def _text_parts(structure: list, prefix: str = ""):
+    """(section, subtype, encoding, charset, is_attachment) of every text part of a BODYSTRUCTURE"""
+    if structure and isinstance(structure[0], list):
+        # A multipart: its parts, then the subtype and extension fields
+        for number, part in enumerate(itertools.takewhile(lambda item: isinstance(item, list), structure), 1):
+            yield from _text_parts(part, f"{prefix}{number}.")
+        return
+    if len(structure) < 7 or str(structure[0]).lower() != "text":
+        return
+    params = structure[2] if isinstance(structure[2], list) else []
+    charset = next((params[i + 1] for i in range(0, len(params) - 1, 2)
+                    if str(params[i]).lower() == "charset"), None)
+    # text parts: type subtype params id description encoding size lines md5 disposition ...
+    disposition = structure[9] if len(structure) > 9 else None
+    is_attachment = isinstance(disposition, list) and str(disposition[0]).lower() == "attachment"
+    yield prefix[:-1] or "1", str(structure[1]).lower(), structure[5], charset, is_attachment
+
+def decode_part(data: bytes, encoding: Optional[str], charset: Optional[str]) -> str:
+    """Text of a (possibly truncated) transfer-encoded part"""
+    encoding = (encoding or "7bit").lower()
+    if encoding == "base64":
+        compact = re.sub(rb"\s+", b"", data)
+        # A truncated fetch can end mid-quantum
+        data = binascii.a2b_base64(compact[:len(compact) // 4 * 4])
+    elif encoding == "quoted-printable":
+        data = quopri.decodestring(data)
+    try:
+        return data.decode(charset or "utf-8", errors="ignore")
+    except LookupError:
+        return data.decode("utf-8", errors="ignore")
+
+def fetch_message(mail: imaplib.IMAP4, message_id, uid: bool = False) -> Tuple[Message, str]:
+    """
+    The Subject and Date headers and the text body of one message
+
+    One round trip for the BODYSTRUCTURE and headers, then one for the
+    first text/plain part that is not an attachment (or, failing that, the
+    first text/html part, tags stripped), fetched with BODY.PEEK and capped
+    at BODY_LIMIT bytes. Neither marks the message \\Seen. If the structure
+    can't be read, the whole message is fetched as before.
+    """
+    def fetch(items: str):
+        if uid:
+            return mail.uid("FETCH", str(message_id), items)
+        return mail.fetch(message_id, items)
+
+    try:
+        status, data = fetch(f"(BODYSTRUCTURE {HEADER_ITEM})")
+    except imaplib.IMAP4.abort:
+        raise
+    except imaplib.IMAP4.error:
+        # A server that rejects the request (BAD) gets the whole-message fetch
+        status, data = "NO", []
+    items = parse_fetch_items(data) if status == "OK" else {}
+    structure = items.get("BODYSTRUCTURE")
+    if not isinstance(structure, list):
+        status, data = fetch("(BODY.PEEK[])")
+        raw = next((part[1] for part in data if isinstance(part, tuple)), b"")
+        msg = email.message_from_bytes(raw)
+        return msg, message_text(msg)
+    header = next((value for name, value in items.items() if name.startswith("BODY[HEADER")), b"")
+    headers = email.message_from_bytes(header if isinstance(header, bytes) else str(header or "").encode())
+
+    parts = list(_text_parts(structure))
+    plain = next((part for part in parts if part[1] == "plain" and not part[4]), None)
+    html = next((part for part in parts if part[1] == "html"), None)
+    for part in (plain, html):
+        if part is None:
+            continue
+        section, subtype, encoding, charset, _ = part
+        status, data = fetch(f"(BODY.PEEK[{section}]<0.{BODY_LIMIT}>)")
+        body = next((value for name, value in parse_fetch_items(data).items()
+                     if name.startswith(f"BODY[{section}]")), None) if status == "OK" else None
+        if body is None:
+            continue
+        text = decode_part(body if isinstance(body, bytes) else body.encode(), encoding, charset)
+        if subtype == "html":
+            text = html_to_text(text)
+        if text.strip():
+            return headers, text
+    return headers, ""
+
+class IMAPPool:
+    """Logged-in IMAP connections to one account, reused across lookups"""
+
+    def __init__(self, account, size: Optional[int] = None, timeout: float = IMAP_TIMEOUT):
+        self.account = account
+        self.size = size or POOL_SIZE or len(account_folders(account))
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        # (connection, monotonic time it was last handed back)
+        self._idle: List[tuple] = []
+
+    def _connect(self) -> imaplib.IMAP4:
+        return connect(self.account, self.timeout)
+
+    def _checkout(self) -> imaplib.IMAP4:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                mail, since = self._idle.pop()
+            if time.monotonic() - since < IDLE_CHECK:
+                return mail
+            try:
+                mail.noop()
+                return mail
+            except (imaplib.IMAP4.error, OSError):
+                self._close(mail)
+        return self._connect()
+
+    @staticmethod
+    def _close(mail: imaplib.IMAP4):
+        try:
+            mail.shutdown()
+        except OSError:
+            pass
+
+    @contextmanager
+    def connection(self, fresh: bool = False):
+        """
+        A logged-in connection for the duration of the block; at most `size`
+        are out at once. `fresh` skips the idle ones for a new login.
+        """
+        self._slots.acquire()
+        try:
+            mail = self._connect() if fresh else self._checkout()
             try:
-                mail.select(folder, readonly=False)
-                status, messages = mail.search(None, '(UNSEEN FROM "openai.com")')
-                if status != "OK":
-                    print(f"[{account['label']}] Failed to search emails in {folder}.")
-                    continue
-
-                email_ids = messages[0].split()
-                if not email_ids:
-                    print(f"[{account['label']}] No unread emails found in {folder}.")
-                    continue
-
-                latest_email_id = email_ids[-1]
-                res, msg_data = mail.fetch(latest_email_id, "(RFC822)")
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        subject, encoding = decode_header(msg["Subject"])[0]
-                        subject = subject.decode(encoding or "utf-8") if isinstance(subject, bytes) else subject
-                        print(f"[{account['label']}] Processing email with subject: {subject}")
-
-                        body = ""
-                        if msg.is_multipart():
-                            for part in msg.walk():
-                                if part.get_content_type() == "text/plain" and "attachment" not in str(part.get("Content-Disposition")):
-                                    body = part.get_payload(decode=True).decode(errors="ignore")
-                                    break
-                        else:
-                            body = msg.get_payload(decode=True).decode(errors="ignore")
-
-                        # Fallback to HTML if plain not found
-                        if not body.strip():
-                            for part in msg.walk():
-                                if part.get_content_type() == "text/html":
-                                    html_body = part.get_payload(decode=True).decode(errors="ignore")
-                                    body = re.sub('<[^<]+?>', ' ', html_body)
-                                    break
-
-                        code = extract_code_from_text(body)
-                        if code:
-                            print(f"[{account['label']}] Verification code found: {code}")
-                            mail.store(latest_email_id, '+FLAGS', '\\Seen')
-                            mail.logout()
-                            return code
-                        else:
-                            print(f"[{account['label']}] No valid code found in: {body[:300]}...")
-
-                mail.store(latest_email_id, '+FLAGS', '\\Seen')
-
-            except Exception as e:
-                print(f"[{account['label']}] Could not access folder {folder}: {e}")
-                continue
-
-        mail.logout()
+                yield mail
+            except CONNECTION_ERRORS:
+                self._close(mail)
+                raise
+            except BaseException:
+                self._checkin(mail)
+                raise
+            self._checkin(mail)
+        finally:
+            self._slots.release()
+
+    def _checkin(self, mail: imaplib.IMAP4):
+        with self._lock:
+            self._idle.append((mail, time.monotonic()))
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for mail, _ in idle:
+            try:
+                mail.logout()
+            except (imaplib.IMAP4.error, OSError):
+                self._close(mail)
+
+class _Claim:
+    """Lets exactly one folder search hand back (and mark \\Seen) its code"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.taken = False
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.taken:
+                return False
+            self.taken = True
+            return True
+
+class HandedOut:
+    """
+    Emails whose code has been handed out, by (account label, folder, UID)
+
+    Shared by the folder search and the watcher's inbox. Whichever returns
+    a code records its email here first, and an email already recorded is
+    skipped. Entries are forgotten `ttl` seconds after they were recorded;
+    by then the email is \\Seen and its code expired.
+    """
+
+    def __init__(self, ttl: float = CODE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sources: Dict[tuple, float] = {}
+
+    def claim(self, source: tuple, now: Optional[float] = None) -> bool:
+        """Record a code as handed out; False if it already was"""
+        now = time.time() if now is None else now
+        with self._lock:
+            cutoff = now - self.ttl
+            for expired in [source for source, recorded in self._sources.items() if recorded <= cutoff]:
+                del self._sources[expired]
+            if source in self._sources:
+                return False
+            self._sources[source] = now
+            return True
+
+    def release(self, source: tuple):
+        """Undo a claim whose code was not returned after all"""
+        with self._lock:
+            self._sources.pop(source, None)
+
+handed_out = HandedOut()
+
+# The running email_watcher.EmailWatcher, if any: lookups take codes from its inbox
+watcher = None
+
+_pools: Dict[tuple, IMAPPool] = {}
+_pools_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+def get_pool(account) -> IMAPPool:
+    """The shared pool for an account, created on first use"""
+    identity = (account["IMAP_SERVER"], account["IMAP_PORT"], account["EMAIL_ACCOUNT"])
+    with _pools_lock:
+        pool = _pools.get(identity)
+        if pool is None:
+            pool = _pools[identity] = IMAPPool(account)
+        return pool
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _pools_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="imap")
+        return _executor
+
+@atexit.register
+def close_pools():
+    """Log out of every pooled connection"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+def _search_folder(mail: imaplib.IMAP4, label: str, folder: str, claim: _Claim) -> Optional[str]:
+    try:
+        status, _ = mail.select(folder, readonly=False)
+    except imaplib.IMAP4.abort:
+        raise
+    except imaplib.IMAP4.error as e:
+        print(f"[{label}] Could not access folder {folder}: {e}")
+        return None
+    if status != "OK":
+        print(f"[{label}] Could not access folder {folder}.")
+        return None
+    status, messages = mail.uid("SEARCH", None, SEARCH_CRITERIA)
+    if status != "OK":
+        print(f"[{label}] Failed to search emails in {folder}.")
         return None
 
-    except Exception as e:
-        print(f"[{account['label']}] Error: {e}")
+    email_ids = messages[0].split()
+    if not email_ids:
+        print(f"[{label}] No unread emails found in {folder}.")
         return None
 
-def get_latest_chatgpt_code():
-    for account in ACCOUNTS:
-        code = check_account_for_code(account)
-        if code:
-            return code
+    # UIDs, not sequence numbers, so the watcher names the same email alike
+    latest_uid = int(email_ids[-1])
+    # The message stays unread unless its code is the one returned
+    headers, body = fetch_message(mail, latest_uid, uid=True)
+    subject, encoding = decode_header(headers["Subject"] or "")[0]
+    subject = subject.decode(encoding or "utf-8") if isinstance(subject, bytes) else subject
+    print(f"[{label}] Processing email with subject: {subject}")
+
+    code = extract_code_from_text(body)
+    if code:
+        source = (label, folder, latest_uid)
+        if not handed_out.claim(source):
+            # The watcher returned it and is still marking it \\Seen
+            print(f"[{label}] Code in {folder} was already handed out")
+            return None
+        if not claim.take():
+            handed_out.release(source)
+            return None
+        print(f"[{label}] Verification code found: {code}")
+        mail.uid("STORE", str(latest_uid), '+FLAGS', '\\Seen')
+        return code
+    else:
+        print(f"[{label}] No valid code found in: {body[:300]}...")
+
+    mail.uid("STORE", str(latest_uid), '+FLAGS', '\\Seen')
+    return None
+
+def check_folder(pool: IMAPPool, folder: str, claim: Optional[_Claim] = None) -> Optional[str]:
+    """
+    The code in the latest unread OpenAI email of one folder, or None
+
+    A pooled connection that turns out to be dead is replaced and the
+    search retried once.
+    """
+    label = pool.account["label"]
+    claim = claim or _Claim()
+    for attempt in range(2):
+        if claim.taken:
+            return None
+        try:
+            # The retry logs in afresh: the other idle connections likely dropped too
+            with pool.connection(fresh=attempt > 0) as mail:
+                return _search_folder(mail, label, folder, claim)
+        except CONNECTION_ERRORS as e:
+            if attempt:
+                print(f"[{label}] Error: {e}")
+        except Exception as e:
+            print(f"[{label}] Error: {e}")
+            return None
     return None
 
+def get_latest_chatgpt_code(accounts=None, timeout: Optional[float] = None) -> Optional[str]:
+    """
+    The first verification code found in any folder of any account
+
+    Folders are searched in parallel over pooled connections; the lookup
+    returns as soon as one of them has a code, or None once all are done
+    (or `timeout` seconds, EMAIL_SEARCH_TIMEOUT by default, have passed).
+    While a watcher has a live session on every folder, its inbox answers
+    instead.
+    """
+    if accounts is None and watcher is not None and watcher.connected():
+        return watcher.take_code()
+    accounts = load_accounts() if accounts is None else accounts
+    executor = _get_executor()
+    claim = _Claim()
+    futures = [executor.submit(check_folder, get_pool(account), folder, claim)
+               for account in accounts for folder in account_folders(account)]
+    try:
+        for future in as_completed(futures, timeout=SEARCH_TIMEOUT if timeout is None else timeout):
+            code = future.result()
+            if code:
+                return code
+    except FuturesTimeout:
+        print("Timed out waiting for email folders")
+    finally:
+        # Searches not started yet are dropped; running ones see the claim
+        for future in futures:
+            future.cancel()
+    return None
+
+def check_account_for_code(account):
+    return get_latest_chatgpt_code([account])
+
 if __name__ == "__main__":
-    code = get_latest_chatgpt_code()
+    try:
+        code = get_latest_chatgpt_code()
+    except RuntimeError as e:
+        raise SystemExit(f"Error: {e}")
     if code:
         print(f"Verification code: {code}")
     else:
-        print("No verification code found in Gmail or Hostinger.")
+        print("No verification code found in any account.")
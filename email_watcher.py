@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Push delivery of email verification codes over IMAP IDLE
+
+Rather than searching every folder when a code is requested,
+EmailWatcher keeps an IDLE session open on each folder of every account in
+email_reader (ACCOUNTS, or EMAIL_ACCOUNTS_FILE). The server tells a
+session as soon as a message arrives. The watcher then fetches the new
+unread OpenAI emails, extracts their codes and keeps them in a CodeInbox.
+While every session is connected, email_reader.get_latest_chatgpt_code()
+takes the newest code from the inbox, a dictionary lookup with no network
+round trip. It falls back to searching the folders only while a session is
+reconnecting.
+
+Codes expire from the inbox EMAIL_CODE_TTL seconds (default 600) after
+their email was sent. Each code is handed out once: taking it records it
+in email_reader.handed_out, which the fallback search checks too, and its
+email is then marked \\Seen in the background, so neither a restart nor a
+search returns it again. Codes a search has already returned are skipped.
+The inbox lives in one process, so run the watcher in the process that
+serves email codes.
+
+IDLE is re-issued every EMAIL_IDLE_RENEW seconds (default 1500), below the
+29 minutes after which RFC 2177 lets a server drop it. Servers without
+IDLE are polled every EMAIL_POLL_INTERVAL seconds (default 30). A dropped
+session reconnects with backoff, up to EMAIL_RECONNECT_MAX seconds.
+
+Nothing in this repository serves email codes, so nothing starts the
+watcher on its own. A process that calls get_latest_chatgpt_code() starts
+it once at startup:
+    email_watcher.EmailWatcher().start()
+or run
+    python email_watcher.py
+to print codes as they arrive.
+"""
+
+import argparse
+import email.utils
+import imaplib
+import itertools
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import email_reader
+from email_reader import (CODE_TTL, CONNECTION_ERRORS, IMAP_TIMEOUT, SEARCH_CRITERIA, account_folders,
+                          connect, extract_code_from_text, fetch_message, get_pool, load_accounts)
+
+IDLE_RENEW = float(os.environ.get("EMAIL_IDLE_RENEW", "1500"))
+POLL_INTERVAL = float(os.environ.get("EMAIL_POLL_INTERVAL", "30"))
+RECONNECT_MAX = float(os.environ.get("EMAIL_RECONNECT_MAX", "60"))
+
+class CodeEntry:
+    __slots__ = ("code", "sent_at", "account", "folder", "uid")
+
+    def __init__(self, code: str, sent_at: float, account, folder: str, uid: int):
+        self.code = code
+        self.sent_at = sent_at
+        self.account = account
+        self.folder = folder
+        self.uid = uid
+
+class CodeInbox:
+    """Codes not yet handed out, each forgotten `ttl` seconds after its email was sent"""
+
+    def __init__(self, ttl: float = CODE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (account label, folder, uid) -> entry
+        self._codes: Dict[tuple, CodeEntry] = {}
+
+    def _expire(self, now: float):
+        cutoff = now - self.ttl
+        for source in [source for source, entry in self._codes.items() if entry.sent_at <= cutoff]:
+            del self._codes[source]
+
+    def put(self, entry: CodeEntry, now: Optional[float] = None) -> bool:
+        """Add a code; False if it has already expired or is already here"""
+        now = time.time() if now is None else now
+        source = (entry.account["label"], entry.folder, entry.uid)
+        with self._lock:
+            self._expire(now)
+            if entry.sent_at <= now - self.ttl or source in self._codes:
+                return False
+            self._codes[source] = entry
+            return True
+
+    def take(self, now: Optional[float] = None) -> Optional[CodeEntry]:
+        """Remove and return the most recently sent unexpired code"""
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+            if not self._codes:
+                return None
+            source = max(self._codes, key=lambda source: self._codes[source].sent_at)
+            return self._codes.pop(source)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire(time.time())
+            return len(self._codes)
+
+def _sent_at(msg) -> float:
+    """When the message says it was sent, no later than now"""
+    now = time.time()
+    try:
+        return min(email.utils.parsedate_to_datetime(msg["Date"]).timestamp(), now)
+    except (TypeError, ValueError, IndexError):
+        return now
+
+class FolderWatcher:
+    """One IDLE session on one folder of one account, feeding an inbox"""
+
+    _tags = itertools.count(1)
+
+    def __init__(self, account, folder: str, inbox: CodeInbox,
+                 on_code: Optional[Callable[[CodeEntry], None]] = None, timeout: float = IMAP_TIMEOUT):
+        self.account = account
+        self.folder = folder
+        self.inbox = inbox
+        self.on_code = on_code
+        self.timeout = timeout
+        # Highest UID looked at; kept across reconnects so no code is added twice
+        self.last_uid = 0
+        self.connected = False
+        # The folder does not exist on this account: nothing to watch
+        self.absent = False
+        self._mail: Optional[imaplib.IMAP4] = None
+        self._idling = False
+        self._idle_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def label(self) -> str:
+        return self.account["label"]
+
+    def start(self) -> threading.Thread:
+        self._thread = threading.Thread(target=self._run, name=f"imap-idle-{self.label}-{self.folder}",
+                                        daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._end_idle()
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        delay = 1.0
+        while not self._stop.is_set():
+            try:
+                self._mail = connect(self.account, self.timeout)
+                status, _ = self._mail.select(self.folder, readonly=True)
+                if status != "OK":
+                    print(f"[{self.label}] Could not access folder {self.folder}; not watching it.")
+                    self.absent = True
+                    return
+                delay = 1.0
+                # The inbox is complete only once the codes already waiting are in it
+                self._sync()
+                self.connected = True
+                if "IDLE" in self._mail.capabilities:
+                    self._idle_loop()
+                else:
+                    self._poll_loop()
+            except (imaplib.IMAP4.error, OSError) as e:
+                if not self._stop.is_set():
+                    print(f"[{self.label}] Watching {self.folder} failed: {e}; reconnecting in {delay:.0f}s")
+            finally:
+                self.connected = False
+                self._close()
+            self._stop.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+
+    def _close(self):
+        mail, self._mail = self._mail, None
+        if mail is None:
+            return
+        try:
+            mail.logout()
+        except (imaplib.IMAP4.error, OSError):
+            try:
+                mail.shutdown()
+            except OSError:
+                pass
+
+    def _sync(self):
+        """Read codes from unread OpenAI emails newer than the last one looked at"""
+        mail = self._mail
+        status, data = mail.uid("SEARCH", None, SEARCH_CRITERIA)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"search failed in {self.folder}")
+        uids = [uid for uid in map(int, data[0].split()) if uid > self.last_uid]
+        for uid in uids:
+            headers, body = fetch_message(mail, uid, uid=True)
+            code = extract_code_from_text(body)
+            if code:
+                self._add(CodeEntry(code, _sent_at(headers), self.account, self.folder, uid))
+            self.last_uid = uid
+
+    def _add(self, entry: CodeEntry):
+        if self.inbox.put(entry):
+            print(f"[{self.label}] Verification code arrived in {self.folder}")
+            if self.on_code is not None:
+                self.on_code(entry)
+
+    def _end_idle(self):
+        """Send DONE once for the IDLE in progress, from any thread"""
+        with self._idle_lock:
+            if self._idling and self._mail is not None:
+                self._idling = False
+                self._mail.send(b"DONE\r\n")
+
+    def _idle_loop(self):
+        mail = self._mail
+        while not self._stop.is_set():
+            tag = b"W%d" % next(self._tags)
+            mail.send(tag + b" IDLE\r\n")
+            line = mail.readline()
+            if not line.startswith(b"+"):
+                raise imaplib.IMAP4.error(f"IDLE refused: {line!r}")
+            with self._idle_lock:
+                self._idling = True
+            if self._stop.is_set():
+                self._end_idle()
+            renew = threading.Timer(IDLE_RENEW, self._end_idle)
+            renew.daemon = True
+            renew.start()
+            # Silence longer than the renewal interval means the connection is gone
+            mail.sock.settimeout(IDLE_RENEW + self.timeout)
+            arrived = False
+            try:
+                while True:
+                    line = mail.readline()
+                    if not line or line.startswith(b"* BYE"):
+                        raise imaplib.IMAP4.abort("server closed the IDLE session")
+                    if line.startswith(tag + b" "):
+                        break
+                    if line.startswith(b"* ") and line.rstrip().upper().endswith(b" EXISTS"):
+                        arrived = True
+                        self._end_idle()
+            finally:
+                renew.cancel()
+                with self._idle_lock:
+                    self._idling = False
+                mail.sock.settimeout(self.timeout)
+            if not line.startswith(tag + b" OK"):
+                raise imaplib.IMAP4.error(f"IDLE ended with {line!r}")
+            if arrived:
+                self._sync()
+
+    def _poll_loop(self):
+        while not self._stop.wait(POLL_INTERVAL):
+            self._mail.noop()
+            self._sync()
+
+def mark_seen(entry: CodeEntry):
+    """Flag a handed-out code's email \\Seen over a pooled connection"""
+    try:
+        with get_pool(entry.account).connection() as mail:
+            mail.select(entry.folder)
+            mail.uid("STORE", str(entry.uid), "+FLAGS", "\\Seen")
+    except (imaplib.IMAP4.error, *CONNECTION_ERRORS) as e:
+        print(f"[{entry.account['label']}] Could not mark code email read: {e}")
+
+class EmailWatcher:
+    """IDLE sessions on every folder of every account, sharing one CodeInbox"""
+
+    def __init__(self, accounts=None, ttl: float = CODE_TTL,
+                 on_code: Optional[Callable[[CodeEntry], None]] = None):
+        accounts = load_accounts() if accounts is None else accounts
+        self.inbox = CodeInbox(ttl)
+        self.folders: List[FolderWatcher] = [FolderWatcher(account, folder, self.inbox, on_code)
+                                             for account in accounts for folder in account_folders(account)]
+
+    def start(self):
+        """Start watching; email_reader lookups use this watcher's inbox from now on"""
+        for folder in self.folders:
+            folder.start()
+        email_reader.watcher = self
+
+    def stop(self, timeout: Optional[float] = None):
+        if email_reader.watcher is self:
+            email_reader.watcher = None
+        for folder in self.folders:
+            folder.stop()
+        for folder in self.folders:
+            folder.join(timeout)
+
+    def connected(self) -> bool:
+        """Whether every folder that exists has a live session, i.e. the inbox is complete"""
+        return all(folder.connected or folder.absent for folder in self.folders)
+
+    def take_code(self) -> Optional[str]:
+        """The newest unexpired code, handed out once; its email is marked \\Seen in the background"""
+        while True:
+            entry = self.inbox.take()
+            if entry is None:
+                return None
+            # A search during a reconnect may have returned it already
+            if email_reader.handed_out.claim((entry.account["label"], entry.folder, entry.uid)):
+                break
+        email_reader._get_executor().submit(mark_seen, entry)
+        return entry.code
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ttl", type=float, default=CODE_TTL, help="seconds a code stays available")
+    args = parser.parse_args(argv)
+
+    try:
+        watcher = EmailWatcher(ttl=args.ttl, on_code=lambda entry: print(f"🔐 {entry.code}"))
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    watcher.start()
+    print(f"👀 Watching {len(watcher.folders)} folders; Ctrl-C to stop", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        watcher.stop(timeout=5)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
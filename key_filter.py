@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Bloom filter over the key set, for rejecting unknown keys without reading records
+
+Most hostile traffic names keys that do not exist. KeyFilter keeps a Bloom
+filter of every key in a store so those lookups are answered from memory
+in a few microseconds, before the store is touched. A Bloom filter has no
+false negatives, so "absent" is final; "maybe present" falls through to
+the store as before.
+
+Keeping the filter complete:
+- keys added through this process's store are added immediately
+- keys added by other processes: the store's membership_version() (a stat
+  or a one-row read) is compared with the version the filter was built
+  from at most once every `refresh_interval` seconds (KEY_FILTER_REFRESH).
+  When it has changed the filter is rebuilt in the background, and misses
+  fall through to the store until the new filter is in place. Between two
+  checks a miss is rejected without touching the store, so a key added by
+  another process can be refused for up to `refresh_interval` seconds
+  after it was added. With KEY_FILTER_REFRESH=0 the version is checked on
+  every miss and the filter rebuilt in line, which closes that window at
+  the cost of one version read per unknown key
+- deleted keys stay in the filter as harmless false positives until the
+  next rebuild
+
+Usage (memory footprint report for the configured store):
+    python key_filter.py [--error-rate 0.001]
+"""
+
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from metrics import Counter, GaugeFunction
+
+KEY_FILTER_LOOKUPS = Counter("keyapi_key_filter_lookups_total",
+                             "Key filter checks by result (rejected, passed)", ("result",))
+_rejected = KEY_FILTER_LOOKUPS.labels(result="rejected")
+_passed = KEY_FILTER_LOOKUPS.labels(result="passed")
+
+# Rebuild once this share of the filter's keys have been deleted
+STALE_REBUILD_RATIO = 0.1
+# Spare room at rebuild so in-process adds do not immediately degrade it
+HEADROOM = 1.25
+MIN_CAPACITY = 1024
+
+class BloomFilter:
+    """Fixed-size Bloom filter sized for `capacity` keys at `error_rate`"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    # The filter never leaves this process, so Python's own (per-process
+    # seeded, SipHash) string hash can be used: it is computed once per str
+    # object and cached, which makes a lookup several times cheaper than
+    # hashing with hashlib. Double hashing (Kirsch-Mitzenmacher) derives all
+    # k positions from its two 32-bit halves.
+
+    def add(self, key: str):
+        bits, m = self.bits, self.num_bits
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        for _ in range(self.num_hashes):
+            position = h1 % m
+            bits[position >> 3] |= 1 << (position & 7)
+            h1 += h2
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits, m = self.bits, self.num_bits
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        for _ in range(self.num_hashes):
+            position = h1 % m
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            h1 += h2
+        return True
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+    def estimated_error_rate(self) -> float:
+        """False-positive rate implied by the share of bits currently set"""
+        fill = int.from_bytes(self.bits, "little").bit_count() / self.num_bits
+        return fill ** self.num_hashes
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "keys": self.count,
+            "capacity": self.capacity,
+            "bits": self.num_bits,
+            "hashes": self.num_hashes,
+            "memory_bytes": self.memory_bytes,
+            "bytes_per_key": round(self.memory_bytes / max(1, self.count), 2),
+            "target_error_rate": self.error_rate,
+            "estimated_error_rate": round(self.estimated_error_rate(), 6),
+        }
+
+class KeyFilter:
+    """Bloom filter kept in step with one KeyStore"""
+
+    def __init__(self, store, error_rate: float = 0.001, refresh_interval: float = 1.0):
+        self.store = store
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self._filter: Optional[BloomFilter] = None
+        self._version = None
+        self._next_check = 0.0
+        self._deleted = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._pending: Optional[List[str]] = None
+        self._rebuilding = False
+
+    def might_contain(self, key: str) -> bool:
+        """
+        False if `key` is not in the store
+
+        Keys added by other processes are seen within `refresh_interval`
+        seconds; until then they may be reported absent.
+        """
+        bloom = self._filter
+        if bloom is None or (self.refresh_interval > 0 and time.monotonic() >= self._next_check):
+            bloom = self._refresh()
+            if bloom is None:
+                # Being built by another thread; let the store answer
+                _passed.inc()
+                return True
+        if key in bloom:
+            _passed.inc()
+            return True
+        if self.refresh_interval <= 0:
+            # No staleness allowed: confirm the filter is current before rejecting
+            version = self.store.membership_version()
+            if version is None or version != self._version:
+                bloom = self._refresh()
+                if bloom is None or key in bloom or version != self._version:
+                    _passed.inc()
+                    return True
+        elif self._version is None or self._rebuilding:
+            # Known to be stale; let the store answer until the rebuild lands
+            _passed.inc()
+            return True
+        _rejected.inc()
+        return False
+
+    def add(self, keys: Iterable[str]):
+        """Record keys just added to the store by this process"""
+        with self._lock:
+            keys = list(keys)
+            if self._pending is not None:
+                self._pending.extend(keys)
+            if self._filter is not None:
+                for key in keys:
+                    self._filter.add(key)
+                if self._filter.count > self._filter.capacity:
+                    self._expire()
+
+    def discard(self, key: str):
+        """Record a deletion; the key stays a false positive until the next rebuild"""
+        with self._lock:
+            self._deleted += 1
+            if self._filter is not None and self._deleted > self._filter.count * STALE_REBUILD_RATIO:
+                self._expire()
+
+    def _expire(self):
+        self._version = None
+        self._next_check = 0.0
+
+    def _refresh(self) -> Optional[BloomFilter]:
+        if not self._build_lock.acquire(blocking=False):
+            return self._filter
+        background = False
+        try:
+            self._next_check = time.monotonic() + self.refresh_interval
+            version = self.store.membership_version()
+            if self._filter is not None and version is not None and version == self._version:
+                return self._filter
+            if self._filter is None or self.refresh_interval <= 0:
+                self.rebuild(version)
+                return self._filter
+            # Rebuilding a large store takes seconds; keep answering from the
+            # current filter meanwhile rather than stalling this request
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, args=(version,),
+                             name="key-filter-rebuild", daemon=True).start()
+            background = True
+            return self._filter
+        finally:
+            if not background:
+                self._build_lock.release()
+
+    def _rebuild_in_background(self, version):
+        try:
+            self.rebuild(version)
+        except Exception as e:
+            print(f"Error rebuilding key filter: {e}")
+        finally:
+            self._rebuilding = False
+            self._build_lock.release()
+
+    def rebuild(self, version=None):
+        """Build a fresh filter from every key in the store"""
+        with self._lock:
+            self._pending = []
+        count = self.store.count()
+        bloom = BloomFilter(max(MIN_CAPACITY, int(count * HEADROOM)), self.error_rate)
+        for key, _ in self.store.items():
+            bloom.add(key)
+        with self._lock:
+            for key in self._pending:
+                bloom.add(key)
+            self._pending = None
+            self._filter = bloom
+            self._version = version
+            self._deleted = 0
+
+    def report(self) -> Dict[str, Any]:
+        """Memory footprint and accuracy of the current filter"""
+        bloom = self._filter
+        if bloom is None:
+            self._refresh()
+            bloom = self._filter
+        return dict(bloom.report(), backend=self.store.backend)
+
+def filter_from_env(store) -> Optional[KeyFilter]:
+    """
+    Build the KeyFilter for `store` described by the environment
+
+    KEY_FILTER ("bloom" or "off"), KEY_FILTER_ERROR_RATE (default 0.001)
+    and KEY_FILTER_REFRESH (seconds between membership checks, default 1;
+    also the longest a key added by another process can be rejected).
+    """
+    if os.environ.get("KEY_FILTER", "bloom") == "off":
+        return None
+    return KeyFilter(
+        store,
+        error_rate=float(os.environ.get("KEY_FILTER_ERROR_RATE", "0.001")),
+        refresh_interval=float(os.environ.get("KEY_FILTER_REFRESH", "1")),
+    )
+
+def _filter_bytes() -> int:
+    from key_store import get_key_store
+
+    key_filter = get_key_store().key_filter
+    return key_filter._filter.memory_bytes if key_filter is not None and key_filter._filter is not None else 0
+
+GaugeFunction("keyapi_key_filter_bytes", "Memory used by the key Bloom filter", _filter_bytes)
+
+def main(argv=None):
+    from key_store import create_key_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", help="key store backend (default: KEY_STORE_BACKEND or json)")
+    parser.add_argument("--url", help="key store path or URL (default: KEY_STORE_URL)")
+    parser.add_argument("--error-rate", type=float, default=float(os.environ.get("KEY_FILTER_ERROR_RATE", "0.001")))
+    args = parser.parse_args(argv)
+
+    store = create_key_store(args.backend, args.url)
+    key_filter = KeyFilter(store, error_rate=args.error_rate)
+    started = time.perf_counter()
+    key_filter.rebuild(store.membership_version())
+    build_s = time.perf_counter() - started
+
+    print("🔎 Key filter report")
+    print("=" * 30)
+    for name, value in key_filter.report().items():
+        print(f"{name:>22}: {value}")
+    print(f"{'build_s':>22}: {build_s:.3f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Secondary indexes over a KeyTable: status, created_at and last_used
+
+Answers admin questions such as "depleted keys", "keys created in this
+batch" or "keys not used in 30 days" without materializing a record or
+parsing a timestamp per key. Each index is a row array sorted by an integer
+value (the key_table timestamp encoding, or a status code), so a query is
+two binary searches and a slice.
+
+Usage changes after the build are tracked incrementally rather than by
+re-sorting: changed rows go into a small overlay that queries consult
+alongside the sorted arrays, and the arrays are rebuilt only once the
+overlay has grown large. Changed rows come from
+- KeyTable.set_usage() (journal replay, i.e. every redemption and reset of
+  the JSON store, whichever worker made it), or
+- for the snapshot store, a chunked comparison of the shared counters
+  against the copy taken at the last refresh, since other workers update
+  them in place without telling anyone.
+
+Adding or deleting keys produces a new table, and the store builds a new
+index for it on the next query.
+"""
+
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from key_table import OVERFLOW, KeyRecord, KeyTable, encode_timestamp
+
+STATUSES = ("active", "low", "depleted")
+ACTIVE, LOW, DEPLETED = range(3)
+
+# Bytes of the shared counters compared per step when looking for changes
+DIFF_CHUNK = 4096
+
+def key_status(max_uses: int, usage_count: int) -> int:
+    """ACTIVE (unlimited or 2+ uses left), LOW (1 left) or DEPLETED, as key_manager shows them"""
+    if max_uses == -1 or max_uses - usage_count > 1:
+        return ACTIVE
+    return LOW if max_uses - usage_count == 1 else DEPLETED
+
+def record_status(record: KeyRecord) -> int:
+    return key_status(record.get("max_uses", 1), record.get("usage_count", 0))
+
+def epoch_bound(epoch: float) -> int:
+    """Encoded-timestamp bound for epoch seconds"""
+    return round(epoch * 1_000_000) << 1
+
+class SortedIndex:
+    """Rows ordered by an integer value, plus the rows whose value has changed since"""
+
+    def __init__(self, values: Sequence[int], typecode: str = "q", counted: bool = False):
+        order = sorted(range(len(values)), key=values.__getitem__)
+        self.rows = array("I", order)
+        self.values = array(typecode, [values[row] for row in order])
+        # Each row's value as sorted, so count() can discount changed rows
+        self.base = array(typecode, values) if counted else None
+        self.changed: Dict[int, int] = {}
+
+    def update(self, row: int, value: int):
+        self.changed[row] = value
+
+    def between(self, low: int, high: int) -> List[int]:
+        """Rows with low <= value < high"""
+        start, end = bisect_left(self.values, low), bisect_left(self.values, high)
+        changed = self.changed
+        if not changed:
+            return self.rows[start:end].tolist()
+        rows = [row for row in self.rows[start:end] if row not in changed]
+        rows += [row for row, value in changed.items() if low <= value < high]
+        return rows
+
+    def count(self, low: int, high: int) -> int:
+        start, end = bisect_left(self.values, low), bisect_left(self.values, high)
+        if not self.changed:
+            return end - start
+        if self.base is None:
+            return len(self.between(low, high))
+        base = self.base
+        return (end - start + sum(1 for value in self.changed.values() if low <= value < high)
+                - sum(1 for row in self.changed if low <= base[row] < high))
+
+class KeyIndex:
+    """Status, created_at and last_used indexes for one table (and its shared counters)"""
+
+    # Re-sort once this many rows have changed since the last sort
+    MIN_REBUILD = 4096
+    REBUILD_RATIO = 0.05
+
+    def __init__(self, table: KeyTable, counters=None):
+        self.table = table
+        self.counters = counters
+        self._lock = threading.Lock()
+        self._build()
+
+    def _build(self):
+        table, counters = self.table, self.counters
+        rows = len(table)
+        if counters is not None:
+            self._saved = counters.slots.tobytes()
+            usage = counters.slots[0::2].tolist()
+            last_used = counters.slots[1::2].tolist()
+        else:
+            # From here on set_usage() records every row it touches
+            table.dirty = set()
+            usage = table.usage_count.tolist()
+            last_used = table.last_used.tolist()
+        max_uses = table.max_uses
+        status = [key_status(max_uses[row], usage[row]) for row in range(rows)]
+        created = table.created_at.tolist()
+        for row in self._overflow_rows():
+            status[row], last_used[row] = self._state(row)
+            created[row] = encode_timestamp(table.overflow[table._key(row)].get("created_at")) or 0
+        self.status = SortedIndex(status, "b", counted=True)
+        self.created = SortedIndex(created)
+        # Never used (absent, or null after a reset) sorts first as 0
+        self.last_used = SortedIndex([value if value > 0 else 0 for value in last_used])
+
+    def _overflow_rows(self) -> List[int]:
+        if not self.table.overflow:
+            return []
+        secret_ids = self.table.secret_ids
+        return [row for row in range(len(secret_ids)) if secret_ids[row] == OVERFLOW]
+
+    def _state(self, row: int):
+        """(status, last_used) of a row as it stands now"""
+        table, counters = self.table, self.counters
+        if table.secret_ids[row] == OVERFLOW:
+            record = table._record(row)
+            if counters is not None:
+                counters.overlay(row, record)
+            status = record_status(record)
+            last_used = encode_timestamp(record.get("last_used")) or 0
+            return status, max(last_used, 0)
+        if counters is not None:
+            usage_count, last_used = counters.get(row)
+        else:
+            usage_count, last_used = table.usage_count[row], table.last_used[row]
+        return key_status(table.max_uses[row], usage_count), max(last_used, 0)
+
+    def _changed_rows(self) -> Iterable[int]:
+        if self.counters is None:
+            dirty, self.table.dirty = self.table.dirty, set()
+            return dirty
+        current = self.counters.slots.tobytes()
+        saved, self._saved = self._saved, current
+        if current == saved:
+            return ()
+        slot_size = 16
+        changed = []
+        for start in range(0, len(current), DIFF_CHUNK):
+            end = start + DIFF_CHUNK
+            if current[start:end] != saved[start:end]:
+                for offset in range(start, min(end, len(current)), slot_size):
+                    if current[offset:offset + slot_size] != saved[offset:offset + slot_size]:
+                        changed.append(offset // slot_size)
+        return changed
+
+    def refresh(self):
+        """Fold usage changes made since the last refresh into the indexes"""
+        for row in self._changed_rows():
+            status, last_used = self._state(row)
+            self.status.update(row, status)
+            self.last_used.update(row, last_used)
+        if len(self.status.changed) > max(self.MIN_REBUILD, len(self.table) * self.REBUILD_RATIO):
+            self._build()
+
+    def query(self, status: Optional[str] = None, created_after: Optional[float] = None,
+              created_before: Optional[float] = None, used_after: Optional[float] = None,
+              used_before: Optional[float] = None, never_used: bool = False) -> List[int]:
+        """Rows matching every given condition, in table order (see KeyStore.query)"""
+        with self._lock:
+            self.refresh()
+            candidates = []
+            if status is not None:
+                code = STATUSES.index(status)
+                candidates.append(self.status.between(code, code + 1))
+            if created_after is not None or created_before is not None:
+                candidates.append(self.created.between(
+                    1 if created_after is None else epoch_bound(created_after),
+                    2 ** 63 - 1 if created_before is None else epoch_bound(created_before)))
+            if never_used:
+                candidates.append(self.last_used.between(0, 1))
+            if used_after is not None or used_before is not None:
+                # Never-used keys (0) count as "not used since" any time
+                candidates.append(self.last_used.between(
+                    0 if used_after is None else epoch_bound(used_after),
+                    2 ** 63 - 1 if used_before is None else epoch_bound(used_before)))
+        if not candidates:
+            return list(range(len(self.table)))
+        candidates.sort(key=len)
+        rows = candidates[0]
+        for other in candidates[1:]:
+            if not rows:
+                break
+            keep = set(rows)
+            rows = [row for row in other if row in keep]
+        return sorted(rows)
+
+    def status_counts(self) -> Dict[str, int]:
+        with self._lock:
+            self.refresh()
+            return {name: self.status.count(code, code + 1) for code, name in enumerate(STATUSES)}
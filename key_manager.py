@@ -4,31 +4,37 @@ Key Manager for 2FA TOTP System
 Allows you to add, modify, and manage keys with different usage limits
 """
 
+import argparse
+import fnmatch
 import json
+import sys
+import time
 import pyotp
-from datetime import datetime
-from totp_generator import load_keys, save_keys, get_key_info
+from bulk_keys import InvalidRow, normalize_secret
+from key_index import STATUSES
+from key_store import (_format_timestamp, _parse_timestamp, configure_key_store, expiry, get_key_store,
+                       is_expired, new_record, normalize_timestamp)
+from totp_generator import get_key_info
 
-def add_key(key_name, secret=None, max_uses=1):
-    """Add a new key with specified usage limit"""
-    keys = load_keys()
+def add_key(key_name, secret=None, max_uses=1, expires_at=None, ttl_after_first_use=None):
+    """Add a new key with specified usage limit and optional expiry (ISO time, and/or seconds after first use)"""
+    store = get_key_store()
     
-    if key_name in keys:
+    if store.get(key_name) is not None:
         print(f"❌ Key '{key_name}' already exists!")
         return False
     
     if not secret:
         secret = pyotp.random_base32()
         print(f"🔑 Generated new secret: {secret}")
+    else:
+        try:
+            secret = normalize_secret(secret)
+        except InvalidRow as e:
+            print(f"❌ Invalid secret: {e}")
+            return False
     
-    keys[key_name] = {
-        "secret": secret,
-        "max_uses": max_uses,
-        "usage_count": 0,
-        "created_at": datetime.utcnow().isoformat() + "Z"
-    }
-    
-    if save_keys(keys):
+    if store.add(key_name, secret, max_uses, expires_at=expires_at, ttl_after_first_use=ttl_after_first_use):
         usage_text = "unlimited" if max_uses == -1 else f"{max_uses}"
         print(f"✅ Added key '{key_name}' with {usage_text} uses")
         return True
@@ -38,54 +44,50 @@ def add_key(key_name, secret=None, max_uses=1):
 
 def modify_key_usage(key_name, new_max_uses):
     """Modify the usage limit of an existing key"""
-    keys = load_keys()
+    previous = get_key_store().set_max_uses(key_name, new_max_uses)
     
-    if key_name not in keys:
+    if previous is None:
         print(f"❌ Key '{key_name}' not found!")
         return False
     
-    old_max = keys[key_name]["max_uses"]
-    keys[key_name]["max_uses"] = new_max_uses
-    
-    if save_keys(keys):
-        old_text = "unlimited" if old_max == -1 else str(old_max)
-        new_text = "unlimited" if new_max_uses == -1 else str(new_max_uses)
-        print(f"✅ Updated key '{key_name}' from {old_text} to {new_text} uses")
-        return True
-    else:
-        print(f"❌ Failed to update key '{key_name}'")
-        return False
+    old_max = previous.get("max_uses", 1)
+    old_text = "unlimited" if old_max == -1 else str(old_max)
+    new_text = "unlimited" if new_max_uses == -1 else str(new_max_uses)
+    print(f"✅ Updated key '{key_name}' from {old_text} to {new_text} uses")
+    return True
 
 def reset_key_usage(key_name):
     """Reset the usage count of a key to 0"""
-    keys = load_keys()
+    previous = get_key_store().reset(key_name)
     
-    if key_name not in keys:
+    if previous is None:
         print(f"❌ Key '{key_name}' not found!")
         return False
     
-    old_count = keys[key_name]["usage_count"]
-    keys[key_name]["usage_count"] = 0
-    
-    if save_keys(keys):
-        print(f"✅ Reset usage count for key '{key_name}' (was {old_count}, now 0)")
-        return True
-    else:
-        print(f"❌ Failed to reset key '{key_name}'")
-        return False
+    old_count = previous.get("usage_count", 0)
+    print(f"✅ Reset usage count for key '{key_name}' (was {old_count}, now 0)")
+    return True
 
-def list_keys(show_secrets=False):
-    """List all keys with their usage information"""
-    keys = load_keys()
+def list_keys(show_secrets=False, key_names=None):
+    """List all keys (or just `key_names`) with their usage information"""
+    store = get_key_store()
+    if key_names is None:
+        total = store.count()
+        entries = store.items()
+    else:
+        total = len(key_names)
+        entries = ((key_name, store.get(key_name)) for key_name in key_names)
     
-    if not keys:
+    if not total:
         print("📝 No keys found")
         return
     
-    print(f"📋 Found {len(keys)} keys:")
+    print(f"📋 Found {total} keys:")
     print("-" * 80)
     
-    for key_name, key_data in keys.items():
+    for key_name, key_data in entries:
+        if key_data is None:
+            continue
         max_uses = key_data.get("max_uses", 1)
         usage_count = key_data.get("usage_count", 0)
         secret = key_data.get("secret", "")
@@ -102,27 +104,47 @@ def list_keys(show_secrets=False):
                 usage_text = f"🚫 {usage_count}/{max_uses} uses (depleted)"
                 status = "🔴"
         
+        deadline = expiry(key_data)
+        expired = is_expired(key_data)
+        if expired:
+            status = "⌛"
+        
         print(f"{status} {key_name}")
         print(f"   {usage_text}")
+        if deadline is not None:
+            print(f"   ⏰ {'Expired' if expired else 'Expires'} {_format_timestamp(deadline)}")
+        elif key_data.get("ttl_after_first_use") is not None:
+            print(f"   ⏰ Expires {key_data['ttl_after_first_use']}s after first use")
         if show_secrets:
             print(f"   🔐 Secret: {secret}")
         print()
 
+def find_keys(status=None, created_after=None, created_before=None, used_within_days=None,
+              unused_days=None, never_used=False, limit=None):
+    """Keys matching the given lifecycle filters, answered from the store's indexes"""
+    now = time.time()
+    return get_key_store().query(
+        status=status,
+        created_after=_parse_timestamp(normalize_timestamp(created_after)) if created_after else None,
+        created_before=_parse_timestamp(normalize_timestamp(created_before)) if created_before else None,
+        used_after=now - used_within_days * 86400 if used_within_days is not None else None,
+        used_before=now - unused_days * 86400 if unused_days is not None else None,
+        never_used=never_used,
+        limit=limit,
+    )
+
+def show_status_counts():
+    """Print how many keys are active, low and depleted"""
+    counts = get_key_store().status_counts()
+    print(f"🟢 {counts['active']} active   🟡 {counts['low']} low   🔴 {counts['depleted']} depleted")
+
 def delete_key(key_name):
     """Delete a key"""
-    keys = load_keys()
-    
-    if key_name not in keys:
-        print(f"❌ Key '{key_name}' not found!")
-        return False
-    
-    del keys[key_name]
-    
-    if save_keys(keys):
+    if get_key_store().delete(key_name):
         print(f"✅ Deleted key '{key_name}'")
         return True
     else:
-        print(f"❌ Failed to delete key '{key_name}'")
+        print(f"❌ Key '{key_name}' not found!")
         return False
 
 def show_key_info(key_name):
@@ -153,14 +175,345 @@ def show_key_info(key_name):
         else:
             print(f"🚫 Status: Depleted")
     
+    if info.get('is_expired'):
+        print(f"⌛ Expired: {info.get('expires_at')}")
+    elif info.get('expires_at'):
+        print(f"⏰ Expires: {info.get('expires_at')}")
+    elif info.get('ttl_after_first_use') is not None:
+        print(f"⏰ Expires: {info.get('ttl_after_first_use')}s after first use")
+    
     if info.get('last_used'):
         print(f"🕒 Last used: {info.get('last_used')}")
     
     if info.get('created_at'):
         print(f"📅 Created: {info.get('created_at')}")
 
-def main():
-    """Interactive key manager"""
+COMMANDS = ("list", "info", "counts", "add", "modify", "reset", "delete")
+
+# Keys named in text output before the list is cut short (--json names all)
+TEXT_KEY_LINES = 20
+
+def read_key_file(path):
+    """Key names from a file (or - for stdin), one per line; blank lines and # comments skipped"""
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        return [line.strip() for line in stream if line.strip() and not line.lstrip().startswith("#")]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def _filters(args):
+    return dict(status=args.status, created_after=args.created_after, created_before=args.created_before,
+                used_within_days=args.used_within_days, unused_days=args.unused_days,
+                never_used=args.never_used)
+
+def _named_keys(args):
+    named = list(args.keys)
+    if args.from_file:
+        named += read_key_file(args.from_file)
+    return list(dict.fromkeys(named))
+
+def has_selector(args):
+    return bool(args.keys or args.from_file or args.match or any(_filters(args).values()))
+
+def select_keys(args):
+    """
+    Keys chosen by the selection options, in store order unless named
+
+    Named keys (arguments and --from-file) are narrowed by the lifecycle
+    filters and --match; without names, the filters pick from the whole
+    store. Returns (selected keys, named keys that do not exist).
+    """
+    store = get_key_store()
+    filters = _filters(args)
+    named = _named_keys(args)
+    missing = []
+    if named:
+        selected = []
+        for key_name in named:
+            (selected if store.get(key_name) is not None else missing).append(key_name)
+        if any(filters.values()):
+            matching = set(find_keys(**filters))
+            selected = [key_name for key_name in selected if key_name in matching]
+    else:
+        selected = find_keys(**filters)
+    if args.match:
+        selected = [key_name for key_name in selected
+                    if any(fnmatch.fnmatchcase(key_name, pattern) for pattern in args.match)]
+    if args.limit is not None:
+        selected = selected[:args.limit]
+    return selected, missing
+
+def _public(record, show_secrets=False):
+    if show_secrets or record is None:
+        return record
+    return {name: value for name, value in record.items() if name != "secret"}
+
+def _print_json(payload):
+    print(json.dumps(payload, indent=2))
+
+def _print_key_lines(lines):
+    for line in lines[:TEXT_KEY_LINES]:
+        print(f"   {line}")
+    if len(lines) > TEXT_KEY_LINES:
+        print(f"   … and {len(lines) - TEXT_KEY_LINES} more (use --json for all)")
+
+def _report_missing(missing):
+    if missing:
+        shown = ", ".join(missing[:TEXT_KEY_LINES]) + (" …" if len(missing) > TEXT_KEY_LINES else "")
+        print(f"⚠️  {len(missing)} keys not found: {shown}", file=sys.stderr)
+
+def _timestamp_arg(value):
+    try:
+        return normalize_timestamp(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not an ISO 8601 time: {value!r}")
+
+def _secret_arg(value):
+    try:
+        return normalize_secret(value)
+    except InvalidRow as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def command_list(args):
+    if args.counts:
+        show_status_counts()
+        if not has_selector(args) and args.limit is None:
+            return 0
+    selected, missing = select_keys(args)
+    store = get_key_store()
+    if args.json:
+        _print_json({
+            "count": len(selected),
+            "keys": [dict(key=key_name, **_public(store.get(key_name), args.secrets)) for key_name in selected],
+            "missing": missing,
+        })
+    elif args.names_only:
+        if selected:
+            print("\n".join(selected))
+    else:
+        list_keys(show_secrets=args.secrets, key_names=selected)
+    _report_missing(missing)
+    return 1 if missing else 0
+
+def command_info(args):
+    selected, missing = select_keys(args)
+    if args.json:
+        _print_json({"keys": {key_name: get_key_info(key_name) for key_name in selected}, "missing": missing})
+    else:
+        for key_name in selected:
+            show_key_info(key_name)
+            print()
+    _report_missing(missing)
+    return 1 if missing else 0
+
+def command_counts(args):
+    if args.json:
+        _print_json(get_key_store().status_counts())
+    else:
+        show_status_counts()
+    return 0
+
+def command_add(args):
+    store = get_key_store()
+    named = _named_keys(args)
+    existing = [key_name for key_name in named if store.get(key_name) is not None]
+    records = {}
+    for key_name in named:
+        if key_name not in existing:
+            records[key_name] = new_record(args.secret or pyotp.random_base32(), args.max_uses,
+                                           expires_at=args.expires_at,
+                                           ttl_after_first_use=args.ttl_after_first_use)
+    added = 0
+    if records and not args.dry_run:
+        added = store.bulk_add(records)
+    failed = bool(records) and not args.dry_run and added == 0
+    if args.json:
+        _print_json({
+            "command": "add",
+            "dry_run": args.dry_run,
+            "keys": [dict(key=key_name, **record) for key_name, record in records.items()] if not failed else [],
+            "existing": existing,
+        })
+    elif failed:
+        print(f"❌ Failed to add {len(records)} keys")
+    else:
+        print(f"{'🔍 Would add' if args.dry_run else '✅ Added'} {len(records)} keys")
+        # Every secret is shown: this is the only place generated ones appear
+        for key_name, record in records.items():
+            print(f"   🔑 {key_name}: {record['secret']}")
+    if existing:
+        print(f"⚠️  {len(existing)} keys already exist: {', '.join(existing[:TEXT_KEY_LINES])}", file=sys.stderr)
+    return 1 if failed or existing else 0
+
+def _change(args, verb, done, apply, describe):
+    """
+    Run a bulk change over the selected keys
+
+    apply(keys) makes the change in one store write and returns the records
+    as they were; describe(key, record) is the text line for one key.
+    """
+    if not has_selector(args) and not args.all:
+        print(f"❌ Refusing to {verb} every key without --all", file=sys.stderr)
+        return 2
+    selected, missing = select_keys(args)
+    store = get_key_store()
+    if args.dry_run:
+        previous = {key_name: store.get(key_name) for key_name in selected}
+        previous = {key_name: record for key_name, record in previous.items() if record is not None}
+    else:
+        previous = apply(selected) if selected else {}
+    failed = bool(selected) and not previous
+    if args.json:
+        _print_json({
+            "command": args.command,
+            "dry_run": args.dry_run,
+            "keys": {key_name: _public(record, args.secrets) for key_name, record in previous.items()},
+            "missing": missing,
+            "failed": failed,
+        })
+    elif failed:
+        print(f"❌ Failed to {verb} {len(selected)} keys")
+    else:
+        print(f"🔍 Would {verb} {len(previous)} keys" if args.dry_run else f"✅ {done} {len(previous)} keys")
+        _print_key_lines([describe(key_name, record) for key_name, record in previous.items()])
+    _report_missing(missing)
+    return 1 if failed or missing else 0
+
+def command_modify(args):
+    new_text = "unlimited" if args.max_uses == -1 else str(args.max_uses)
+    def describe(key_name, record):
+        old_max = record.get("max_uses", 1)
+        return f"{key_name} ({'unlimited' if old_max == -1 else old_max} → {new_text} uses)"
+    return _change(args, "modify", "Modified", lambda keys: get_key_store().set_max_uses_many(keys, args.max_uses), describe)
+
+def command_reset(args):
+    return _change(args, "reset", "Reset", get_key_store().reset_many,
+                   lambda key_name, record: f"{key_name} (was {record.get('usage_count', 0)}, now 0)")
+
+def command_delete(args):
+    if not args.dry_run and not args.yes:
+        print("❌ delete needs --yes (or --dry-run to preview)", file=sys.stderr)
+        return 2
+    return _change(args, "delete", "Deleted", get_key_store().delete_many,
+                   lambda key_name, record: f"{key_name} ({record.get('usage_count', 0)} uses)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Key Manager for 2FA TOTP System. Without arguments, starts the interactive menu; "
+                    "options without a command are taken as 'list'.",
+        epilog="Examples:\n"
+               "  key_manager.py list --status depleted --names-only\n"
+               "  key_manager.py add --from-file new_keys.txt --max-uses 5 --json\n"
+               "  key_manager.py reset --match 'TEAM_*' --dry-run\n"
+               "  key_manager.py modify --from-file keys.txt --max-uses -1\n"
+               "  key_manager.py delete --unused-days 365 --yes",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--backend", choices=["json", "snapshot", "sqlite", "sqlalchemy"],
+                        help="key store backend (default: KEY_STORE_BACKEND or json)")
+    common.add_argument("--url", help="key store file or database URL (default: KEY_STORE_URL)")
+    common.add_argument("--json", action="store_true", help="print the result as JSON")
+
+    names = argparse.ArgumentParser(add_help=False)
+    names.add_argument("keys", nargs="*", metavar="KEY", help="key names")
+    names.add_argument("--from-file", metavar="PATH", help="file with one key name per line (- for stdin)")
+
+    select = argparse.ArgumentParser(add_help=False, parents=[names])
+    select.add_argument("--match", action="append", metavar="GLOB",
+                        help="only keys whose name matches this shell pattern (repeatable)")
+    select.add_argument("--status", choices=STATUSES, help="only keys with this status")
+    select.add_argument("--created-after", type=_timestamp_arg, metavar="TIME",
+                        help="created at or after (ISO date or time, UTC unless it has an offset)")
+    select.add_argument("--created-before", type=_timestamp_arg, metavar="TIME",
+                        help="created before (ISO date or time, UTC unless it has an offset)")
+    select.add_argument("--used-within-days", type=float, metavar="N", help="used in the last N days")
+    select.add_argument("--unused-days", type=float, metavar="N",
+                        help="not used in the last N days (including never used)")
+    select.add_argument("--never-used", action="store_true", help="only keys never redeemed")
+    select.add_argument("--limit", type=int, help="at most this many keys")
+    select.add_argument("--secrets", action="store_true", help="include secrets in the output")
+
+    change = argparse.ArgumentParser(add_help=False, parents=[select])
+    change.add_argument("--all", action="store_true", help="allow the change to apply to every key")
+    change.add_argument("--dry-run", action="store_true", help="show what would change without writing")
+
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    list_parser = commands.add_parser("list", parents=[common, select], help="list keys (all, or matching)")
+    list_parser.add_argument("--counts", action="store_true", help="print the number of keys per status")
+    list_parser.add_argument("--names-only", action="store_true", help="print matching key names only")
+    commands.add_parser("info", parents=[common, select], help="show details of keys")
+    commands.add_parser("counts", parents=[common], help="number of keys per status")
+
+    add_parser = commands.add_parser("add", parents=[common, names], help="add keys in one write")
+    add_parser.add_argument("--secret", type=_secret_arg, help="TOTP secret for every added key (default: a random one each)")
+    add_parser.add_argument("--max-uses", type=int, default=1, help="usage limit (-1 for unlimited, default 1)")
+    add_parser.add_argument("--expires-at", type=_timestamp_arg, metavar="TIME", help="absolute expiry (ISO time)")
+    add_parser.add_argument("--ttl-after-first-use", type=int, metavar="SECONDS",
+                            help="expire this long after the first redemption")
+    add_parser.add_argument("--dry-run", action="store_true", help="show what would be added without writing")
+
+    modify_parser = commands.add_parser("modify", parents=[common, change], help="change the usage limit of keys")
+    modify_parser.add_argument("--max-uses", type=int, required=True, help="new usage limit (-1 for unlimited)")
+    commands.add_parser("reset", parents=[common, change], help="reset the usage count of keys to 0")
+    delete_parser = commands.add_parser("delete", parents=[common, change], help="delete keys")
+    delete_parser.add_argument("--yes", action="store_true", help="confirm the deletion")
+    # Options of the original CLI that take a value, to find the command behind them
+    parser.value_options = {option for action in list_parser._actions if action.nargs != 0
+                            for option in action.option_strings}
+    return parser
+
+HANDLERS = {
+    "list": command_list,
+    "info": command_info,
+    "counts": command_counts,
+    "add": command_add,
+    "modify": command_modify,
+    "reset": command_reset,
+    "delete": command_delete,
+}
+
+def _first_operand(argv, value_options):
+    """Index of the first token that is neither an option nor an option's value, or None"""
+    position = 0
+    while position < len(argv):
+        token = argv[position]
+        if token == "--":
+            # Everything after it is a key name
+            return None
+        if not token.startswith("-") or token == "-":
+            return position
+        position += 2 if token in value_options else 1
+    return None
+
+def main(argv=None):
+    """Run one CLI command and return its exit status; without arguments, the interactive menu"""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv:
+        parser = build_parser()
+        if argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+            position = _first_operand(argv, parser.value_options)
+            if position is not None and argv[position] in COMMANDS:
+                # Options given before the command belong to it
+                argv.insert(0, argv.pop(position))
+            else:
+                # Options on their own (the original CLI) filter the listing
+                argv = ["list"] + argv
+        args = parser.parse_args(argv)
+        if args.command is None:
+            parser.print_help()
+            return 2
+        if args.command == "add" and not (args.keys or args.from_file):
+            parser.error("add needs key names or --from-file")
+        if args.backend or args.url:
+            configure_key_store(args.backend, args.url)
+        return HANDLERS[args.command](args)
+    interactive()
+    return 0
+
+def interactive():
+    """The input()-driven menu"""
     print("🔐 2FA Key Manager")
     print("=" * 50)
     
@@ -217,4 +570,4 @@ def main():
             print("❌ Invalid choice!")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
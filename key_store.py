@@ -0,0 +1,1665 @@
+"""
+Key storage backends for the 2FA TOTP system
+
+All key access goes through a KeyStore. Four interchangeable backends are
+provided and selected by configuration:
+
+- "json":       keys.json snapshot plus an append-only usage journal (default)
+- "snapshot":   the same, with a memory-mapped binary snapshot (snapshot.py)
+- "sqlite":     a local SQLite database in WAL mode
+- "sqlalchemy": any SQLAlchemy URL, e.g. PostgreSQL via DATABASE_URL
+
+Every backend stores the same record shape as keys.json:
+secret, max_uses (-1 for unlimited), usage_count, created_at and last_used,
+plus the optional expiry fields expires_at, ttl_after_first_use and
+first_used_at (see expiry()).
+"""
+
+import os
+import json
+import fcntl
+import struct
+import sqlite3
+import threading
+import time
+from typing import Tuple, Optional, Dict, Any, Callable, Iterable, Iterator, List
+from datetime import datetime, timezone
+
+from group_commit import GroupCommit, group_commit_from_env
+from key_filter import KeyFilter, filter_from_env
+from key_index import STATUSES, KeyIndex, record_status
+from key_table import KeyTable, decode_timestamp, encode_epoch
+from shared_counters import SharedCounters
+import snapshot
+from metrics import KEY_CACHE_LOOKUPS, STAGE_LATENCY, STORE_ERRORS
+
+# Metric series on the redemption path, bound once
+_cache_hits = KEY_CACHE_LOOKUPS.labels(result="hit")
+_cache_reloads = KEY_CACHE_LOOKUPS.labels(result="reload")
+_load_latency = STAGE_LATENCY.labels(stage="load")
+_validate_latency = STAGE_LATENCY.labels(stage="validate")
+_persist_latency = STAGE_LATENCY.labels(stage="persist")
+
+KeyRecord = Dict[str, Any]
+
+# fsync usage writes before reporting a redemption (SQLite: synchronous=FULL).
+# Pair with KEYS_GROUP_COMMIT_MS so concurrent redemptions share each sync.
+SYNC_WRITES = os.environ.get("KEYS_SYNC_WRITES", "0") == "1"
+
+# Fold the journal back into the snapshot once it holds this many records
+JOURNAL_COMPACT_THRESHOLD = int(os.environ.get("KEYS_JOURNAL_COMPACT_THRESHOLD", "1000"))
+
+# Journal header: magic, then the (mtime_ns, size) of the snapshot it applies to
+JOURNAL_HEADER = struct.Struct("<4sqq")
+JOURNAL_MAGIC = b"KJ02"
+# Journal record: access key (NUL padded), new usage_count, last_used epoch
+# (0 = never), first_used_at epoch (0 = unchanged)
+JOURNAL_RECORD = struct.Struct("<64sqdd")
+# Journals written before first_used_at existed: replayed, never appended to
+LEGACY_JOURNAL_RECORDS = {b"KJ01": struct.Struct("<64sqd")}
+
+def utc_timestamp() -> str:
+    """Current UTC time in the ISO format stored in key records"""
+    return datetime.utcnow().isoformat(timespec="microseconds") + "Z"
+
+def _format_timestamp(epoch: float) -> Optional[str]:
+    if not epoch:
+        return None
+    return datetime.utcfromtimestamp(epoch).isoformat(timespec="microseconds") + "Z"
+
+def _parse_timestamp(value: Optional[str]) -> float:
+    if not value:
+        return 0.0
+    return datetime.fromisoformat(value.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+
+def _query_timestamp(value) -> float:
+    """_parse_timestamp() for filtering: anything unparsable counts as unset"""
+    try:
+        return _parse_timestamp(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def normalize_timestamp(value: str) -> str:
+    """
+    An ISO 8601 time in the format stored in key records (UTC, microseconds)
+
+    Accepts a "Z" or numeric UTC offset; a time without one is taken as
+    UTC. Raises ValueError if `value` is not a time. Stored times compare
+    correctly as strings only in this one format, which the SQL backends rely on.
+    """
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return _format_timestamp(parsed.timestamp())
+
+def expiry(record: KeyRecord) -> Optional[float]:
+    """
+    When a key stops being usable, in epoch seconds; None if it never expires
+
+    The earlier of its absolute expires_at and, once the key has been used,
+    first_used_at + ttl_after_first_use. A TTL key that was never used has
+    no expiry yet. Unparsable values are ignored.
+    """
+    expires_at = record.get("expires_at")
+    ttl = record.get("ttl_after_first_use")
+    if expires_at is None and ttl is None:
+        return None
+    deadlines = []
+    if expires_at is not None:
+        deadlines.append(_query_timestamp(expires_at) or None)
+    if ttl is not None:
+        first_used = _query_timestamp(record.get("first_used_at"))
+        if first_used and isinstance(ttl, (int, float)):
+            deadlines.append(first_used + ttl)
+    deadlines = [deadline for deadline in deadlines if deadline is not None]
+    return min(deadlines) if deadlines else None
+
+def is_expired(record: KeyRecord, now: Optional[float] = None) -> bool:
+    """Check whether a key record is past its expiry"""
+    deadline = expiry(record)
+    return deadline is not None and (time.time() if now is None else now) >= deadline
+
+def is_key_valid(record: KeyRecord, now: Optional[float] = None) -> bool:
+    """Check whether a key record still has remaining uses and has not expired"""
+    max_uses = record.get("max_uses", 1)
+    usage_count = record.get("usage_count", 0)
+    return (max_uses == -1 or usage_count < max_uses) and not is_expired(record, now)
+
+def rejection_reason(record: Optional[KeyRecord], now: Optional[float] = None) -> Optional[str]:
+    """Explain why a key cannot be redeemed at `now` (default: the current time), or None if it can"""
+    if record is None:
+        return "Invalid key provided"
+    if is_expired(record, now):
+        return f"Key expired at {_format_timestamp(expiry(record))}"
+    if not is_key_valid(record, now):
+        return f"Key has reached its usage limit ({record.get('usage_count', 0)}/{record.get('max_uses', 1)} uses)"
+    if not record.get("secret"):
+        return "No secret found for this key"
+    return None
+
+def starts_ttl(record: KeyRecord) -> bool:
+    """True if redeeming the key now is its first use and starts its ttl_after_first_use"""
+    return record.get("ttl_after_first_use") is not None and not record.get("first_used_at")
+
+def new_record(secret: str, max_uses: int = 1, created_at: Optional[str] = None,
+               expires_at: Optional[str] = None, ttl_after_first_use: Optional[int] = None) -> KeyRecord:
+    """Build the record stored for a freshly added key"""
+    record = {
+        "secret": secret,
+        "max_uses": max_uses,
+        "usage_count": 0,
+        "created_at": created_at or utc_timestamp()
+    }
+    if expires_at is not None:
+        record["expires_at"] = normalize_timestamp(expires_at)
+    if ttl_after_first_use is not None:
+        record["ttl_after_first_use"] = ttl_after_first_use
+    return record
+
+class KeyStore:
+    """
+    Interface shared by all key storage backends.
+
+    redeem() is the only operation on the request path that writes. It must
+    check the usage limit and increment usage_count as one atomic step, even
+    across processes.
+    """
+
+    backend = ""
+
+    _key_filter: Optional[KeyFilter] = None
+    _key_filter_loaded = False
+    _key_filter_lock = threading.Lock()
+
+    _group_commit: Optional[GroupCommit] = None
+    _group_commit_loaded = False
+
+    @property
+    def group_commit(self) -> Optional[GroupCommit]:
+        """Batches concurrent redemptions on this store (None unless KEYS_GROUP_COMMIT_MS is set)"""
+        if not self._group_commit_loaded:
+            with self._key_filter_lock:
+                if not self._group_commit_loaded:
+                    self._group_commit = group_commit_from_env(self)
+                    self._group_commit_loaded = True
+        return self._group_commit
+
+    @property
+    def key_filter(self) -> Optional[KeyFilter]:
+        """The Bloom filter over this store's keys (None if KEY_FILTER=off)"""
+        if not self._key_filter_loaded:
+            with self._key_filter_lock:
+                if not self._key_filter_loaded:
+                    self._key_filter = filter_from_env(self)
+                    self._key_filter_loaded = True
+        return self._key_filter
+
+    def might_contain(self, key: str) -> bool:
+        """
+        False only if the key definitely does not exist
+
+        Answered from memory by the key filter, so unknown keys can be
+        rejected before any store access.
+        """
+        key_filter = self.key_filter
+        return key_filter is None or key_filter.might_contain(key)
+
+    def membership_version(self):
+        """
+        Cheap token that changes whenever keys are added or deleted
+
+        The key filter rebuilds itself when this changes. Usage updates
+        need not change it.
+        """
+        raise NotImplementedError
+
+    def data_version(self, key: str):
+        """
+        Cheap token that changes whenever `key`'s record changes, in any process
+
+        Lets cached responses (response_cache.py) be checked without reading
+        the record. Backends may return a token that changes with any
+        record. None if the backend has no such token; responses are then
+        not cached at all.
+        """
+        return None
+
+    def _keys_added(self, keys: Iterable[str]):
+        if self._key_filter is not None:
+            self._key_filter.add(keys)
+
+    def _key_deleted(self, key: str):
+        if self._key_filter is not None:
+            self._key_filter.discard(key)
+
+    def get(self, key: str) -> Optional[KeyRecord]:
+        """Return a copy of the key's record, or None if it does not exist"""
+        raise NotImplementedError
+
+    def redeem(self, key: str) -> Tuple[Optional[KeyRecord], Optional[str]]:
+        """
+        Consume one use of a key
+
+        Returns:
+            Tuple of (record, error_message). On success the record reflects
+            the incremented usage_count and error_message is None. On
+            rejection the record is the current one (None if the key does not
+            exist) and error_message says why.
+        """
+        raise NotImplementedError
+
+    def redeem_many(self, keys: List[str]) -> List[Tuple[Optional[KeyRecord], Optional[str]]]:
+        """
+        Consume one use of each key in a single transaction
+
+        Keys are processed in order with the same limit semantics as
+        redeem(); a key listed twice consumes two uses. Returns one
+        (record, error_message) tuple per key.
+        """
+        return [self.redeem(key) for key in keys]
+
+    def add(self, key: str, secret: str, max_uses: int = 1, created_at: Optional[str] = None,
+            expires_at: Optional[str] = None, ttl_after_first_use: Optional[int] = None) -> bool:
+        """Add a key; returns False if it already exists"""
+        raise NotImplementedError
+
+    def bulk_add(self, records: Dict[str, KeyRecord]) -> int:
+        """Add many keys in one write, skipping existing ones; returns the number added"""
+        raise NotImplementedError
+
+    def reset(self, key: str) -> Optional[KeyRecord]:
+        """Reset usage_count to 0; returns the record as it was, or None if not found"""
+        return self.reset_many([key]).get(key)
+
+    def reset_many(self, keys: List[str]) -> Dict[str, KeyRecord]:
+        """Reset several keys in one write; returns the records as they were (unknown keys are left out)"""
+        raise NotImplementedError
+
+    def set_max_uses(self, key: str, max_uses: int) -> Optional[KeyRecord]:
+        """Change a key's usage limit; returns the record as it was, or None if not found"""
+        return self.set_max_uses_many([key], max_uses).get(key)
+
+    def set_max_uses_many(self, keys: List[str], max_uses: int) -> Dict[str, KeyRecord]:
+        """Change several keys' usage limit in one write; returns the records as they were"""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        """Delete a key; returns False if it did not exist"""
+        raise NotImplementedError
+
+    def delete_many(self, keys: List[str], where: Optional[Callable[[KeyRecord], bool]] = None,
+                    before_delete: Optional[Callable[[Dict[str, KeyRecord]], None]] = None) -> Dict[str, KeyRecord]:
+        """
+        Delete several keys in one write; returns the records deleted
+
+        Args:
+            keys: Keys to delete; unknown ones are ignored
+            where: Only delete keys whose current record passes this check
+            before_delete: Called with the records about to be deleted
+                before the delete is committed (under the store's lock or
+                transaction, where it has one). If it raises, nothing is
+                deleted.
+
+        The generic version deletes one key at a time.
+        """
+        records = {}
+        for key in keys:
+            record = self.get(key)
+            if record is not None and (where is None or where(record)):
+                records[key] = record
+        if before_delete is not None and records:
+            before_delete(records)
+        return {key: record for key, record in records.items() if self.delete(key)}
+
+    def items(self) -> Iterator[Tuple[str, KeyRecord]]:
+        """Iterate over (key, record) pairs"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        """Number of keys held"""
+        return sum(1 for _ in self.items())
+
+    def query(self, status: Optional[str] = None, created_after: Optional[float] = None,
+              created_before: Optional[float] = None, used_after: Optional[float] = None,
+              used_before: Optional[float] = None, never_used: bool = False,
+              limit: Optional[int] = None) -> List[str]:
+        """
+        Keys matching every given condition, in store order
+
+        Args:
+            status: "active" (unlimited or 2+ uses left), "low" (1 left) or "depleted"
+            created_after, created_before: created_at in [after, before), epoch seconds
+            used_after: last used at or after this time
+            used_before: not used since this time (last used before it, or never)
+            never_used: only keys that have never been redeemed
+            limit: return at most this many keys
+
+        The generic version scans every record; backends answer from indexes.
+        """
+        if status is not None and status not in STATUSES:
+            raise ValueError(f"Unknown status '{status}' (expected one of {', '.join(STATUSES)})")
+        matches = []
+        for key, record in self.items():
+            created = _query_timestamp(record.get("created_at"))
+            last_used = _query_timestamp(record.get("last_used"))
+            if ((status is None or STATUSES[record_status(record)] == status)
+                    and (created_after is None or created >= created_after)
+                    and (created_before is None or created < created_before)
+                    and (used_after is None or (last_used and last_used >= used_after))
+                    and (used_before is None or last_used < used_before)
+                    and (not never_used or not last_used)):
+                matches.append(key)
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
+
+    def expired_keys(self, before: Optional[float] = None, limit: Optional[int] = None) -> List[str]:
+        """Keys whose expiry (see expiry()) is at or before `before` (default: now), in store order"""
+        before = time.time() if before is None else before
+        matches = []
+        for key, record in self.items():
+            deadline = expiry(record)
+            if deadline is not None and deadline <= before:
+                matches.append(key)
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
+
+    def status_counts(self) -> Dict[str, int]:
+        """Number of keys per status ("active", "low", "depleted")"""
+        counts = dict.fromkeys(STATUSES, 0)
+        for _, record in self.items():
+            counts[STATUSES[record_status(record)]] += 1
+        return counts
+
+    def all(self) -> Dict[str, KeyRecord]:
+        """Return every key as a plain dict in keys.json format"""
+        return dict(self.items())
+
+def _file_signature(path: str):
+    """Return a (mtime_ns, size) pair identifying the file's current contents"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _journal_signature(path: str):
+    """Return (inode, size) of the journal so replacement and growth are both seen"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size)
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _load_json_table(path: str) -> KeyTable:
+    with open(path, 'r') as f:
+        return KeyTable(json.load(f))
+
+class KeyCache:
+    """
+    In-process cache of the parsed keys file.
+
+    The keys file is a snapshot; redemptions are appended to a fixed-size
+    record journal next to it instead of rewriting the snapshot. The cache
+    parses the snapshot once, replays the journal over it, and afterwards
+    only reads journal records appended since the last look. The snapshot is
+    re-parsed only when its (mtime, size) signature changes on disk, e.g.
+    after compaction or after another process rewrote it.
+
+    Parsed keys are held in a KeyTable (packed columns, ~50 bytes per key)
+    rather than a dict of dicts, so million-key stores fit comfortably in
+    every worker.
+    """
+
+    def __init__(self, path: str, journal_path: str, loader=None):
+        self.path = path
+        self.journal_path = journal_path
+        # path -> KeyTable; parses keys.json unless given another format
+        self.loader = loader or _load_json_table
+        self._keys = KeyTable()
+        self._signature = None
+        self._journal_signature = None
+        self._journal_offset = 0
+        self._journal_record = JOURNAL_RECORD
+        self._lock = threading.Lock()
+
+    def get(self) -> KeyTable:
+        """Return the shared, cached key table. Records it returns are copies."""
+        signature = _file_signature(self.path)
+        journal_signature = _journal_signature(self.journal_path)
+        if (signature is not None and signature == self._signature
+                and journal_signature == self._journal_signature):
+            _cache_hits.inc()
+            return self._keys
+        _cache_reloads.inc()
+        with self._lock, _load_latency.time():
+            signature = _file_signature(self.path)
+            if signature is None:
+                print(f"Error: {self.path} file not found")
+                self._keys, self._signature = KeyTable(), None
+                self._journal_signature, self._journal_offset = None, 0
+                return self._keys
+            journal_signature = _journal_signature(self.journal_path)
+            if signature != self._signature or self._journal_replaced(journal_signature):
+                self._load_snapshot(signature)
+            if journal_signature != self._journal_signature:
+                self._replay_journal(signature)
+            return self._keys
+
+    def update(self, table: KeyTable):
+        """Replace the cached contents after this process wrote a new snapshot."""
+        with self._lock:
+            self._keys = table
+            self._signature = _file_signature(self.path)
+            self._journal_signature = _journal_signature(self.journal_path)
+            self._journal_offset = self._journal_signature[1] if self._journal_signature else 0
+
+    def _journal_replaced(self, journal_signature) -> bool:
+        if self._journal_signature is None:
+            return False
+        if journal_signature is None or journal_signature[0] != self._journal_signature[0]:
+            return True
+        return journal_signature[1] < self._journal_offset
+
+    def _load_snapshot(self, signature):
+        try:
+            self._keys = self.loader(self.path)
+        except ValueError as e:
+            print(f"Error: Cannot load {self.path}: {e}")
+            self._keys = KeyTable()
+        self._signature = signature
+        self._journal_signature = None
+        self._journal_offset = 0
+
+    def _replay_journal(self, signature):
+        try:
+            f = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            self._journal_signature, self._journal_offset = None, 0
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            if self._journal_offset == 0:
+                header = f.read(JOURNAL_HEADER.size)
+                if len(header) < JOURNAL_HEADER.size:
+                    return
+                magic, mtime_ns, size = JOURNAL_HEADER.unpack(header)
+                record = JOURNAL_RECORD if magic == JOURNAL_MAGIC else LEGACY_JOURNAL_RECORDS.get(magic)
+                if record is None or (mtime_ns, size) != signature:
+                    # Written against another snapshot; the snapshot wins
+                    self._journal_signature = (st.st_ino, st.st_size)
+                    self._journal_offset = st.st_size
+                    return
+                self._journal_record = record
+                self._journal_offset = JOURNAL_HEADER.size
+            record = self._journal_record
+            f.seek(self._journal_offset)
+            # Only consume whole records; a concurrent append may be in flight
+            count = (st.st_size - self._journal_offset) // record.size
+            data = f.read(count * record.size)
+        for raw_key, *usage in record.iter_unpack(data):
+            self._keys.set_usage(raw_key.rstrip(b"\0").decode("utf-8"), *usage)
+        self._journal_offset += len(data)
+        self._journal_signature = (st.st_ino, self._journal_offset)
+
+class StoreLock:
+    """
+    Exclusive lock over the keys file, its journal and the key cache.
+
+    Combines a thread lock with an fcntl lock on a side file, so every
+    check-and-increment or snapshot write is serialized across threads and
+    across gunicorn worker processes. Re-entrant within a thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except Exception:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+class JSONKeyStore(KeyStore):
+    """
+    keys.json snapshot with an append-only usage journal.
+
+    Redemptions and resets append one fixed-size record to <path>.journal, so
+    their cost does not depend on the number of keys. Structural changes
+    (add, delete, limit changes) rewrite the snapshot. All writes happen
+    under an fcntl lock on <path>.lock.
+    """
+
+    backend = "json"
+
+    def __init__(self, path: str = "keys.json"):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.cache = KeyCache(path, self.journal_path)
+        self.lock = StoreLock(path + ".lock")
+
+    def get(self, key: str) -> Optional[KeyRecord]:
+        return self.cache.get().get(key)
+
+    def redeem(self, key: str) -> Tuple[Optional[KeyRecord], Optional[str]]:
+        return self.redeem_many([key])[0]
+
+    def redeem_many(self, keys: List[str]) -> List[Tuple[Optional[KeyRecord], Optional[str]]]:
+        with self.lock:
+            cached = self.cache.get()
+            validate_started = time.perf_counter()
+            now = time.time()
+            redeemed: Dict[str, KeyRecord] = {}
+            results = []
+            updates = []
+            for key in keys:
+                record = redeemed.get(key) or cached.get(key)
+                error = rejection_reason(record, now)
+                if error:
+                    results.append(((dict(record) if record is not None else None), error))
+                    continue
+                updated = dict(record)
+                updated["usage_count"] = record.get("usage_count", 0) + 1
+                updated["last_used"] = _format_timestamp(now)
+                first_used = 0.0
+                if starts_ttl(record):
+                    updated["first_used_at"] = updated["last_used"]
+                    first_used = now
+                redeemed[key] = updated
+                updates.append((key, updated["usage_count"], now, first_used))
+                results.append((updated, None))
+            _validate_latency.observe(time.perf_counter() - validate_started)
+            if updates and not self._record_usage(updates):
+                return [
+                    (record, error) if error else (cached[key], "Failed to update key usage count")
+                    for key, (record, error) in zip(keys, results)
+                ]
+            return results
+
+    def add(self, key: str, secret: str, max_uses: int = 1, created_at: Optional[str] = None,
+            expires_at: Optional[str] = None, ttl_after_first_use: Optional[int] = None) -> bool:
+        with self.lock:
+            if key in self.cache.get():
+                return False
+            keys = self.all()
+            keys[key] = new_record(secret, max_uses, created_at, expires_at, ttl_after_first_use)
+            if not self.save(keys):
+                return False
+            self._keys_added([key])
+            return True
+
+    def bulk_add(self, records: Dict[str, KeyRecord]) -> int:
+        with self.lock:
+            keys = self.all()
+            added = []
+            for key, record in records.items():
+                if key not in keys:
+                    keys[key] = dict(record)
+                    added.append(key)
+            if added and not self.save(keys):
+                return 0
+            self._keys_added(added)
+            return len(added)
+
+    def reset_many(self, keys: List[str]) -> Dict[str, KeyRecord]:
+        with self.lock:
+            table = self.cache.get()
+            previous = {}
+            for key in keys:
+                record = table.get(key)
+                if record is not None:
+                    previous[key] = dict(record)
+            # first_used_at stays: a reset restores uses, not time
+            if previous and not self._record_usage([(key, 0, _parse_timestamp(record.get("last_used")), 0.0)
+                                                    for key, record in previous.items()]):
+                return {}
+            return previous
+
+    def set_max_uses_many(self, keys: List[str], max_uses: int) -> Dict[str, KeyRecord]:
+        with self.lock:
+            current = self.all()
+            previous = {}
+            for key in keys:
+                if key in current and key not in previous:
+                    previous[key] = dict(current[key])
+                    current[key]["max_uses"] = max_uses
+            if previous and not self.save(current):
+                return {}
+            return previous
+
+    def delete(self, key: str) -> bool:
+        with self.lock:
+            keys = self.all()
+            if key not in keys:
+                return False
+            del keys[key]
+            if not self.save(keys):
+                return False
+            self._key_deleted(key)
+            return True
+
+    def delete_many(self, keys: List[str], where: Optional[Callable[[KeyRecord], bool]] = None,
+                    before_delete: Optional[Callable[[Dict[str, KeyRecord]], None]] = None) -> Dict[str, KeyRecord]:
+        with self.lock:
+            current = self.all()
+            deleted = {}
+            for key in keys:
+                record = current.get(key)
+                if record is not None and (where is None or where(record)):
+                    deleted[key] = record
+            if not deleted:
+                return {}
+            if before_delete is not None:
+                before_delete(deleted)
+            for key in deleted:
+                del current[key]
+            if not self.save(current):
+                return {}
+            for key in deleted:
+                self._key_deleted(key)
+            return deleted
+
+    def items(self) -> Iterator[Tuple[str, KeyRecord]]:
+        # A reload swaps in a new table; this one stays consistent meanwhile
+        return self.cache.get().items()
+
+    def expired_keys(self, before: Optional[float] = None, limit: Optional[int] = None) -> List[str]:
+        # Expiry fields never fit the packed columns, so only overflow rows can expire
+        before = time.time() if before is None else before
+        table = self.cache.get()
+        matches = []
+        for key, record in table.overflow.items():
+            deadline = expiry(record)
+            if deadline is not None and deadline <= before:
+                matches.append(key)
+        matches.sort(key=table.find)
+        return matches[:limit]
+
+    def membership_version(self):
+        # Keys are only added or removed by a snapshot rewrite
+        return _file_signature(self.path)
+
+    def data_version(self, key: str):
+        # Usage changes append to the journal; everything else rewrites the snapshot
+        return _file_signature(self.path), _journal_signature(self.journal_path)
+
+    _key_index: Optional[KeyIndex] = None
+
+    def _index(self) -> Tuple[KeyTable, KeyIndex]:
+        """The secondary indexes for the current table, built on first use"""
+        table = self.cache.get()
+        index = self._key_index
+        if index is None or index.table is not table:
+            index = self._key_index = KeyIndex(table)
+        return table, index
+
+    def query(self, status: Optional[str] = None, created_after: Optional[float] = None,
+              created_before: Optional[float] = None, used_after: Optional[float] = None,
+              used_before: Optional[float] = None, never_used: bool = False,
+              limit: Optional[int] = None) -> List[str]:
+        if status is not None and status not in STATUSES:
+            raise ValueError(f"Unknown status '{status}' (expected one of {', '.join(STATUSES)})")
+        table, index = self._index()
+        rows = index.query(status, created_after, created_before, used_after, used_before, never_used)
+        return [table._key(row) for row in rows[:limit]]
+
+    def status_counts(self) -> Dict[str, int]:
+        return self._index()[1].status_counts()
+
+    def count(self) -> int:
+        return len(self.cache.get())
+
+    def all(self) -> Dict[str, KeyRecord]:
+        return dict(self.cache.get().items())
+
+    def save(self, keys: Dict[str, KeyRecord]) -> bool:
+        """Write a full snapshot and start a fresh, empty usage journal for it"""
+        try:
+            with self.lock:
+                _write_atomic(self.path, self._encode(keys))
+                signature = _file_signature(self.path)
+                _write_atomic(self.journal_path, JOURNAL_HEADER.pack(JOURNAL_MAGIC, *signature))
+                self.cache.update(self._table(keys))
+            return True
+        except Exception as e:
+            STORE_ERRORS.inc(operation="save")
+            print(f"Error saving keys: {e}")
+            return False
+
+    def _encode(self, keys: Dict[str, KeyRecord]) -> bytes:
+        """Snapshot file contents for `keys`"""
+        return json.dumps(keys, indent=2).encode("utf-8")
+
+    def _table(self, keys: Dict[str, KeyRecord]) -> KeyTable:
+        """Cache contents matching the snapshot just written"""
+        return KeyTable(keys)
+
+    def compact(self) -> bool:
+        """Fold the usage journal into the snapshot and truncate the journal"""
+        with self.lock:
+            return self.save(self.all())
+
+    def _record_usage(self, updates: List[Tuple[str, int, float, float]]) -> bool:
+        """
+        Persist new usage counts by appending one journal record per update
+
+        Each update is (key, usage_count, last_used, first_used_at), times in
+        epoch seconds and first_used_at 0 unless the redemption sets it. All
+        records go out in a single write. Falls back to a full snapshot
+        write if a key is too long for a record. Callers doing
+        check-and-increment must hold the lock around both steps.
+        """
+        raw_updates = [(key.encode("utf-8"), *usage) for key, *usage in updates]
+        if any(len(raw_key) > 64 for raw_key, *_ in raw_updates):
+            with self.lock:
+                keys = self.all()
+                for key, usage_count, last_used, first_used in updates:
+                    keys[key]["usage_count"] = usage_count
+                    keys[key]["last_used"] = _format_timestamp(last_used)
+                    if first_used:
+                        keys[key]["first_used_at"] = _format_timestamp(first_used)
+                return self.save(keys)
+        legacy = False
+        try:
+            header = JOURNAL_HEADER.pack(JOURNAL_MAGIC, *_file_signature(self.path))
+            with self.lock, _persist_latency.time(), open(self.journal_path, 'a+b') as f:
+                f.seek(0)
+                existing = f.read(JOURNAL_HEADER.size)
+                if existing[:4] in LEGACY_JOURNAL_RECORDS and existing[4:] == header[4:]:
+                    # Older record format, still current: fold it into the snapshot first
+                    legacy = True
+                else:
+                    if existing != header:
+                        # Missing, or left over from an older snapshot: start afresh
+                        f.truncate(0)
+                        f.write(header)
+                    f.write(b"".join(JOURNAL_RECORD.pack(*update) for update in raw_updates))
+                    f.flush()
+                    if SYNC_WRITES:
+                        os.fsync(f.fileno())
+                journal_size = os.fstat(f.fileno()).st_size
+        except Exception as e:
+            STORE_ERRORS.inc(operation="persist")
+            print(f"Error saving keys: {e}")
+            return False
+        if legacy:
+            with self.lock:
+                return self.compact() and self._record_usage(updates)
+        if (journal_size - JOURNAL_HEADER.size) // JOURNAL_RECORD.size >= JOURNAL_COMPACT_THRESHOLD:
+            return self.compact()
+        return True
+
+_COLUMNS = ("key", "secret", "max_uses", "usage_count", "created_at", "last_used",
+            "expires_at", "ttl_after_first_use", "first_used_at")
+# Columns added after the first release; present in a record only when set
+_EXPIRY_COLUMNS = _COLUMNS[6:]
+
+class SnapshotKeyStore(JSONKeyStore):
+    """
+    Binary snapshot (see snapshot.py) with usage counters shared by all workers.
+
+    Workers mmap the snapshot instead of parsing keys.json, so start-up
+    does not grow with the number of keys and every lookup is one hash
+    probe into pages shared through the page cache.
+
+    Usage lives in <path>.counters (see shared_counters.py), one slot per
+    snapshot row. A redemption locks only its key's slot, so it neither
+    takes the store lock nor appends to the journal, and every worker
+    enforces max_uses against the same usage_count. Structural changes
+    still rewrite the snapshot under the store lock, folding the counters
+    into it; a journal left by an older version is replayed once into the
+    counters when they are first created.
+    """
+
+    backend = "snapshot"
+
+    def __init__(self, path: str = "keys.snap"):
+        super().__init__(path)
+        self.cache.loader = snapshot.load
+        self.counters_path = path + ".counters"
+        self._counters: Optional[SharedCounters] = None
+
+    def _counters_for(self, table: KeyTable) -> Optional[SharedCounters]:
+        """The counters mapped for `table`, possibly retired; None if there are none yet"""
+        counters = self._counters
+        if counters is None or counters.seed != table.seed or counters.retired:
+            if table.seed is None:
+                return None
+            counters = SharedCounters.open(self.counters_path, table) or counters
+            if counters is not None and counters.seed != table.seed:
+                counters = None
+            self._counters = counters
+        return counters
+
+    def _live_counters(self, table: KeyTable) -> SharedCounters:
+        """Active counters for `table`, creating them if needed (caller holds the lock)"""
+        counters = self._counters_for(table)
+        if counters is None:
+            counters = self._counters = SharedCounters.create(self.counters_path, table)
+        elif counters.retired:
+            # Retired for this very snapshot, yet nobody holds the lock: the
+            # writer died before replacing it. Its slots are still current.
+            counters.reactivate()
+        return counters
+
+    def _index(self) -> Tuple[KeyTable, KeyIndex]:
+        table = self.cache.get()
+        counters = self._counters_for(table)
+        index = self._key_index
+        if index is None or index.table is not table or index.counters is not counters:
+            index = self._key_index = KeyIndex(table, counters)
+        return table, index
+
+    def get(self, key: str) -> Optional[KeyRecord]:
+        table = self.cache.get()
+        row = table.find(key)
+        if row < 0:
+            return None
+        record = table._record(row, key)
+        counters = self._counters_for(table)
+        return counters.overlay(row, record) if counters is not None else record
+
+    def items(self) -> Iterator[Tuple[str, KeyRecord]]:
+        table = self.cache.get()
+        counters = self._counters_for(table)
+        for row, (key, record) in enumerate(table.items()):
+            yield key, (counters.overlay(row, record) if counters is not None else record)
+
+    def all(self) -> Dict[str, KeyRecord]:
+        return dict(self.items())
+
+    def data_version(self, key: str):
+        # Redemptions only write their shared counter slot, which no file
+        # signature sees, so the key's slot is part of the version
+        table = self.cache.get()
+        row = table.find(key)
+        counters = self._counters_for(table) if row >= 0 else None
+        return _file_signature(self.path), counters.get(row) if counters is not None else None
+
+    def redeem_many(self, keys: List[str]) -> List[Tuple[Optional[KeyRecord], Optional[str]]]:
+        # Each key is checked and incremented atomically on its own; a key
+        # listed twice still consumes two uses
+        table = self.cache.get()
+        validate_started = time.perf_counter()
+        now = time.time()
+        results = [self._redeem(table, key, now) for key in keys]
+        _validate_latency.observe(time.perf_counter() - validate_started)
+        if SYNC_WRITES and self._counters is not None and any(error is None for _, error in results):
+            self._sync_counters()
+        return results
+
+    def _sync_counters(self):
+        try:
+            with _persist_latency.time():
+                self._counters.mapping.flush()
+        except (OSError, ValueError) as e:
+            STORE_ERRORS.inc(operation="persist")
+            print(f"Error syncing usage counters: {e}")
+
+    def _redeem(self, table: KeyTable, key: str, now: float) -> Tuple[Optional[KeyRecord], Optional[str]]:
+        row = table.find(key)
+        if row < 0:
+            return None, rejection_reason(None)
+        counters = self._counters_for(table)
+        if counters is not None and counters.lock(row):
+            try:
+                record = counters.overlay(row, table._record(row, key))
+                # The first use of a TTL key also journals first_used_at
+                if not starts_ttl(record):
+                    return self._increment(counters, row, record, now)
+            finally:
+                counters.unlock(row)
+        # No counters yet, the snapshot is being replaced, or first_used_at
+        # must be written: take the store lock, then retry against whatever
+        # snapshot is current
+        try:
+            with self.lock:
+                table = self.cache.get()
+                row = table.find(key)
+                if row < 0:
+                    return None, rejection_reason(None)
+                counters = self._live_counters(table)
+                # Retiring needs the store lock, so this cannot fail now
+                counters.lock(row)
+                try:
+                    record = counters.overlay(row, table._record(row, key))
+                    first_use = starts_ttl(record)
+                    record, error = self._increment(counters, row, record, now)
+                finally:
+                    counters.unlock(row)
+                # Journaled after unlocking: a compaction retires the counters
+                if first_use and error is None:
+                    record["first_used_at"] = record["last_used"]
+                    self._record_usage([(key, record["usage_count"], now, now)])
+                return record, error
+        except Exception as e:
+            STORE_ERRORS.inc(operation="persist")
+            print(f"Error saving keys: {e}")
+            return self.get(key), "Failed to update key usage count"
+
+    @staticmethod
+    def _increment(counters: SharedCounters, row: int, record: KeyRecord,
+                   now: float) -> Tuple[Optional[KeyRecord], Optional[str]]:
+        """Check and consume one use of a locked row, given its current record"""
+        error = rejection_reason(record, now)
+        if error:
+            return record, error
+        encoded = encode_epoch(now)
+        record["usage_count"] = record.get("usage_count", 0) + 1
+        counters.set(row, record["usage_count"], encoded)
+        record["last_used"] = decode_timestamp(encoded)
+        return record, None
+
+    def reset_many(self, keys: List[str]) -> Dict[str, KeyRecord]:
+        previous = {}
+        try:
+            with self.lock:
+                table = self.cache.get()
+                counters = self._live_counters(table)
+                for key in keys:
+                    row = table.find(key)
+                    if row < 0:
+                        continue
+                    counters.lock(row)
+                    try:
+                        record = counters.overlay(row, table._record(row, key))
+                        previous.setdefault(key, record)
+                        # Same result as the journal: last_used kept, or null if never used
+                        counters.set(row, 0, encode_epoch(_parse_timestamp(record.get("last_used"))))
+                    finally:
+                        counters.unlock(row)
+                if SYNC_WRITES and previous:
+                    self._sync_counters()
+                return previous
+        except Exception as e:
+            STORE_ERRORS.inc(operation="persist")
+            print(f"Error saving keys: {e}")
+            return {}
+
+    def save(self, keys: Dict[str, KeyRecord]) -> bool:
+        """Write a full snapshot, folding in the current counters, and start fresh counters for it"""
+        with self.lock:
+            table = self.cache.get() if _file_signature(self.path) else KeyTable()
+            counters = self._counters_for(table)
+            if counters is not None:
+                if not counters.retired:
+                    counters.retire()
+                # Redemptions may have landed since the caller read `keys`
+                for key, record in keys.items():
+                    row = table.find(key)
+                    if row >= 0:
+                        counters.overlay(row, record)
+            if not super().save(keys):
+                if counters is not None:
+                    counters.reactivate()
+                return False
+            try:
+                self._counters = SharedCounters.create(self.counters_path, self.cache.get())
+            except Exception as e:
+                # Redemptions retry creating them under the lock
+                STORE_ERRORS.inc(operation="save")
+                print(f"Error creating usage counters: {e}")
+            return True
+
+    def _encode(self, keys: Dict[str, KeyRecord]) -> bytes:
+        return snapshot.dump(keys)
+
+    def _table(self, keys: Dict[str, KeyRecord]) -> KeyTable:
+        return snapshot.load(self.path)
+
+def _row_to_record(row) -> KeyRecord:
+    record = {
+        "secret": row[1],
+        "max_uses": row[2],
+        "usage_count": row[3],
+        "created_at": row[4]
+    }
+    if row[5] is not None:
+        record["last_used"] = row[5]
+    for name, value in zip(_EXPIRY_COLUMNS, row[6:]):
+        if value is not None:
+            record[name] = value
+    return record
+
+def _record_to_row(key: str, record: KeyRecord) -> tuple:
+    return (
+        key,
+        record.get("secret", ""),
+        record.get("max_uses", 1),
+        record.get("usage_count", 0),
+        record.get("created_at"),
+        record.get("last_used"),
+        *(record.get(name) for name in _EXPIRY_COLUMNS)
+    )
+
+# Status code (index into STATUSES) of a row, as SQL; also the expression indexed
+STATUS_SQL = ("CASE WHEN max_uses = -1 OR max_uses - usage_count > 1 THEN 0 "
+              "WHEN max_uses - usage_count = 1 THEN 1 ELSE 2 END")
+
+class SQLiteKeyStore(KeyStore):
+    """
+    Local SQLite database in WAL mode.
+
+    Redemption is a single conditional UPDATE, so the limit check and the
+    increment are atomic across threads and processes sharing the file.
+    Keys with a ttl_after_first_use (and any key the UPDATE turns down
+    although its record looks redeemable) are checked in Python instead and
+    incremented by an UPDATE conditional on the usage_count that was checked.
+    """
+
+    backend = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS keys (
+            key TEXT PRIMARY KEY,
+            secret TEXT NOT NULL,
+            max_uses INTEGER NOT NULL DEFAULT 1,
+            usage_count INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT,
+            last_used TEXT,
+            expires_at TEXT,
+            ttl_after_first_use INTEGER,
+            first_used_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS key_meta (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS keys_created_at ON keys (created_at);
+        CREATE INDEX IF NOT EXISTS keys_last_used ON keys (last_used);
+        CREATE INDEX IF NOT EXISTS keys_status ON keys ({status});
+    """.format(status=STATUS_SQL)
+
+    # Columns missing from databases created by older versions
+    ADDED_COLUMNS = (("expires_at", "TEXT"), ("ttl_after_first_use", "INTEGER"), ("first_used_at", "TEXT"))
+    ADDED_INDEXES = "CREATE INDEX IF NOT EXISTS keys_expires_at ON keys (expires_at)"
+
+    # Bumped in the same transaction as every insert or delete of keys
+    BUMP_GENERATION_SQL = """
+        INSERT INTO key_meta (name, value) VALUES ('generation', 1)
+        ON CONFLICT (name) DO UPDATE SET value = value + 1
+    """
+
+    REDEEM_SQL = f"""
+        UPDATE keys SET usage_count = usage_count + 1, last_used = ?
+        WHERE key = ? AND secret != ''
+          AND (max_uses = -1 OR usage_count < max_uses)
+          AND (expires_at IS NULL OR expires_at > ?) AND ttl_after_first_use IS NULL
+        RETURNING {', '.join(_COLUMNS)}
+    """
+
+    # After rejection_reason() passed on a record read at this usage_count
+    REDEEM_CHECKED_SQL = f"""
+        UPDATE keys SET usage_count = usage_count + 1, last_used = ?,
+            first_used_at = CASE WHEN ttl_after_first_use IS NULL THEN first_used_at
+                                 ELSE COALESCE(first_used_at, ?) END
+        WHERE key = ? AND usage_count = ? AND max_uses = ?
+        RETURNING {', '.join(_COLUMNS)}
+    """
+
+    # Keys per IN (...) list (SQLite's variable limit)
+    BATCH_CHUNK_SIZE = 500
+
+    def __init__(self, path: str = "keys.db"):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(keys)")}
+            for name, sql_type in self.ADDED_COLUMNS:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE keys ADD COLUMN {name} {sql_type}")
+            conn.execute(self.ADDED_INDEXES)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL" if SYNC_WRITES else "PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[KeyRecord]:
+        row = self._connect().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM keys WHERE key = ?", (key,)
+        ).fetchone()
+        return _row_to_record(row) if row else None
+
+    def _redeem(self, conn: sqlite3.Connection, key: str) -> Tuple[Optional[KeyRecord], Optional[str]]:
+        while True:
+            now = time.time()
+            timestamp = _format_timestamp(now)
+            rows = conn.execute(self.REDEEM_SQL, (timestamp, key, timestamp)).fetchall()
+            if rows:
+                return _row_to_record(rows[0]), None
+            record = self.get(key)
+            error = rejection_reason(record, now)
+            if error:
+                return record, error
+            rows = conn.execute(self.REDEEM_CHECKED_SQL, (timestamp, timestamp, key, record["usage_count"],
+                                                          record["max_uses"])).fetchall()
+            if rows:
+                return _row_to_record(rows[0]), None
+            # Changed since it was read: check again
+
+    def redeem(self, key: str) -> Tuple[Optional[KeyRecord], Optional[str]]:
+        try:
+            with _persist_latency.time():
+                return self._redeem(self._connect(), key)
+        except sqlite3.Error as e:
+            STORE_ERRORS.inc(operation="persist")
+            print(f"Error saving keys: {e}")
+            return self.get(key), "Failed to update key usage count"
+
+    def redeem_many(self, keys: List[str]) -> List[Tuple[Optional[KeyRecord], Optional[str]]]:
+        conn = self._connect()
+        results = []
+        try:
+            with conn, _persist_latency.time():
+                conn.execute("BEGIN IMMEDIATE")
+                for key in keys:
+                    results.append(self._redeem(conn, key))
+        except sqlite3.Error as e:
+            STORE_ERRORS.inc(operation="persist")
+            print(f"Error saving keys: {e}")
+            return [(self.get(key), "Failed to update key usage count") for key in keys]
+        return results
+
+    def add(self, key: str, secret: str, max_uses: int = 1, created_at: Optional[str] = None,
+            expires_at: Optional[str] = None, ttl_after_first_use: Optional[int] = None) -> bool:
+        return self.bulk_add({key: new_record(secret, max_uses, created_at, expires_at, ttl_after_first_use)}) == 1
+
+    def bulk_add(self, records: Dict[str, KeyRecord]) -> int:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                f"INSERT OR IGNORE INTO keys ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                (_record_to_row(key, record) for key, record in records.items())
+            )
+            added = conn.total_changes - before
+            if added:
+                conn.execute(self.BUMP_GENERATION_SQL)
+        if added:
+            self._keys_added(records)
+        return added
+
+    def _select_many(self, conn: sqlite3.Connection, keys: List[str]) -> Dict[str, KeyRecord]:
+        records = {}
+        for start in range(0, len(keys), self.BATCH_CHUNK_SIZE):
+            chunk = keys[start:start + self.BATCH_CHUNK_SIZE]
+            for row in conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM keys "
+                                    f"WHERE key IN ({', '.join('?' * len(chunk))})", chunk):
+                records[row[0]] = _row_to_record(row)
+        return records
+
+    def _update_returning_previous(self, keys: List[str], assignment: str, params: tuple) -> Dict[str, KeyRecord]:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            previous = self._select_many(conn, keys)
+            conn.executemany(f"UPDATE keys SET {assignment} WHERE key = ?", (params + (key,) for key in previous))
+            return previous
+
+    def reset_many(self, keys: List[str]) -> Dict[str, KeyRecord]:
+        return self._update_returning_previous(keys, "usage_count = 0", ())
+
+    def set_max_uses_many(self, keys: List[str], max_uses: int) -> Dict[str, KeyRecord]:
+        return self._update_returning_previous(keys, "max_uses = ?", (max_uses,))
+
+    def delete(self, key: str) -> bool:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = conn.execute("DELETE FROM keys WHERE key = ?", (key,)).rowcount > 0
+            if deleted:
+                conn.execute(self.BUMP_GENERATION_SQL)
+        if deleted:
+            self._key_deleted(key)
+        return deleted
+
+    def delete_many(self, keys: List[str], where: Optional[Callable[[KeyRecord], bool]] = None,
+                    before_delete: Optional[Callable[[Dict[str, KeyRecord]], None]] = None) -> Dict[str, KeyRecord]:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = {key: record for key, record in self._select_many(conn, keys).items()
+                       if where is None or where(record)}
+            if not deleted:
+                return {}
+            if before_delete is not None:
+                before_delete(deleted)
+            conn.executemany("DELETE FROM keys WHERE key = ?", ((key,) for key in deleted))
+            conn.execute(self.BUMP_GENERATION_SQL)
+        for key in deleted:
+            self._key_deleted(key)
+        return deleted
+
+    def items(self) -> Iterator[Tuple[str, KeyRecord]]:
+        for row in self._connect().execute(f"SELECT {', '.join(_COLUMNS)} FROM keys ORDER BY rowid"):
+            yield row[0], _row_to_record(row)
+
+    def expired_keys(self, before: Optional[float] = None, limit: Optional[int] = None) -> List[str]:
+        # Absolute expiries come from the index; TTL deadlines need Python
+        before = time.time() if before is None else before
+        matches = []
+        for key, *fields in self._connect().execute(
+                "SELECT key, expires_at, ttl_after_first_use, first_used_at FROM keys "
+                "WHERE expires_at <= ? OR (ttl_after_first_use IS NOT NULL AND first_used_at IS NOT NULL) "
+                "ORDER BY rowid", (_format_timestamp(before),)):
+            deadline = expiry({name: value for name, value in zip(_EXPIRY_COLUMNS, fields) if value is not None})
+            if deadline is not None and deadline <= before:
+                matches.append(key)
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
+
+    def membership_version(self):
+        row = self._connect().execute("SELECT value FROM key_meta WHERE name = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def data_version(self, key: str):
+        # Every commit writes to the WAL file. Frames rewritten in place after
+        # a checkpoint within one mtime tick can go unseen; the TTL covers that.
+        return _file_signature(self.path), _file_signature(self.path + "-wal")
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+
+    def query(self, status: Optional[str] = None, created_after: Optional[float] = None,
+              created_before: Optional[float] = None, used_after: Optional[float] = None,
+              used_before: Optional[float] = None, never_used: bool = False,
+              limit: Optional[int] = None) -> List[str]:
+        if status is not None and status not in STATUSES:
+            raise ValueError(f"Unknown status '{status}' (expected one of {', '.join(STATUSES)})")
+        # Each condition matches one of the indexes in SCHEMA; the status
+        # expression must be spelled exactly as indexed
+        conditions, params = [], []
+        if status is not None:
+            conditions.append(f"{STATUS_SQL} = ?")
+            params.append(STATUSES.index(status))
+        # Stored timestamps are ISO strings, which sort in time order
+        for condition, epoch in (("created_at >= ?", created_after), ("created_at < ?", created_before),
+                                 ("last_used >= ?", used_after),
+                                 ("(last_used IS NULL OR last_used < ?)", used_before)):
+            if epoch is not None:
+                conditions.append(condition)
+                params.append(_format_timestamp(epoch))
+        if never_used:
+            conditions.append("last_used IS NULL")
+        sql = "SELECT key FROM keys"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY rowid"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [row[0] for row in self._connect().execute(sql, params)]
+
+    def status_counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        for code, count in self._connect().execute(f"SELECT {STATUS_SQL}, COUNT(*) FROM keys GROUP BY 1"):
+            counts[STATUSES[code]] = count
+        return counts
+
+class SQLAlchemyKeyStore(KeyStore):
+    """
+    Any SQLAlchemy database, e.g. the deployment's PostgreSQL.
+
+    Uses SQLAlchemy Core only, so the same code runs against PostgreSQL in
+    production and against a sqlite:/// URL for local testing. Redemption is
+    a single conditional UPDATE ... RETURNING, with the same checked
+    fallback as SQLiteKeyStore for keys with a ttl_after_first_use.
+    """
+
+    backend = "sqlalchemy"
+
+    BULK_CHUNK_SIZE = 1000
+
+    def __init__(self, url: str):
+        import sqlalchemy as sa
+
+        self.sa = sa
+        self.engine = sa.create_engine(url, pool_pre_ping=True)
+        metadata = sa.MetaData()
+        # Status code (index into STATUSES). Literal SQL rather than bound
+        # parameters, so queries repeat the indexed expression exactly
+        self.status = sa.literal_column(f"({STATUS_SQL})")
+        self.table = sa.Table(
+            "keys", metadata,
+            sa.Column("key", sa.String(255), primary_key=True),
+            sa.Column("secret", sa.String(255), nullable=False),
+            sa.Column("max_uses", sa.Integer, nullable=False, default=1),
+            sa.Column("usage_count", sa.Integer, nullable=False, default=0),
+            sa.Column("created_at", sa.String(40)),
+            sa.Column("last_used", sa.String(40)),
+            sa.Column("expires_at", sa.String(40)),
+            sa.Column("ttl_after_first_use", sa.Integer),
+            sa.Column("first_used_at", sa.String(40)),
+            sa.Index("keys_created_at", "created_at"),
+            sa.Index("keys_last_used", "last_used"),
+            sa.Index("keys_status", self.status),
+            sa.Index("keys_expires_at", "expires_at"),
+        )
+        # Generation counter bumped with every insert or delete of keys
+        self.meta = sa.Table(
+            "key_meta", metadata,
+            sa.Column("name", sa.String(64), primary_key=True),
+            sa.Column("value", sa.Integer, nullable=False),
+        )
+        metadata.create_all(self.engine)
+        # create_all() neither adds columns to an existing table nor adds
+        # indexes except along with a new table, and cannot reflect
+        # expression indexes to check for them
+        existing = {column["name"] for column in sa.inspect(self.engine).get_columns("keys")}
+        with self.engine.begin() as conn:
+            for name in _EXPIRY_COLUMNS:
+                if name not in existing:
+                    column_type = self.table.c[name].type.compile(dialect=self.engine.dialect)
+                    conn.execute(sa.text(f"ALTER TABLE keys ADD COLUMN {name} {column_type}"))
+            for index in self.table.indexes:
+                conn.execute(sa.schema.CreateIndex(index, if_not_exists=True))
+
+    def _select(self):
+        return self.sa.select(*[self.table.c[name] for name in _COLUMNS])
+
+    def get(self, key: str) -> Optional[KeyRecord]:
+        with self.engine.connect() as conn:
+            row = conn.execute(self._select().where(self.table.c.key == key)).first()
+        return _row_to_record(row) if row else None
+
+    def _redeem_statement(self, key: str, timestamp: str):
+        t = self.table
+        return (
+            self.sa.update(t)
+            .where(t.c.key == key, t.c.secret != "",
+                   self.sa.or_(t.c.max_uses == -1, t.c.usage_count < t.c.max_uses),
+                   self.sa.or_(t.c.expires_at.is_(None), t.c.expires_at > timestamp),
+                   t.c.ttl_after_first_use.is_(None))
+            .values(usage_count=t.c.usage_count + 1, last_used=timestamp)
+            .returning(*[t.c[name] for name in _COLUMNS])
+        )
+
+    def _checked_redeem_statement(self, key: str, timestamp: str, record: KeyRecord):
+        """Increment after rejection_reason() passed on `record`, unless the row has changed since"""
+        t = self.table
+        sa = self.sa
+        return (
+            sa.update(t)
+            .where(t.c.key == key, t.c.usage_count == record["usage_count"], t.c.max_uses == record["max_uses"])
+            .values(usage_count=t.c.usage_count + 1, last_used=timestamp,
+                    first_used_at=sa.case((t.c.ttl_after_first_use.is_(None), t.c.first_used_at),
+                                          else_=sa.func.coalesce(t.c.first_used_at, timestamp)))
+            .returning(*[t.c[name] for name in _COLUMNS])
+        )
+
+    def _redeem(self, conn, key: str) -> Tuple[Optional[KeyRecord], Optional[str]]:
+        while True:
+            now = time.time()
+            timestamp = _format_timestamp(now)
+            row = conn.execute(self._redeem_statement(key, timestamp)).first()
+            if row:
+                return _row_to_record(row), None
+            row = conn.execute(self._select().where(self.table.c.key == key)).first()
+            record = _row_to_record(row) if row else None
+            error = rejection_reason(record, now)
+            if error:
+                return record, error
+            row = conn.execute(self._checked_redeem_statement(key, timestamp, record)).first()
+            if row:
+                return _row_to_record(row), None
+            # Changed since it was read: check again
+
+    def redeem(self, key: str) -> Tuple[Optional[KeyRecord], Optional[str]]:
+        return self.redeem_many([key])[0]
+
+    def redeem_many(self, keys: List[str]) -> List[Tuple[Optional[KeyRecord], Optional[str]]]:
+        results = []
+        try:
+            with self.engine.begin() as conn, _persist_latency.time():
+                for key in keys:
+                    results.append(self._redeem(conn, key))
+        except self.sa.exc.SQLAlchemyError as e:
+            STORE_ERRORS.inc(operation="persist")
+            print(f"Error saving keys: {e}")
+            return [(self.get(key), "Failed to update key usage count") for key in keys]
+        return results
+
+    def add(self, key: str, secret: str, max_uses: int = 1, created_at: Optional[str] = None,
+            expires_at: Optional[str] = None, ttl_after_first_use: Optional[int] = None) -> bool:
+        return self.bulk_add({key: new_record(secret, max_uses, created_at, expires_at, ttl_after_first_use)}) == 1
+
+    def bulk_add(self, records: Dict[str, KeyRecord]) -> int:
+        t = self.table
+        added = 0
+        with self.engine.begin() as conn:
+            pending = list(records.items())
+            for start in range(0, len(pending), self.BULK_CHUNK_SIZE):
+                chunk = pending[start:start + self.BULK_CHUNK_SIZE]
+                existing = set(conn.execute(
+                    self.sa.select(t.c.key).where(t.c.key.in_([key for key, _ in chunk]))
+                ).scalars())
+                rows = [dict(zip(_COLUMNS, _record_to_row(key, record)))
+                        for key, record in chunk if key not in existing]
+                if rows:
+                    conn.execute(t.insert(), rows)
+                    added += len(rows)
+            if added:
+                self._bump_generation(conn)
+        if added:
+            self._keys_added(records)
+        return added
+
+    def _bump_generation(self, conn):
+        m = self.meta
+        if not conn.execute(self.sa.update(m).where(m.c.name == "generation")
+                            .values(value=m.c.value + 1)).rowcount:
+            conn.execute(m.insert().values(name="generation", value=1))
+
+    def _select_many(self, conn, keys: List[str]) -> Dict[str, KeyRecord]:
+        """Records of `keys`, locked until the transaction ends"""
+        t = self.table
+        records = {}
+        for start in range(0, len(keys), self.BULK_CHUNK_SIZE):
+            chunk = keys[start:start + self.BULK_CHUNK_SIZE]
+            for row in conn.execute(self._select().where(t.c.key.in_(chunk)).with_for_update()):
+                records[row[0]] = _row_to_record(row)
+        return records
+
+    def _update_returning_previous(self, keys: List[str], **values) -> Dict[str, KeyRecord]:
+        t = self.table
+        with self.engine.begin() as conn:
+            previous = self._select_many(conn, keys)
+            pending = list(previous)
+            for start in range(0, len(pending), self.BULK_CHUNK_SIZE):
+                conn.execute(self.sa.update(t).where(t.c.key.in_(pending[start:start + self.BULK_CHUNK_SIZE]))
+                             .values(**values))
+        return previous
+
+    def reset_many(self, keys: List[str]) -> Dict[str, KeyRecord]:
+        return self._update_returning_previous(keys, usage_count=0)
+
+    def set_max_uses_many(self, keys: List[str], max_uses: int) -> Dict[str, KeyRecord]:
+        return self._update_returning_previous(keys, max_uses=max_uses)
+
+    def delete(self, key: str) -> bool:
+        with self.engine.begin() as conn:
+            deleted = conn.execute(self.sa.delete(self.table).where(self.table.c.key == key)).rowcount > 0
+            if deleted:
+                self._bump_generation(conn)
+        if deleted:
+            self._key_deleted(key)
+        return deleted
+
+    def delete_many(self, keys: List[str], where: Optional[Callable[[KeyRecord], bool]] = None,
+                    before_delete: Optional[Callable[[Dict[str, KeyRecord]], None]] = None) -> Dict[str, KeyRecord]:
+        t = self.table
+        with self.engine.begin() as conn:
+            deleted = {key: record for key, record in self._select_many(conn, keys).items()
+                       if where is None or where(record)}
+            if not deleted:
+                return {}
+            if before_delete is not None:
+                before_delete(deleted)
+            pending = list(deleted)
+            for start in range(0, len(pending), self.BULK_CHUNK_SIZE):
+                conn.execute(self.sa.delete(t).where(t.c.key.in_(pending[start:start + self.BULK_CHUNK_SIZE])))
+            self._bump_generation(conn)
+        for key in deleted:
+            self._key_deleted(key)
+        return deleted
+
+    def items(self) -> Iterator[Tuple[str, KeyRecord]]:
+        with self.engine.connect() as conn:
+            for row in conn.execution_options(stream_results=True).execute(self._select()):
+                yield row[0], _row_to_record(row)
+
+    def expired_keys(self, before: Optional[float] = None, limit: Optional[int] = None) -> List[str]:
+        # Absolute expiries come from the index; TTL deadlines need Python
+        t = self.table
+        before = time.time() if before is None else before
+        statement = (self.sa.select(t.c.key, *[t.c[name] for name in _EXPIRY_COLUMNS])
+                     .where(self.sa.or_(t.c.expires_at <= _format_timestamp(before),
+                                        self.sa.and_(t.c.ttl_after_first_use.isnot(None),
+                                                     t.c.first_used_at.isnot(None))))
+                     .order_by(t.c.key))
+        matches = []
+        with self.engine.connect() as conn:
+            for key, *fields in conn.execute(statement):
+                deadline = expiry({name: value for name, value in zip(_EXPIRY_COLUMNS, fields) if value is not None})
+                if deadline is not None and deadline <= before:
+                    matches.append(key)
+                    if limit is not None and len(matches) >= limit:
+                        break
+        return matches
+
+    def count(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(self.sa.select(self.sa.func.count()).select_from(self.table)).scalar()
+
+    def membership_version(self):
+        with self.engine.connect() as conn:
+            return conn.execute(self.sa.select(self.meta.c.value)
+                                .where(self.meta.c.name == "generation")).scalar() or 0
+
+    def query(self, status: Optional[str] = None, created_after: Optional[float] = None,
+              created_before: Optional[float] = None, used_after: Optional[float] = None,
+              used_before: Optional[float] = None, never_used: bool = False,
+              limit: Optional[int] = None) -> List[str]:
+        if status is not None and status not in STATUSES:
+            raise ValueError(f"Unknown status '{status}' (expected one of {', '.join(STATUSES)})")
+        t = self.table
+        statement = self.sa.select(t.c.key)
+        if status is not None:
+            statement = statement.where(self.status == STATUSES.index(status))
+        if created_after is not None:
+            statement = statement.where(t.c.created_at >= _format_timestamp(created_after))
+        if created_before is not None:
+            statement = statement.where(t.c.created_at < _format_timestamp(created_before))
+        if used_after is not None:
+            statement = statement.where(t.c.last_used >= _format_timestamp(used_after))
+        if used_before is not None:
+            statement = statement.where(self.sa.or_(t.c.last_used.is_(None),
+                                                    t.c.last_used < _format_timestamp(used_before)))
+        if never_used:
+            statement = statement.where(t.c.last_used.is_(None))
+        statement = statement.order_by(t.c.key).limit(limit)
+        with self.engine.connect() as conn:
+            return list(conn.execute(statement).scalars())
+
+    def status_counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        statement = self.sa.select(self.status, self.sa.func.count()).select_from(self.table).group_by(self.status)
+        with self.engine.connect() as conn:
+            for code, count in conn.execute(statement):
+                counts[STATUSES[code]] = count
+        return counts
+
+BACKENDS = {
+    "json": JSONKeyStore,
+    "snapshot": SnapshotKeyStore,
+    "sqlite": SQLiteKeyStore,
+    "sqlalchemy": SQLAlchemyKeyStore,
+}
+
+DEFAULT_LOCATIONS = {
+    "json": os.environ.get("KEYS_FILE", "keys.json"),
+    "snapshot": "keys.snap",
+    "sqlite": "keys.db",
+    "sqlalchemy": os.environ.get("DATABASE_URL"),
+}
+
+def create_key_store(backend: Optional[str] = None, location: Optional[str] = None) -> KeyStore:
+    """
+    Create a key store
+
+    Args:
+        backend: "json", "snapshot", "sqlite" or "sqlalchemy". Defaults to
+            the KEY_STORE_BACKEND environment variable, then "json".
+        location: File path or database URL. Defaults to KEY_STORE_URL, then
+            the backend's default (keys.json, keys.snap, keys.db or DATABASE_URL).
+    """
+    backend = backend or os.environ.get("KEY_STORE_BACKEND", "json")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown key store backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+    location = location or os.environ.get("KEY_STORE_URL") or DEFAULT_LOCATIONS[backend]
+    if not location:
+        raise ValueError(f"No location configured for the '{backend}' key store")
+    return BACKENDS[backend](location)
+
+_default_store: Optional[KeyStore] = None
+_default_store_lock = threading.Lock()
+
+def configure_key_store(backend: Optional[str] = None, location: Optional[str] = None) -> KeyStore:
+    """Create the process-wide key store used by totp_generator and key_manager"""
+    global _default_store
+    with _default_store_lock:
+        _default_store = create_key_store(backend, location)
+        return _default_store
+
+def get_key_store() -> KeyStore:
+    """Return the process-wide key store, creating it from the environment on first use"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = create_key_store()
+    return _default_store
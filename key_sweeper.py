@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Archive expired and depleted keys out of the hot store
+
+A key that can never be redeemed again (depleted, or past its expiry, see
+key_store.expiry()) still costs every worker memory and load time. The
+sweeper moves such keys into an append-only cold file (KEYS_ARCHIVE_FILE,
+default keys.archive.jsonl): one JSON object per line, in the format
+bulk_keys.py imports, plus the time it was archived.
+
+Keys go in batches of KEYS_SWEEP_BATCH. Each batch is one
+KeyStore.delete_many() call, i.e. one snapshot rewrite or one transaction,
+so the file backends default to a single batch (0) and the databases to
+1000 keys, which keeps each transaction's locks short. A batch's records
+are appended to the archive and fsynced before its delete is committed. A
+crash in between leaves a key in both places, never in neither; the next
+sweep archives it again.
+
+Only keys that have been unusable for KEYS_SWEEP_GRACE seconds (default
+one day) are swept, so a key that has just run out can still be inspected
+or reset with key_manager.py.
+
+Run it once, e.g. from cron:
+    python key_sweeper.py
+    python key_sweeper.py --dry-run --grace 0
+or in every app worker with KEYS_SWEEP_INTERVAL=<seconds>. A lock file next
+to the archive lets only one process sweep at a time; the others skip.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from key_index import DEPLETED, record_status
+from key_store import KeyRecord, _query_timestamp, create_key_store, expiry, utc_timestamp
+from metrics import Counter
+
+KEYS_SWEPT = Counter("keyapi_keys_swept_total", "Keys moved to the archive by the sweeper", ("reason",))
+_swept_expired = KEYS_SWEPT.labels(reason="expired")
+_swept_depleted = KEYS_SWEPT.labels(reason="depleted")
+
+# Every file-backend batch rewrites the whole snapshot, so sweep in one
+DEFAULT_BATCH_SIZES = {"json": 0, "snapshot": 0, "sqlite": 1000, "sqlalchemy": 1000}
+
+def default_batch_size(store) -> int:
+    return int(os.environ.get("KEYS_SWEEP_BATCH", DEFAULT_BATCH_SIZES.get(store.backend, 1000)))
+
+def sweep_reason(record: KeyRecord, cutoff: float) -> Optional[str]:
+    """"expired" or "depleted" if the key has been unusable since before `cutoff`, else None"""
+    deadline = expiry(record)
+    if deadline is not None and deadline <= cutoff:
+        return "expired"
+    if record_status(record) == DEPLETED and _query_timestamp(record.get("last_used")) < cutoff:
+        return "depleted"
+    return None
+
+class KeySweeper:
+    """Moves unusable keys from a store into an archive file"""
+
+    def __init__(self, store, archive_path: str = "keys.archive.jsonl", batch_size: int = 1000,
+                 grace: float = 86400.0):
+        """batch_size 0 archives everything in one batch"""
+        if batch_size < 0:
+            raise ValueError("batch_size must not be negative")
+        self.store = store
+        self.archive_path = archive_path
+        self.batch_size = batch_size
+        self.grace = grace
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def candidates(self, now: Optional[float] = None) -> List[str]:
+        """Keys a sweep at `now` would archive, from the store's indexes"""
+        cutoff = (time.time() if now is None else now) - self.grace
+        keys = self.store.expired_keys(before=cutoff)
+        seen = set(keys)
+        keys += [key for key in self.store.query(status="depleted", used_before=cutoff) if key not in seen]
+        return keys
+
+    def sweep(self, now: Optional[float] = None) -> Optional[Dict[str, int]]:
+        """
+        Archive every sweepable key
+
+        Returns the number of keys archived per reason, or None if another
+        process is sweeping right now.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - self.grace
+        lock_fd = os.open(self.archive_path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            swept = {"expired": 0, "depleted": 0}
+            keys = self.candidates(now)
+            batch_size = self.batch_size or len(keys)
+            for start in range(0, len(keys), batch_size):
+                # Re-checked against the current record inside the store's lock
+                batch = self.store.delete_many(keys[start:start + batch_size],
+                                               where=lambda record: sweep_reason(record, cutoff) is not None,
+                                               before_delete=self._archive)
+                for record in batch.values():
+                    swept[sweep_reason(record, cutoff)] += 1
+            _swept_expired.inc(swept["expired"])
+            _swept_depleted.inc(swept["depleted"])
+            return swept
+        finally:
+            os.close(lock_fd)
+
+    def _archive(self, records: Dict[str, KeyRecord]):
+        archived_at = utc_timestamp()
+        lines = "".join(json.dumps({"key": key, **record, "archived_at": archived_at}) + "\n"
+                        for key, record in records.items())
+        with open(self.archive_path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, interval: float) -> threading.Thread:
+        """Sweep every `interval` seconds on a daemon thread until stop()"""
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="key-sweeper", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                swept = self.sweep()
+            except Exception as e:
+                print(f"Error sweeping keys: {e}")
+                continue
+            if swept and any(swept.values()):
+                print(f"🧹 Archived {swept['expired']} expired and {swept['depleted']} depleted keys "
+                      f"to {self.archive_path}")
+
+def sweeper_from_env(store) -> Optional[KeySweeper]:
+    """
+    Start the background sweeper for `store` described by the environment
+
+    Returns None (no background sweeping) unless KEYS_SWEEP_INTERVAL is set
+    above 0.
+    """
+    interval = float(os.environ.get("KEYS_SWEEP_INTERVAL", "0"))
+    if interval <= 0:
+        return None
+    sweeper = KeySweeper(store,
+                         archive_path=os.environ.get("KEYS_ARCHIVE_FILE", "keys.archive.jsonl"),
+                         batch_size=default_batch_size(store),
+                         grace=float(os.environ.get("KEYS_SWEEP_GRACE", "86400")))
+    sweeper.start(interval)
+    return sweeper
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["json", "snapshot", "sqlite", "sqlalchemy"],
+                        help="key store backend (default: KEY_STORE_BACKEND or json)")
+    parser.add_argument("--url", help="key store file or database URL (default: KEY_STORE_URL)")
+    parser.add_argument("--archive", default=os.environ.get("KEYS_ARCHIVE_FILE", "keys.archive.jsonl"),
+                        help="archive file (default: KEYS_ARCHIVE_FILE or keys.archive.jsonl)")
+    parser.add_argument("--batch-size", type=int,
+                        help="keys per delete, 0 for one batch (default: KEYS_SWEEP_BATCH, else per backend)")
+    parser.add_argument("--grace", type=float, default=float(os.environ.get("KEYS_SWEEP_GRACE", "86400")),
+                        help="seconds a key must have been unusable before it is archived")
+    parser.add_argument("--dry-run", action="store_true", help="only count the keys that would be archived")
+    args = parser.parse_args(argv)
+
+    store = create_key_store(args.backend, args.url)
+    batch_size = default_batch_size(store) if args.batch_size is None else args.batch_size
+    sweeper = KeySweeper(store, args.archive, batch_size, args.grace)
+    if args.dry_run:
+        print(f"🔍 {len(sweeper.candidates())} keys would be archived to {args.archive}")
+        return 0
+    started = time.perf_counter()
+    swept = sweeper.sweep()
+    if swept is None:
+        print("⚠️  Another sweep is running; nothing done")
+        return 1
+    print(f"✅ Archived {swept['expired']} expired and {swept['depleted']} depleted keys "
+          f"to {args.archive} in {time.perf_counter() - started:.2f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
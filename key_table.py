@@ -0,0 +1,286 @@
+"""
+Compact in-memory table of key records
+
+A dict of dicts costs roughly 440 bytes per key once the ISO timestamps and
+per-record secret strings are counted. KeyTable holds the same data as
+columns instead:
+
+- keys:        UTF-8 bytes in one bytearray, located by an offsets array
+- index:       open-addressing hash table of row numbers (load <= 0.7)
+- secret:      index into a table of distinct secrets (keys share secrets)
+- max_uses, usage_count:     int32 columns
+- created_at, last_used:    int64 encoded timestamps (see encode_timestamp;
+  last_used 0 = absent, -1 = present but null, as after a reset)
+
+which comes to about 55 bytes per key for 13-character keys. Records are materialized as
+ordinary keys.json-style dicts on lookup, so callers see the same shape as
+before. A record that would not survive the round trip exactly (extra
+fields, unusual timestamp formats, non-integer counts) is kept as a plain
+dict instead, so nothing in keys.json is ever rewritten differently.
+
+The key set is fixed once built; only usage_count, last_used and (for keys
+with an expiry, which are always kept as dicts) first_used_at change in
+place (journal replay). Adding or deleting keys builds a new table.
+"""
+
+import re
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+KeyRecord = Dict[str, Any]
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_INT32 = (-2 ** 31, 2 ** 31 - 1)
+# last_used column value for a record whose last_used is present but null
+NULL_TIMESTAMP = -1
+MAX_LOAD = 0.7
+
+_TIMESTAMP_FORMAT = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d{6})?Z")
+
+@lru_cache(maxsize=65536)
+def encode_timestamp(value: Optional[str]) -> Optional[int]:
+    """
+    ISO "...Z" timestamp as an integer: microseconds since the epoch, shifted
+    left one bit, with the low bit set if the string had no fractional part
+
+    Returns 0 for a missing timestamp, and None for anything that
+    decode_timestamp() would not reproduce exactly.
+    """
+    if value is None:
+        return 0
+    if not isinstance(value, str) or not _TIMESTAMP_FORMAT.fullmatch(value):
+        return None
+    try:
+        parsed = datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                          int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                          int(value[20:26]) if len(value) == 27 else 0, tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    micros = (parsed - _EPOCH) // _MICROSECOND
+    if micros <= 0:
+        return None
+    return micros << 1 | (len(value) == 20)
+
+def encode_epoch(epoch: float) -> int:
+    """Encoded timestamp for epoch seconds (0 = present but null)"""
+    return round(epoch * 1_000_000) << 1 if epoch else NULL_TIMESTAMP
+
+@lru_cache(maxsize=4096)
+def decode_timestamp(encoded: int) -> Optional[str]:
+    # strftime over gmtime is about twice as fast as datetime arithmetic, and
+    # bulk-imported keys share created_at values, hence the cache
+    if encoded <= 0:
+        return None
+    seconds, micros = divmod(encoded >> 1, 1_000_000)
+    text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+    return text + "Z" if encoded & 1 else f"{text}.{micros:06d}Z"
+
+# secret_ids value for a row whose record lives in the overflow dict
+OVERFLOW = 0xFFFFFFFF
+
+# Columns in row order, with their array typecodes
+COLUMNS = (("secret_ids", "I"), ("max_uses", "i"), ("usage_count", "i"),
+           ("created_at", "q"), ("last_used", "q"))
+
+def stable_hash(key: str, seed: bytes) -> int:
+    """Key hash that is the same in every process (for on-disk indexes)"""
+    return int.from_bytes(blake2b(key.encode("utf-8"), digest_size=8, key=seed).digest(), "little")
+
+class KeyTable:
+    """
+    Read-mostly mapping of key -> record held as packed columns
+
+    Supports the read side of a dict (get, [], in, len, iteration, items)
+    and set_usage() for in-place usage updates. get() and [] return a new
+    dict each time, which callers may modify freely.
+
+    With a `seed`, the index uses stable_hash() instead of the per-process
+    str hash, so it stays valid when written to disk (see snapshot.py).
+    """
+
+    def __init__(self, records: Optional[Dict[str, KeyRecord]] = None, seed: Optional[bytes] = None):
+        self.seed = seed
+        self._set_hash()
+        self.key_blob = bytearray()
+        self.key_offsets = array("I", [0])
+        self.secrets: List[str] = []
+        self._secret_ids: Dict[str, int] = {}
+        self.secret_ids = array("I")
+        self.max_uses = array("i")
+        self.usage_count = array("i")
+        self.created_at = array("q")
+        self.last_used = array("q")
+        # Records that do not fit the columns, kept verbatim. They still get
+        # a row (secret id OVERFLOW) so lookups and ordering work the same.
+        self.overflow: Dict[str, KeyRecord] = {}
+        self.index = array("I")
+        # Rows whose usage set_usage() changed, while a KeyIndex is watching
+        self.dirty: Optional[set] = None
+        if records:
+            self._extend(records)
+        self._build_index()
+
+    def _extend(self, records: Dict[str, KeyRecord]):
+        # Runs once per key on every snapshot load, hence the local aliases
+        secret_ids, secrets, overflow = self._secret_ids, self.secrets, self.overflow
+        blob, offsets = self.key_blob, self.key_offsets
+        columns = (self.secret_ids, self.max_uses, self.usage_count, self.created_at, self.last_used)
+        appends = [column.append for column in columns]
+        add_secret, add_max_uses, add_usage, add_created, add_last_used = appends
+        low, high = _INT32
+        for key, record in records.items():
+            try:
+                secret = record["secret"]
+                max_uses = record["max_uses"]
+                usage_count = record["usage_count"]
+                created_at = encode_timestamp(record["created_at"])
+                if len(record) == 4:
+                    last_used = 0
+                else:
+                    last_used = record["last_used"]
+                    last_used = NULL_TIMESTAMP if last_used is None else encode_timestamp(last_used)
+                packed = (len(record) <= 5 and created_at and last_used is not None
+                          and type(secret) is str and type(max_uses) is int and type(usage_count) is int
+                          and low <= max_uses <= high and low <= usage_count <= high)
+            except (KeyError, TypeError):
+                packed = False
+            if packed:
+                secret_id = secret_ids.get(secret)
+                if secret_id is None:
+                    secret_id = secret_ids[secret] = len(secrets)
+                    secrets.append(secret)
+            else:
+                overflow[key] = dict(record) if isinstance(record, dict) else record
+                secret_id, max_uses, usage_count, created_at, last_used = OVERFLOW, 0, 0, 0, 0
+            blob += key.encode("utf-8")
+            offsets.append(len(blob))
+            add_secret(secret_id)
+            add_max_uses(max_uses)
+            add_usage(usage_count)
+            add_created(created_at)
+            add_last_used(last_used)
+
+    def _set_hash(self):
+        seed = self.seed
+        # In memory only, the built-in (per-process seeded) str hash is fine,
+        # and it is cached on the caller's str
+        self._hash = hash if seed is None else (lambda key: stable_hash(key, seed))
+
+    def _build_index(self):
+        rows = len(self.secret_ids)
+        # Appending over-allocates; copy each column to its exact length
+        for name in ("key_offsets",) + tuple(name for name, _ in COLUMNS):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, column))
+        self.key_blob = bytearray(self.key_blob)
+        size = max(8, int(rows / MAX_LOAD) + 1)
+        index = array("I", bytes(4 * size))
+        blob, offsets, key_hash = self.key_blob, self.key_offsets, self._hash
+        for row in range(rows):
+            slot = key_hash(blob[offsets[row]:offsets[row + 1]].decode("utf-8")) % size
+            while index[slot]:
+                slot = (slot + 1) % size
+            # Row numbers are stored +1 so that 0 marks an empty slot
+            index[slot] = row + 1
+        self.index = index
+
+    def find(self, key: str) -> int:
+        """Row number of a packed key, or -1"""
+        raw_key = key.encode("utf-8")
+        index, blob, offsets = self.index, self.key_blob, self.key_offsets
+        size = len(index)
+        slot = self._hash(key) % size
+        while True:
+            row = index[slot]
+            if not row:
+                return -1
+            row -= 1
+            if blob[offsets[row]:offsets[row + 1]] == raw_key:
+                return row
+            slot = (slot + 1) % size
+
+    def _record(self, row: int, key: Optional[str] = None) -> KeyRecord:
+        secret_id = self.secret_ids[row]
+        if secret_id == OVERFLOW:
+            if key is None:
+                key = self._key(row)
+            return dict(self.overflow[key])
+        record = {
+            "secret": self.secrets[secret_id],
+            "max_uses": self.max_uses[row],
+            "usage_count": self.usage_count[row],
+            "created_at": decode_timestamp(self.created_at[row]),
+        }
+        last_used = self.last_used[row]
+        if last_used:
+            record["last_used"] = decode_timestamp(last_used)
+        return record
+
+    def _key(self, row: int) -> str:
+        return str(self.key_blob[self.key_offsets[row]:self.key_offsets[row + 1]], "utf-8")
+
+    def get(self, key: str, default=None) -> Optional[KeyRecord]:
+        row = self.find(key)
+        return self._record(row, key) if row >= 0 else default
+
+    def __getitem__(self, key: str) -> KeyRecord:
+        record = self.get(key)
+        if record is None:
+            raise KeyError(key)
+        return record
+
+    def __contains__(self, key: str) -> bool:
+        return self.find(key) >= 0
+
+    def __len__(self) -> int:
+        return len(self.secret_ids)
+
+    def __iter__(self) -> Iterator[str]:
+        for row in range(len(self.secret_ids)):
+            yield self._key(row)
+
+    keys = __iter__
+
+    def items(self) -> Iterator[Tuple[str, KeyRecord]]:
+        for row in range(len(self.secret_ids)):
+            key = self._key(row)
+            yield key, self._record(row, key)
+
+    def set_usage(self, key: str, usage_count: int, last_used: float, first_used: float = 0.0) -> bool:
+        """
+        Update usage in place; False if unknown
+
+        Times are epoch seconds: last_used 0 = never, first_used (the
+        first_used_at of a TTL key) 0 = unchanged.
+        """
+        encoded = encode_epoch(last_used)
+        row = self.find(key)
+        if row < 0:
+            return False
+        if self.dirty is not None:
+            self.dirty.add(row)
+        if self.secret_ids[row] != OVERFLOW and (first_used or not _INT32[0] <= usage_count <= _INT32[1]):
+            self.overflow[key] = self._record(row, key)
+            self.secret_ids[row] = OVERFLOW
+        if self.secret_ids[row] == OVERFLOW:
+            record = self.overflow[key]
+            record["usage_count"] = usage_count
+            record["last_used"] = decode_timestamp(encoded)
+            if first_used:
+                record["first_used_at"] = decode_timestamp(encode_epoch(first_used))
+            return True
+        self.usage_count[row] = usage_count
+        self.last_used[row] = encoded
+        return True
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes held by the packed columns and index"""
+        columns = (self.key_offsets, self.secret_ids, self.max_uses, self.usage_count,
+                   self.created_at, self.last_used, self.index)
+        return (len(self.key_blob) + sum(column.itemsize * len(column) for column in columns)
+                + sum(len(secret) + 49 for secret in self.secrets))
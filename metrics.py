@@ -0,0 +1,350 @@
+"""
+In-process metrics in the Prometheus text exposition format
+
+Counters and histograms are plain Python objects guarded by a lock, so
+recording a sample costs well under a microsecond and they can stay on in
+production.
+
+Each process keeps its own values. Once the serving app has called
+share_between_workers(), every gunicorn worker also writes them to a file
+in a directory shared by the server's workers, every
+METRICS_FLUSH_INTERVAL seconds (default 5) and whenever it answers a
+scrape. A scrape, whichever worker answers it, sums counters and
+histograms over all of those files, including those of workers that have
+exited, so the series stay monotonic and rates are meaningful.
+
+The directory is METRICS_DIR if set, used as is; it should be emptied
+before the server starts. Otherwise, in a gunicorn worker, it is
+/dev/shm/keyapi_metrics.<master pid>, new for every server run, and ones
+left by servers that are no longer running are removed. A process with no
+gunicorn master (python app.py, a single uvicorn process, uvicorn's own
+--workers) has no server to share with unless METRICS_DIR is set. There,
+with METRICS_DIR=off, or in a process that never called
+share_between_workers(), a scrape reports the process's own values with a
+`worker` label on each sample.
+
+Gauges are read at scrape time in the worker that answers it.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from server_files import server_path
+
+# Latency buckets in seconds, from 50us (cached lookups) to 10s (cold loads)
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+DIR_PREFIX = "keyapi_metrics."
+
+_registry: List["_Metric"] = []
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "",
+                   worker: bool = False) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if worker:
+        pairs.append(f'worker="{os.getpid()}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def labels(self, **labels):
+        """
+        The child series for one set of label values
+
+        Hot paths bind their children once at import time, which skips the
+        label lookup on every sample.
+        """
+        key = tuple([str(labels[name]) for name in self.labelnames])
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def snapshot(self) -> List[list]:
+        """This process's values, as [label values, value] pairs that merge() adds up"""
+        return []
+
+    @staticmethod
+    def merge(total, value):
+        return total + value
+
+    def samples(self, values: Dict[Tuple[str, ...], Any], worker: bool) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, snapshots: Optional[List[Dict[str, List[list]]]] = None) -> str:
+        """
+        The metric's samples: this process's own values, or the sum over
+        `snapshots` (every worker's snapshot(), keyed by metric name)
+        """
+        if snapshots is None:
+            values = dict((tuple(key), value) for key, value in self.snapshot())
+        else:
+            values: Dict[Tuple[str, ...], Any] = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(self.name, ()):
+                    key = tuple(key)
+                    values[key] = self.merge(values[key], value) if key in values else value
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples(values, worker=snapshots is None))
+        return "\n".join(lines)
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels"""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1, **labels):
+        self.labels(**labels).inc(amount)
+
+    def value(self, **labels) -> float:
+        return self.labels(**labels).value
+
+    def snapshot(self) -> List[list]:
+        return [[list(key), child.value] for key, child in list(self._children.items())]
+
+    def samples(self, values: Dict[Tuple[str, ...], Any], worker: bool) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key, worker=worker)} {value}"
+                for key, value in values.items()]
+
+class _HistogramChild:
+    __slots__ = ("_lock", "buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> "_Timer":
+        """Observe the wall-clock duration of a with-block"""
+        return _Timer(self)
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float, **labels):
+        self.labels(**labels).observe(value)
+
+    def time(self, **labels) -> "_Timer":
+        """Observe the wall-clock duration of a with-block"""
+        return _Timer(self.labels(**labels))
+
+    def snapshot(self) -> List[list]:
+        """[label values, [bucket counts, sum]] per child"""
+        values = []
+        for key, child in list(self._children.items()):
+            with child._lock:
+                values.append([list(key), [list(child.counts), child.sum]])
+        return values
+
+    @staticmethod
+    def merge(total, value):
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1]]
+
+    def samples(self, values: Dict[Tuple[str, ...], Any], worker: bool) -> List[str]:
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % le, worker=worker)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key, worker=worker)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key, worker=worker)} {cumulative}")
+        return lines
+
+class _Timer:
+    # A plain class rather than @contextmanager: this sits on every request
+    # path and a generator-based context manager costs several times more
+    __slots__ = ("child", "started")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+class GaugeFunction(_Metric):
+    """Gauge whose value is read from a callback at scrape time, in the worker answering it"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def render(self, snapshots=None) -> str:
+        try:
+            value = self.func()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            value = None
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if value is not None:
+            lines.append(f"{self.name}{_format_labels((), (), worker=snapshots is None)} {value}")
+        return "\n".join(lines)
+
+class _WorkerFiles:
+    """This process's values in a file, next to those of the server's other workers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = False
+        self.directory: Optional[str] = None
+        self.path: Optional[str] = None
+
+    def start(self):
+        """Share this process's values, and those of processes forked from it"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._setup()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A forked worker has none of the parent's threads and needs its own file
+        self._lock = threading.Lock()
+        self._setup()
+
+    def _setup(self):
+        self.directory = self.path = None
+        configured = os.environ.get("METRICS_DIR")
+        if configured == "off":
+            return
+        directory = configured or server_path(DIR_PREFIX)
+        if directory is None:
+            # No gunicorn master: nothing identifies the other workers, if any
+            return
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            print(f"Error creating metrics directory {directory}: {e}")
+            return
+        self.directory = directory
+        # Unique per process, so a reused pid never overwrites an exited worker's totals
+        self.path = os.path.join(directory, f"{os.getpid()}-{time.time_ns()}.json")
+        threading.Thread(target=self._flush_loop, args=(self.path,), name="metrics-flush", daemon=True).start()
+
+    def flush(self):
+        """Write this process's current values"""
+        with self._lock:
+            path = self.path
+            if path is None:
+                return
+            snapshot = {metric.name: metric.snapshot() for metric in _registry}
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(snapshot, f, separators=(",", ":"))
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Error writing metrics to {path}: {e}")
+
+    def _flush_loop(self, path: str):
+        while self.path == path:
+            self.flush()
+            time.sleep(FLUSH_INTERVAL)
+
+    def snapshots(self) -> Optional[List[Dict[str, List[list]]]]:
+        """Every worker's latest values, this one's current; None if they are not shared"""
+        directory = self.directory
+        if directory is None:
+            return None
+        self.flush()
+        snapshots = []
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Replaced or removed while listing
+                continue
+        return snapshots
+
+_worker_files = _WorkerFiles()
+
+def share_between_workers():
+    """
+    Sum metrics over every worker of this server (see the module docstring)
+
+    Called by the serving app at import, so command-line tools that record
+    metrics keep them to themselves.
+    """
+    _worker_files.start()
+
+def render() -> str:
+    """All registered metrics in Prometheus text format, summed over the server's workers"""
+    snapshots = _worker_files.snapshots()
+    return "\n".join(metric.render(snapshots) for metric in _registry) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request outcomes: success, invalid_key, depleted, storage_error (and valid for lookups)
+REQUESTS = Counter("keyapi_requests_total", "API requests by endpoint and outcome", ("endpoint", "outcome"))
+REQUEST_LATENCY = Histogram("keyapi_request_duration_seconds", "End-to-end request latency", ("endpoint",))
+# Stages: load (snapshot parse / journal replay), validate, totp, persist
+STAGE_LATENCY = Histogram("keyapi_stage_duration_seconds", "Time spent in each redemption stage", ("stage",))
+KEY_CACHE_LOOKUPS = Counter("keyapi_key_cache_lookups_total", "Key cache lookups by result (hit, reload)", ("result",))
+TOTP_CACHE_LOOKUPS = Counter("keyapi_totp_cache_lookups_total", "TOTP code cache lookups by result (hit, miss)", ("result",))
+STORE_ERRORS = Counter("keyapi_store_errors_total", "Key store read/write failures", ("operation",))
@@ -0,0 +1,238 @@
+"""
+Token-bucket rate limiting for the key API
+
+Every API request draws one token from a bucket for the client IP and one
+from a bucket per key it names. Buckets refill continuously at `rate`
+tokens per second up to `burst`; a request is allowed only if every bucket
+it touches has a token, and then all of them are charged together.
+
+Two bucket stores are provided and selected by configuration:
+
+- "memory": a dict in this process (each gunicorn worker limits on its own)
+- "sqlite": a small SQLite file shared by all workers of a gunicorn
+  server; by default /dev/shm/keyapi_rate_limit.<master pid>.db, so it is
+  effectively shared memory and never shared with another server on the
+  host. A process that is not a gunicorn worker has no such file and
+  limits in memory unless RATE_LIMIT_PATH names one
+
+A bucket that has refilled to `burst` is identical to one that never
+existed, so both stores evict buckets once they are full again.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from server_files import server_path
+
+# (bucket name, refill rate in tokens/second, burst capacity)
+Bucket = Tuple[str, float, float]
+
+def _refill(tokens: float, updated: float, rate: float, burst: float, now: float) -> float:
+    return min(burst, tokens + (now - updated) * rate)
+
+def _full_at(tokens: float, rate: float, burst: float, now: float) -> float:
+    """When a bucket holding `tokens` at `now` will be full again"""
+    return now + (burst - tokens) / rate
+
+class BucketStore:
+    """Interface for token bucket state"""
+
+    def take(self, buckets: List[Bucket], now: float) -> float:
+        """
+        Charge one token from every bucket, or none of them
+
+        Returns:
+            0.0 if the tokens were taken, otherwise the seconds until every
+            bucket has a token again
+        """
+        raise NotImplementedError
+
+class MemoryBucketStore(BucketStore):
+    """Buckets held in a dict, private to this process"""
+
+    # Full buckets are swept at most this often
+    EVICT_INTERVAL = 60.0
+
+    def __init__(self):
+        # name -> [tokens, updated, full_at]
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._next_evict = 0.0
+
+    def take(self, buckets: List[Bucket], now: float) -> float:
+        with self._lock:
+            if now >= self._next_evict:
+                self._evict(now)
+            levels = []
+            wait = 0.0
+            for name, rate, burst in buckets:
+                state = self._buckets.get(name)
+                tokens = burst if state is None else _refill(state[0], state[1], rate, burst, now)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                levels.append(tokens)
+            if wait:
+                return wait
+            for (name, rate, burst), tokens in zip(buckets, levels):
+                tokens -= 1
+                self._buckets[name] = [tokens, now, _full_at(tokens, rate, burst, now)]
+            return 0.0
+
+    def _evict(self, now: float):
+        self._buckets = {name: state for name, state in self._buckets.items() if state[2] > now}
+        self._next_evict = now + self.EVICT_INTERVAL
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+class SQLiteBucketStore(BucketStore):
+    """Buckets in a SQLite file shared by every process that opens `path`"""
+
+    EVICT_INTERVAL = 60.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._next_evict = 0.0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " name TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated REAL NOT NULL,"
+            " full_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Bucket state is disposable; never wait on fsync for it
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def take(self, buckets: List[Bucket], now: float) -> float:
+        conn = self._connect()
+        names = [name for name, _, _ in buckets]
+        with conn:
+            # IMMEDIATE takes the write lock up front, so the read-modify-write
+            # below cannot interleave with another worker's
+            conn.execute("BEGIN IMMEDIATE")
+            if now >= self._next_evict:
+                conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+                self._next_evict = now + self.EVICT_INTERVAL
+            rows = conn.execute(
+                f"SELECT name, tokens, updated FROM buckets WHERE name IN ({','.join('?' * len(names))})",
+                names,
+            ).fetchall()
+            stored = {name: (tokens, updated) for name, tokens, updated in rows}
+            levels = []
+            wait = 0.0
+            for name, rate, burst in buckets:
+                state = stored.get(name)
+                tokens = burst if state is None else _refill(state[0], state[1], rate, burst, now)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                levels.append(tokens)
+            if wait:
+                return wait
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                [(name, tokens - 1, now, _full_at(tokens - 1, rate, burst, now))
+                 for (name, rate, burst), tokens in zip(buckets, levels)],
+            )
+            return 0.0
+
+BUCKET_STORES = {
+    "memory": MemoryBucketStore,
+    "sqlite": SQLiteBucketStore,
+}
+
+class RateLimiter:
+    """Per-IP and per-key token bucket limits"""
+
+    def __init__(self, store: BucketStore, ip_rate: float = 5.0, ip_burst: float = 20.0,
+                 key_rate: float = 1.0, key_burst: float = 10.0):
+        self.store = store
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+
+    def check(self, client_ip: Optional[str], keys: Iterable[str] = ()) -> float:
+        """
+        Charge one request from `client_ip` naming `keys`
+
+        Returns:
+            0.0 if the request may proceed, otherwise the seconds the
+            client should wait before retrying
+        """
+        buckets: List[Bucket] = []
+        if client_ip:
+            buckets.append((f"ip:{client_ip}", self.ip_rate, self.ip_burst))
+        for key in dict.fromkeys(keys):
+            buckets.append((f"key:{key}", self.key_rate, self.key_burst))
+        if not buckets:
+            return 0.0
+        try:
+            return self.store.take(buckets, time.time())
+        except sqlite3.Error as e:
+            # Fail open: a broken limiter must not take the API down with it
+            print(f"Error checking rate limit: {e}")
+            return 0.0
+
+def retry_after_header(wait: float) -> str:
+    """Retry-After value (whole seconds, at least 1) for a wait in seconds"""
+    return str(max(1, math.ceil(wait)))
+
+def client_address(remote_addr: Optional[str], forwarded_for: Optional[str] = None,
+                   proxy_hops: int = 0) -> Optional[str]:
+    """
+    The client IP to limit on
+
+    X-Forwarded-For is only honoured behind `proxy_hops` trusted reverse
+    proxies (RATE_LIMIT_TRUST_PROXY); otherwise any client could pick its
+    own IP. Each proxy appends the address it was reached from, so the
+    client is the `proxy_hops`-th entry from the right; anything left of it
+    was sent by the client and is ignored.
+    """
+    if proxy_hops > 0 and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(",") if address.strip()]
+        if addresses:
+            return addresses[-min(proxy_hops, len(addresses))]
+    return remote_addr
+
+def create_rate_limiter(backend: Optional[str] = None, path: Optional[str] = None) -> Optional[RateLimiter]:
+    """
+    Build the rate limiter described by the environment
+
+    RATE_LIMIT_BACKEND is "memory", "sqlite" (default) or "off". The sqlite
+    file is RATE_LIMIT_PATH, or one per gunicorn server; outside gunicorn
+    without RATE_LIMIT_PATH there is no one to share with, so buckets stay
+    in memory. Limits come from RATE_LIMIT_IP_RATE / RATE_LIMIT_IP_BURST and
+    RATE_LIMIT_KEY_RATE / RATE_LIMIT_KEY_BURST (tokens per second / bucket
+    size).
+
+    Returns:
+        None when rate limiting is disabled
+    """
+    backend = backend or os.environ.get("RATE_LIMIT_BACKEND", "sqlite")
+    if backend == "off":
+        return None
+    if backend not in BUCKET_STORES:
+        raise ValueError(f"Unknown rate limit backend {backend!r} (expected one of {', '.join(BUCKET_STORES)}, off)")
+    if backend == "sqlite":
+        path = path or os.environ.get("RATE_LIMIT_PATH") or server_path("keyapi_rate_limit.", ".db")
+    store = SQLiteBucketStore(path) if backend == "sqlite" and path else MemoryBucketStore()
+    return RateLimiter(
+        store,
+        ip_rate=float(os.environ.get("RATE_LIMIT_IP_RATE", "5")),
+        ip_burst=float(os.environ.get("RATE_LIMIT_IP_BURST", "20")),
+        key_rate=float(os.environ.get("RATE_LIMIT_KEY_RATE", "1")),
+        key_burst=float(os.environ.get("RATE_LIMIT_KEY_BURST", "10")),
+    )
@@ -0,0 +1,166 @@
+"""
+Short-lived cache of /validate-key and /key-info responses
+
+The page calls /validate-key on a debounce timer while the user types and
+then again around /get-code, so the same key is looked up over and over.
+ResponseCache keeps each answer for `ttl` seconds (RESPONSE_CACHE_TTL,
+default 2), keyed by endpoint and key, together with the store's
+data_version(key) at the time it was computed. A cached answer is served
+only while that version is unchanged, so:
+- a redemption or admin change in any process invalidates it: the JSON and
+  SQLite backends version the whole store by its files, the snapshot
+  backend by its file and the key's shared counter slot
+- the SQLAlchemy backend has no cheap version, so its answers are not
+  cached (ETags and 304s still work)
+- a redemption through this process drops the key's answers at once
+  (invalidate()), including any lookup still in flight for that key
+
+Every answer carries an ETag derived from its JSON body. A request whose
+If-None-Match names it gets 304 Not Modified, straight from the cache when
+the answer is cached. Storage errors are never cached.
+
+At most RESPONSE_CACHE_KEYS keys (default 10000) are kept, least recently
+used first out.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from key_store import get_key_store
+from metrics import Counter
+
+RESPONSE_CACHE_LOOKUPS = Counter("keyapi_response_cache_lookups_total",
+                                 "Response cache lookups by result (hit, miss)", ("result",))
+_hits = RESPONSE_CACHE_LOOKUPS.labels(result="hit")
+_misses = RESPONSE_CACHE_LOOKUPS.labels(result="miss")
+
+# Outcome of a lookup that must not be cached (see api._lookup_outcome)
+UNCACHEABLE_OUTCOME = "storage_error"
+
+def etag_for(payload: Dict[str, Any]) -> str:
+    """Strong ETag of a JSON payload, the same in every worker and serving mode"""
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names `etag` (weak comparison, as RFC 7232 asks)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+class CachedResponse:
+    __slots__ = ("payload", "status", "outcome", "etag", "version", "expires")
+
+    def __init__(self, payload: Dict[str, Any], status: int, outcome: str, version=None, expires: float = 0.0):
+        self.payload = payload
+        self.status = status
+        # Metrics outcome, counted again on every hit
+        self.outcome = outcome
+        self.etag = etag_for(payload)
+        self.version = version
+        self.expires = expires
+
+class _Slot:
+    """Cached answers for one key, and when it was last invalidated"""
+
+    __slots__ = ("responses", "invalidated")
+
+    def __init__(self):
+        self.responses: Dict[str, CachedResponse] = {}
+        self.invalidated = 0
+
+class ResponseCache:
+    """Answers to read-only key lookups, per endpoint and key"""
+
+    def __init__(self, ttl: float = 2.0, max_keys: int = 10000, version: Optional[Callable[[str], Any]] = None):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # Returns the store's current data_version(key); None disables caching
+        self.version = version or (lambda key: get_key_store().data_version(key))
+        self._slots: "OrderedDict[str, _Slot]" = OrderedDict()
+        # Orders lookups against invalidations
+        self._tickets = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def fetch(self, endpoint: str, key: str,
+              compute: Callable[[], Tuple[Dict[str, Any], int, str, Optional[float]]]) -> CachedResponse:
+        """
+        The cached answer for (endpoint, key), or compute() it and cache it
+
+        compute() runs without the cache lock held and returns (payload,
+        status, metrics outcome, seconds until the answer changes by itself,
+        e.g. the key expiring, or None).
+        """
+        version = self.version(key)
+        if version is None:
+            # No way to tell a stale answer from a fresh one
+            _misses.inc()
+            payload, status, outcome, _ = compute()
+            return CachedResponse(payload, status, outcome)
+        now = time.monotonic()
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is not None:
+                response = slot.responses.get(endpoint)
+                if response is not None and response.version == version and now < response.expires:
+                    self._slots.move_to_end(key)
+                    _hits.inc()
+                    return response
+            ticket = next(self._tickets)
+        _misses.inc()
+        payload, status, outcome, changes_in = compute()
+        ttl = self.ttl if changes_in is None else min(self.ttl, changes_in)
+        response = CachedResponse(payload, status, outcome, version, now + ttl)
+        if outcome == UNCACHEABLE_OUTCOME or ttl <= 0:
+            return response
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _Slot()
+                if len(self._slots) > self.max_keys:
+                    self._slots.popitem(last=False)
+            elif slot.invalidated > ticket:
+                # Redeemed while this lookup ran: its answer may predate that
+                return response
+            slot.responses[endpoint] = response
+            self._slots.move_to_end(key)
+        return response
+
+    def invalidate(self, keys):
+        """Drop every cached answer for these keys, e.g. after redeeming them"""
+        with self._lock:
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._slots[key] = _Slot()
+                    if len(self._slots) > self.max_keys:
+                        self._slots.popitem(last=False)
+                slot.responses.clear()
+                slot.invalidated = next(self._tickets)
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(slot.responses) for slot in self._slots.values())
+
+def response_cache_from_env() -> Optional[ResponseCache]:
+    """
+    Build the response cache described by the environment
+
+    Returns None (every lookup reads the store) if RESPONSE_CACHE_TTL is 0.
+    """
+    ttl = float(os.environ.get("RESPONSE_CACHE_TTL", "2"))
+    if ttl <= 0:
+        return None
+    return ResponseCache(ttl, int(os.environ.get("RESPONSE_CACHE_KEYS", "10000")))
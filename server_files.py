@@ -0,0 +1,68 @@
+"""
+Files shared by the worker processes of one server
+
+Metrics (metrics.py) and rate limit buckets (rate_limit.py) are shared by
+the workers of a server through files in /dev/shm. Their default names
+carry the pid of the gunicorn master, so two servers on one host, or two
+runs of the same server, never share state by accident. A process that is
+not a gunicorn worker (python app.py, a single uvicorn process, the
+command-line tools) has no such server; callers then keep the state to
+the process unless a path is configured.
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+def master_pid() -> Optional[int]:
+    """The pid of the gunicorn master this process is a worker of, or None"""
+    # The arbiter sets SERVER_SOFTWARE before forking any worker; workers
+    # of gunicorn's uvicorn worker class inherit it too
+    if not os.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn/"):
+        return None
+    return os.getppid()
+
+def server_path(prefix: str, suffix: str = "") -> Optional[str]:
+    """
+    SHARED_DIR/<prefix><master pid><suffix> for this server, None without a master
+
+    Files or directories left under `prefix` by servers that are no longer
+    running are removed first.
+    """
+    pid = master_pid()
+    if pid is None:
+        return None
+    remove_dead_servers(prefix)
+    return os.path.join(SHARED_DIR, f"{prefix}{pid}{suffix}")
+
+def remove_dead_servers(prefix: str):
+    """Delete SHARED_DIR entries named <prefix><pid>... whose server has exited"""
+    try:
+        names = os.listdir(SHARED_DIR)
+    except OSError:
+        return
+    current = master_pid()
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        # keyapi_metrics.<pid>, keyapi_rate_limit.<pid>.db, ....db-wal
+        pid = name[len(prefix):].split(".", 1)[0]
+        if not pid.isdigit() or int(pid) == current:
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            path = os.path.join(SHARED_DIR, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        except OSError:
+            # Alive, owned by someone else
+            pass
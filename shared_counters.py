@@ -0,0 +1,172 @@
+"""
+Usage counters shared by every worker on a host
+
+A counters file sits next to a binary snapshot (<path>.counters) and holds
+one 16-byte slot per snapshot row: usage_count and last_used (encoded as in
+key_table, 0 = as in the snapshot). Every worker maps it MAP_SHARED, so a
+redemption in one worker is visible to all the others at once, with no file
+rewrite, no journal append and no database round trip.
+
+A check-and-increment locks only its own slot with an fcntl byte-range lock
+(lockf), so redemptions of different keys never wait on each other across
+processes. fcntl locks are per process, so a module-wide thread lock
+serializes the (microsecond-long) slot updates between threads.
+
+The header carries the hash seed of the snapshot the slots belong to.
+snapshot.dump() draws a fresh seed for every snapshot, so counters can never
+be applied to the wrong one. Before a snapshot is rewritten, retire() marks
+the file retired and waits for in-flight increments; workers that then find
+it retired fall back to the store lock and pick up the new snapshot and its
+counters file.
+
+Like the usage journal, slots reach disk through the kernel's writeback of
+the mapping: they survive any worker crash, not a host crash.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import Optional
+
+from key_table import OVERFLOW, KeyRecord, KeyTable, decode_timestamp
+
+MAGIC = b"KCNT"
+VERSION = 1
+# magic, version, state, rows, snapshot seed
+HEADER = struct.Struct("<4sHHQ16s")
+STATE_OFFSET = 6
+ACTIVE, RETIRED = 0, 1
+# usage_count, encoded last_used
+SLOT = struct.Struct("<qq")
+
+# fcntl locks belong to the process, so threads need their own exclusion.
+# Held while any fd of a counters file is opened or closed as well: closing
+# a file drops every lock this process holds on it.
+_thread_lock = threading.Lock()
+
+class SharedCounters:
+    """Memory-mapped usage slots for the rows of one snapshot"""
+
+    def __init__(self, f, mapping: mmap.mmap, seed: bytes, rows: int):
+        self._file = f
+        self.fd = f.fileno()
+        self.mapping = mapping
+        self.seed = seed
+        self.rows = rows
+        self.slots = memoryview(mapping)[HEADER.size:HEADER.size + rows * SLOT.size].cast("q")
+
+    @classmethod
+    def open(cls, path: str, table: KeyTable) -> Optional["SharedCounters"]:
+        """Map the counters file for `table`; None if missing or written for another snapshot"""
+        with _thread_lock:
+            try:
+                f = open(path, "r+b")
+            except FileNotFoundError:
+                return None
+            try:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    f.close()
+                    return None
+                magic, version, _, rows, seed = HEADER.unpack(header)
+                size = os.fstat(f.fileno()).st_size
+                if (magic != MAGIC or version != VERSION or seed != table.seed or rows != len(table)
+                        or size < HEADER.size + rows * SLOT.size):
+                    f.close()
+                    return None
+                mapping = mmap.mmap(f.fileno(), size, mmap.MAP_SHARED)
+            except Exception:
+                f.close()
+                raise
+        return cls(f, mapping, seed, rows)
+
+    @classmethod
+    def create(cls, path: str, table: KeyTable) -> "SharedCounters":
+        """Write a counters file seeded from `table` and map it (caller holds the store lock)"""
+        rows = len(table)
+        slots = array("q", bytes(rows * SLOT.size))
+        slots[0::2] = array("q", table.usage_count)
+        slots[1::2] = array("q", table.last_used)
+        for row in range(rows):
+            if table.secret_ids[row] == OVERFLOW:
+                usage_count = table.overflow[table._key(row)].get("usage_count", 0)
+                slots[2 * row] = int(usage_count) if isinstance(usage_count, (int, float)) else 0
+                # 0 keeps whatever last_used the verbatim record has
+                slots[2 * row + 1] = 0
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, ACTIVE, rows, table.seed))
+            f.write(slots.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        counters = cls.open(path, table)
+        if counters is None:
+            raise OSError(f"{path} was replaced while it was being created")
+        return counters
+
+    @property
+    def retired(self) -> bool:
+        return self.mapping[STATE_OFFSET] == RETIRED
+
+    def lock(self, row: int) -> bool:
+        """
+        Lock one slot for a check-and-increment
+
+        Returns False, holding nothing, if the file has been retired.
+        Otherwise the caller must unlock(row).
+        """
+        _thread_lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, SLOT.size, HEADER.size + row * SLOT.size)
+        except Exception:
+            _thread_lock.release()
+            raise
+        if self.mapping[STATE_OFFSET] == RETIRED:
+            self.unlock(row)
+            return False
+        return True
+
+    def unlock(self, row: int):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, SLOT.size, HEADER.size + row * SLOT.size)
+        finally:
+            _thread_lock.release()
+
+    def get(self, row: int):
+        """(usage_count, encoded last_used) of a slot"""
+        return self.slots[2 * row], self.slots[2 * row + 1]
+
+    def set(self, row: int, usage_count: int, last_used: int):
+        """Overwrite a slot; only while holding lock(row)"""
+        self.slots[2 * row] = usage_count
+        self.slots[2 * row + 1] = last_used
+
+    def overlay(self, row: int, record: KeyRecord) -> KeyRecord:
+        """Apply a slot's current values to the snapshot record of its row"""
+        usage_count, last_used = self.slots[2 * row], self.slots[2 * row + 1]
+        if record.get("usage_count", 0) != usage_count:
+            record["usage_count"] = usage_count
+        if last_used:
+            record["last_used"] = decode_timestamp(last_used)
+        return record
+
+    def retire(self):
+        """
+        Stop all further updates and wait for in-flight ones
+
+        Called under the store lock before the snapshot is rewritten, so the
+        slot values read afterwards are final.
+        """
+        with _thread_lock:
+            self.mapping[STATE_OFFSET] = RETIRED
+            # Granted only once no other process holds any slot lock
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 0, 0)
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 0, 0)
+
+    def reactivate(self):
+        """Undo retire() after a snapshot rewrite failed"""
+        self.mapping[STATE_OFFSET] = ACTIVE
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Binary key snapshot format
+
+A .snap file is a KeyTable (see key_table.py) written out column by column,
+with its hash index, so a worker can open it with mmap and answer lookups
+straight from the mapping: one hash probe, no parse. Opening a store of any
+size costs a header read plus the secrets list; pages are faulted in as keys
+are touched and shared between all workers through the page cache.
+
+Layout (native little-endian, every section 8-byte aligned):
+
+    header     magic "KSNP", version, row count, index slots, hash seed,
+               then (offset, length) for each section below
+    index      uint32 per slot: row + 1, 0 = empty (linear probing)
+    key_offsets, secret_ids, max_uses, usage_count, created_at, last_used
+               one packed column each (key_offsets has rows + 1 entries)
+    keys       UTF-8 key bytes, located by key_offsets
+    secrets    JSON list of distinct secrets
+    overflow   JSON object of records kept verbatim
+
+The mapping is copy-on-write: journal replay updates usage columns in
+place without touching the file, exactly like an in-memory KeyTable. Live
+usage counts are kept beside the snapshot (see shared_counters.py).
+
+Usage:
+    python snapshot.py to-binary keys.json keys.snap
+    python snapshot.py to-json keys.snap keys.json
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, List, Tuple
+
+from key_table import COLUMNS, KeyRecord, KeyTable
+
+MAGIC = b"KSNP"
+VERSION = 1
+SECTIONS = ("index", "key_offsets") + tuple(name for name, _ in COLUMNS) + ("keys", "secrets", "overflow")
+# magic, version, byte order (1 = little), rows, index slots, seed, then (offset, length) per section
+HEADER = struct.Struct("<4sHHQQ16s" + "QQ" * len(SECTIONS))
+TYPECODES = dict(COLUMNS, index="I", key_offsets="I")
+
+if sys.byteorder != "little":
+    raise ImportError("the binary snapshot format is little-endian only")
+
+class SnapshotError(ValueError):
+    """A file that is not a readable key snapshot"""
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+def dump(records: Dict[str, KeyRecord]) -> bytes:
+    """Serialize keys.json-style records to the binary snapshot format"""
+    table = KeyTable(records, seed=os.urandom(16))
+    payloads = {name: getattr(table, name).tobytes() for name in ("index", "key_offsets")}
+    for name, _ in COLUMNS:
+        payloads[name] = getattr(table, name).tobytes()
+    payloads["keys"] = bytes(table.key_blob)
+    payloads["secrets"] = json.dumps(table.secrets).encode("utf-8")
+    payloads["overflow"] = json.dumps(table.overflow).encode("utf-8")
+
+    positions: List[int] = []
+    offset = _align(HEADER.size)
+    for name in SECTIONS:
+        positions += [offset, len(payloads[name])]
+        offset = _align(offset + len(payloads[name]))
+    out = bytearray(offset)
+    HEADER.pack_into(out, 0, MAGIC, VERSION, 1, len(table), len(table.index), table.seed, *positions)
+    for i, name in enumerate(SECTIONS):
+        start, length = positions[2 * i], positions[2 * i + 1]
+        out[start:start + length] = payloads[name]
+    return bytes(out)
+
+def load(path: str) -> KeyTable:
+    """Open a snapshot as a KeyTable backed by a private mapping of the file"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise SnapshotError(f"{path} is too short to be a key snapshot")
+        mapping = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY)
+    fields = HEADER.unpack_from(mapping, 0)
+    magic, version, byte_order, rows, slots, seed = fields[:6]
+    if magic != MAGIC or version != VERSION or byte_order != 1:
+        raise SnapshotError(f"{path} is not a version {VERSION} key snapshot")
+    sections: Dict[str, Tuple[int, int]] = {
+        name: (fields[6 + 2 * i], fields[7 + 2 * i]) for i, name in enumerate(SECTIONS)
+    }
+    if any(start + length > size for start, length in sections.values()):
+        raise SnapshotError(f"{path} is truncated")
+
+    view = memoryview(mapping)
+    def section(name):
+        start, length = sections[name]
+        return view[start:start + length]
+
+    table = KeyTable.__new__(KeyTable)
+    table.seed = seed
+    table._set_hash()
+    for name, typecode in TYPECODES.items():
+        setattr(table, name, section(name).cast(typecode))
+    if len(table.index) != slots or len(table.secret_ids) != rows or len(table.key_offsets) != rows + 1:
+        raise SnapshotError(f"{path} has inconsistent section sizes")
+    table.key_blob = section("keys")
+    table.secrets = json.loads(bytes(section("secrets")))
+    table._secret_ids = {}
+    table.dirty = None
+    table.overflow = json.loads(bytes(section("overflow")))
+    # Keeps the mapping open for as long as the table is referenced
+    table.mapping = mapping
+    return table
+
+def is_snapshot(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def main(argv=None):
+    from key_store import SnapshotKeyStore, _write_atomic
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    to_binary = commands.add_parser("to-binary", help="convert keys.json to a binary snapshot")
+    to_binary.add_argument("source")
+    to_binary.add_argument("target")
+    to_json = commands.add_parser("to-json", help="convert a binary snapshot to keys.json")
+    to_json.add_argument("source")
+    to_json.add_argument("target")
+    args = parser.parse_args(argv)
+
+    if args.command == "to-binary":
+        with open(args.source) as f:
+            records = json.load(f)
+        _write_atomic(args.target, dump(records))
+    else:
+        # Through the store, so usage still in the counters file is included
+        records = SnapshotKeyStore(args.source).all()
+        _write_atomic(args.target, json.dumps(records, indent=2).encode("utf-8"))
+    print(f"✅ Wrote {len(records)} keys to {args.target}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
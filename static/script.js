@@ -2,6 +2,10 @@
 let isLoading = false;
 let validationTimeout = null;
 
+// Last /validate-key answer per key, revalidated with If-None-Match
+const validationCache = new Map();
+const VALIDATION_CACHE_SIZE = 20;
+
 // DOM elements
 const keyInput = document.getElementById('keyInput');
 const fetchButton = document.getElementById('fetchButton');
@@ -114,13 +118,21 @@ function handleGlobalKeydown(event) {
  */
 async function validateKey(key) {
     try {
+        const cached = validationCache.get(key);
+        const headers = { 'Content-Type': 'application/json' };
+        if (cached) {
+            headers['If-None-Match'] = cached.etag;
+        }
+        
         const response = await fetch('/validate-key', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers,
             body: JSON.stringify({ key })
         });
         
-        const data = await response.json();
+        // 304: the answer we already have is still current
+        const data = response.status === 304 ? cached.data : await response.json();
+        rememberValidation(key, response.headers.get('ETag'), data);
         
         // Update input styling based on validation
         if (data.valid) {
@@ -139,6 +151,20 @@ async function validateKey(key) {
     }
 }
 
+/**
+ * Keep a key's validation answer for conditional revalidation
+ */
+function rememberValidation(key, etag, data) {
+    validationCache.delete(key);
+    if (!etag) {
+        return;
+    }
+    validationCache.set(key, { etag, data });
+    if (validationCache.size > VALIDATION_CACHE_SIZE) {
+        validationCache.delete(validationCache.keys().next().value);
+    }
+}
+
 /**
  * Main function to fetch Netflix code
  */
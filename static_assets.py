@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Fingerprinted, precompressed static assets
+
+The build step copies every file in static/ to static/dist/ under a
+content-hashed name (style.css -> style.3f2a9c1d7e0b.css) and writes a
+manifest.json mapping one to the other. Along the way it:
+- re-encodes JPEG images (background.jpg) as progressive JPEGs at most
+  IMAGE_MAX_WIDTH pixels wide, if Pillow is installed
+- points url(/static/...) references in CSS at the hashed names
+- writes .gz and, if the brotli package is installed, .br variants of text
+  assets, kept only when smaller than the original
+
+The page links to the hashed names with the asset_url() template helper.
+They are served from /assets/ with a one-year immutable Cache-Control, so
+browsers never ask for them again. Each request gets the smallest variant
+its Accept-Encoding allows, with a matching Content-Encoding and
+Vary: Accept-Encoding. Files are passed to the server as file wrappers
+(sendfile under gunicorn) and never compressed per request.
+
+Without a build, asset_url() falls back to the plain /static/ URLs.
+
+Usage (run before starting the app, and again after changing static/):
+    python static_assets.py [--image-width 1600]
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import sys
+import threading
+from typing import Dict, List, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+BUILD_DIR = "dist"
+MANIFEST = "manifest.json"
+URL_PREFIX = "/assets"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+IMAGE_MAX_WIDTH = int(os.environ.get("STATIC_IMAGE_MAX_WIDTH", "1600"))
+IMAGE_QUALITY = int(os.environ.get("STATIC_IMAGE_QUALITY", "80"))
+
+# Worth compressing; images and fonts already are
+TEXT_TYPES = (".css", ".js", ".svg", ".html", ".json", ".txt", ".map")
+JPEG_TYPES = (".jpg", ".jpeg")
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+CSS_URL = re.compile(r"""url\((['"]?)/static/([^'")]+)\1\)""")
+
+def asset_path(assets: Dict[str, str], name: str) -> str:
+    return f"{URL_PREFIX}/{assets[name]}"
+
+def _hashed_name(name: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+def optimize_jpeg(path: str, max_width: int = IMAGE_MAX_WIDTH, quality: int = IMAGE_QUALITY) -> Optional[bytes]:
+    """A progressive JPEG at most `max_width` wide, or None without Pillow"""
+    if Image is None:
+        return None
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+        if image.width > max_width:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+def _compressed(data: bytes) -> Dict[str, bytes]:
+    """Content-Encoding -> compressed bytes, for the encodings that shrink `data`"""
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+def _write(path: str, data: bytes):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def build(static_dir: str = "static", image_width: int = IMAGE_MAX_WIDTH) -> Dict[str, object]:
+    """Write the hashed assets and manifest to <static_dir>/dist; returns the manifest"""
+    out_dir = os.path.join(static_dir, BUILD_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    names = sorted(os.path.relpath(os.path.join(root, name), static_dir)
+                   for root, dirs, files in os.walk(static_dir)
+                   if not os.path.relpath(root, static_dir).split(os.sep)[0] == BUILD_DIR
+                   for name in files)
+    # CSS last, so the url() references it rewrites already have hashed names
+    names.sort(key=lambda name: name.endswith(".css"))
+    assets: Dict[str, str] = {}
+    encodings: Dict[str, List[str]] = {}
+    sizes: Dict[str, int] = {}
+    for name in names:
+        path = os.path.join(static_dir, name)
+        ext = os.path.splitext(name)[1].lower()
+        data = None
+        if ext in JPEG_TYPES:
+            data = optimize_jpeg(path, image_width)
+            if data is None:
+                print(f"⚠️  Pillow is not installed; copying {name} unoptimized")
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        if ext == ".css":
+            data = CSS_URL.sub(lambda m: f"url({m.group(1)}{asset_path(assets, m.group(2))}{m.group(1)})"
+                               if m.group(2) in assets else m.group(0), data.decode("utf-8")).encode("utf-8")
+        hashed = _hashed_name(name, data).replace(os.sep, "/")
+        os.makedirs(os.path.dirname(os.path.join(out_dir, hashed)), exist_ok=True)
+        _write(os.path.join(out_dir, hashed), data)
+        assets[name.replace(os.sep, "/")] = hashed
+        sizes[hashed] = len(data)
+        variants = _compressed(data) if ext in TEXT_TYPES else {}
+        for encoding, suffix in ENCODINGS:
+            if encoding in variants:
+                _write(os.path.join(out_dir, hashed + suffix), variants[encoding])
+                sizes[hashed + suffix] = len(variants[encoding])
+        encodings[hashed] = [encoding for encoding, _ in ENCODINGS if encoding in variants]
+        print(f"📦 {name} -> {hashed} ({os.path.getsize(path)} -> {len(data)} bytes"
+              + "".join(f", {encoding} {sizes[hashed + suffix]}" for encoding, suffix in ENCODINGS
+                        if hashed + suffix in sizes) + ")")
+
+    # The previous build stays servable, so pages rendered just before this one still load
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    previous = _load(manifest_path)
+    servable = {hashed: previous.get("encodings", {}).get(hashed, []) for hashed in previous.get("assets", {}).values()}
+    servable.update(encodings)
+    manifest = {"assets": assets, "encodings": servable}
+    _remove_stale(out_dir, servable)
+    _write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    return manifest
+
+def _remove_stale(out_dir: str, servable: Dict[str, List[str]]):
+    """Delete the files of older builds"""
+    keep = {MANIFEST}
+    for hashed in servable:
+        keep.update({hashed, *(hashed + suffix for _, suffix in ENCODINGS)})
+    for root, dirs, files in os.walk(out_dir):
+        for name in files:
+            relative = os.path.relpath(os.path.join(root, name), out_dir).replace(os.sep, "/")
+            if relative not in keep:
+                os.remove(os.path.join(root, name))
+
+def _load(manifest_path: str) -> Dict[str, object]:
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"Error: Cannot load {manifest_path}: {e}")
+        return {}
+
+class AssetManifest:
+    """The build's manifest, reloaded when a new build replaces it"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._signature = None
+        self.assets: Dict[str, str] = {}
+        # Hashed name -> available encodings, for this build and the one before
+        self.encodings: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature:
+            return
+        with self._lock:
+            manifest = _load(self.path) if signature is not None else {}
+            self.encodings = manifest.get("encodings", {})
+            self.assets = manifest.get("assets", {})
+            self._signature = signature
+
+def _encoding_for(accept_encodings, available: List[str]) -> Optional[str]:
+    """The preferred encoding both sides have, None for the uncompressed file"""
+    best, best_quality = None, 0
+    for encoding in available:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def init_app(app):
+    """Serve <static folder>/dist at /assets and give templates asset_url()"""
+    from flask import abort, request, send_from_directory, url_for
+
+    build_dir = os.path.join(app.static_folder, BUILD_DIR)
+    manifest = AssetManifest(os.path.join(build_dir, MANIFEST))
+    manifest.refresh()
+
+    @app.template_global()
+    def asset_url(filename: str) -> str:
+        """URL of a static file: its hashed build when there is one, else /static/"""
+        manifest.refresh()
+        if filename in manifest.assets:
+            return asset_path(manifest.assets, filename)
+        return url_for("static", filename=filename)
+
+    @app.route(f"{URL_PREFIX}/<path:filename>")
+    def hashed_asset(filename):
+        manifest.refresh()
+        available = manifest.encodings.get(filename)
+        if available is None:
+            abort(404)
+        encoding = _encoding_for(request.accept_encodings, available)
+        suffix = dict(ENCODINGS)[encoding] if encoding else ""
+        response = send_from_directory(build_dir, filename + suffix, mimetype=mimetypes.guess_type(filename)[0])
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if available:
+            response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        return response
+
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--static", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"),
+                        help="static folder to build from")
+    parser.add_argument("--image-width", type=int, default=IMAGE_MAX_WIDTH, help="widest JPEG kept, in pixels")
+    args = parser.parse_args(argv)
+
+    if brotli is None:
+        print("⚠️  brotli is not installed; writing gzip variants only")
+    manifest = build(args.static, args.image_width)
+    print(f"✅ Built {len(manifest['assets'])} assets into {os.path.join(args.static, BUILD_DIR)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+"""Shared fixtures: throwaway key stores in a temporary directory"""
+
+import pytest
+
+from key_store import create_key_store, new_record
+
+SECRET = "JBSWY3DPEHPK3PXP"
+FILE_BACKENDS = {"json": "keys.json", "snapshot": "keys.snap", "sqlite": "keys.db"}
+
+def records(count, max_uses=1, prefix="KEY"):
+    return {f"{prefix}{i:04d}": new_record(SECRET, max_uses) for i in range(count)}
+
+def make_store(backend, directory, keys=None):
+    """A store of `backend` under `directory`, filled with `keys`"""
+    path = str(directory / FILE_BACKENDS[backend])
+    store = create_key_store(backend, path)
+    if keys:
+        store.bulk_add(keys)
+    return store
+
+@pytest.fixture(params=sorted(FILE_BACKENDS))
+def backend(request):
+    return request.param
@@ -0,0 +1,62 @@
+"""Request body handling shared by the Flask (app.py) and ASGI (asgi.py) front ends"""
+
+import asyncio
+import json
+
+import pytest
+
+import app as app_module
+from key_store import configure_key_store
+
+ENDPOINTS = ["/get-code", "/get-codes", "/validate-key", "/key-info"]
+NOT_OBJECTS = [[], ["KEY"], "KEY", 7, True]
+
+@pytest.fixture
+def store(tmp_path):
+    keys_file = tmp_path / "keys.json"
+    keys_file.write_text(json.dumps({}))
+    configure_key_store("json", str(keys_file))
+
+@pytest.fixture
+def client(store, monkeypatch):
+    monkeypatch.setattr(app_module, "response_cache", None)
+    monkeypatch.setattr(app_module, "rate_limiter", None)
+    return app_module.app.test_client()
+
+@pytest.mark.parametrize("endpoint", ENDPOINTS)
+@pytest.mark.parametrize("body", NOT_OBJECTS)
+def test_flask_rejects_non_object_body(client, endpoint, body):
+    response = client.post(endpoint, json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Request body must be a JSON object"}
+
+def test_flask_rate_limited_non_object_body(client, monkeypatch):
+    from rate_limit import MemoryBucketStore, RateLimiter
+
+    monkeypatch.setattr(app_module, "rate_limiter", RateLimiter(MemoryBucketStore(), ip_burst=5))
+    assert client.post("/get-code", json="KEY").status_code == 400
+
+def _asgi_post(asgi, path, body):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "headers": [], "client": ("127.0.0.1", 1)}
+    asyncio.run(asgi.app(scope, receive, send))
+    return messages[0]["status"], json.loads(messages[1]["body"])
+
+@pytest.mark.parametrize("endpoint", ENDPOINTS)
+@pytest.mark.parametrize("body", NOT_OBJECTS)
+def test_asgi_answers_like_flask(store, monkeypatch, endpoint, body):
+    pytest.importorskip("asgiref")
+    import asgi
+
+    monkeypatch.setattr(asgi, "response_cache", None)
+    monkeypatch.setattr(asgi, "rate_limiter", None)
+    status, payload = _asgi_post(asgi, endpoint, json.dumps(body).encode())
+    assert status == 400
+    assert payload == {"error": "Request body must be a JSON object"}
@@ -0,0 +1,129 @@
+import io
+import json
+
+import pytest
+
+import bulk_keys
+from bulk_keys import InvalidRow, build_record, export_keys, import_keys, normalize_secret
+from conftest import SECRET, make_store, records
+
+DEFAULTS = {"max_uses": 1, "generate_secrets": False, "created_at": "2024-01-01T00:00:00Z"}
+
+def _rows(fmt, text):
+    return list(bulk_keys.READERS[fmt](io.StringIO(text)))
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+def test_read_csv():
+    rows = _rows("csv", "key,secret,max_uses\nA,JBSWY3DPEHPK3PXP,2\nB,,\n")
+    assert [row["key"] for row in rows] == ["A", "B"]
+    assert rows[0]["max_uses"] == "2"
+
+def test_read_csv_needs_key_column():
+    with pytest.raises(SystemExit):
+        _rows("csv", "name,secret\nA,JBSWY3DPEHPK3PXP\n")
+
+def test_read_jsonl():
+    rows = _rows("jsonl", '{"key": "A", "max_uses": 2}\n\n"B"\nnot json\n[1]\n')
+    assert rows[0] == {"key": "A", "max_uses": 2}
+    assert rows[1] == {"key": "B"}
+    assert "invalid JSON" in rows[2]["__error__"]
+    assert "__error__" in rows[3]
+
+def test_read_json_object():
+    rows = _rows("json", '{"A": {"secret": "X", "max_uses": 3}, "B": 5}')
+    assert rows[0] == {"key": "A", "secret": "X", "max_uses": 3}
+    assert rows[1]["key"] == "B" and "__error__" in rows[1]
+
+def test_read_json_list_items_are_rows():
+    rows = _rows("json", '["A", {"key": "B", "secret": "X"}, 7, null]')
+    assert rows[0] == {"key": "A"}
+    assert rows[1] == {"key": "B", "secret": "X"}
+    assert "__error__" in rows[2] and "__error__" in rows[3]
+
+def test_read_json_scalar():
+    assert "__error__" in _rows("json", '"A"')[0]
+
+def test_normalize_secret():
+    assert normalize_secret("jbsw y3dp ehpk 3pxp") == SECRET
+    for secret in ("", "   ", "NOT-BASE32!", "ABCDEFG1"):
+        with pytest.raises(InvalidRow):
+            normalize_secret(secret)
+
+def test_build_record_fields():
+    key, record = build_record({"key": " A ", "secret": SECRET.lower(), "max_uses": "3",
+                                "usage_count": "2", "last_used": "2024-02-01T10:00:00+02:00"}, DEFAULTS)
+    assert key == "A"
+    assert record["secret"] == SECRET
+    assert record["max_uses"] == 3 and record["usage_count"] == 2
+    assert record["created_at"] == DEFAULTS["created_at"]
+    assert record["last_used"] == "2024-02-01T08:00:00.000000Z"
+
+def test_build_record_legacy_used_flag():
+    _, record = build_record({"key": "A", "secret": SECRET, "max_uses": 2, "used": "true"}, DEFAULTS)
+    assert record["usage_count"] == 2
+
+@pytest.mark.parametrize("row", [
+    {"secret": SECRET},
+    {"key": "A"},
+    {"key": "A", "secret": SECRET, "max_uses": 0},
+    {"key": "A", "secret": SECRET, "max_uses": "many"},
+    {"key": "A", "secret": SECRET, "usage_count": -1},
+    {"key": "A", "secret": SECRET, "max_uses": 2, "usage_count": 3},
+    {"key": "A", "secret": SECRET, "created_at": "yesterday"},
+    {"key": "A", "secret": SECRET, "ttl_after_first_use": 0},
+])
+def test_build_record_rejects(row):
+    with pytest.raises(InvalidRow):
+        build_record(row, DEFAULTS)
+
+def test_build_record_unlimited_allows_any_usage():
+    _, record = build_record({"key": "A", "secret": SECRET, "max_uses": -1, "usage_count": 50}, DEFAULTS)
+    assert record["usage_count"] == 50
+
+def test_import_skips_existing_and_invalid(backend, tmp_path):
+    store = make_store(backend, tmp_path, records(2))
+    path = _write(tmp_path, "in.jsonl", "\n".join([
+        json.dumps({"key": "KEY0000", "secret": SECRET, "max_uses": 5}),
+        json.dumps({"key": "NEW1", "secret": SECRET}),
+        json.dumps({"key": "NEW1", "secret": SECRET, "max_uses": 9}),
+        json.dumps({"key": "BAD", "secret": "???"}),
+        json.dumps({"key": "NEW2"}),
+    ]))
+    stats = import_keys(path, store, generate_secrets=False)
+    assert stats == {"read": 5, "added": 1, "existing": 2, "invalid": 2}
+    assert store.get("KEY0000")["max_uses"] == 1
+    assert store.get("NEW1")["max_uses"] == 1
+    assert store.get("BAD") is None and store.get("NEW2") is None
+
+def test_import_commits_in_chunks(tmp_path, monkeypatch):
+    store = make_store("sqlite", tmp_path)
+    commits = []
+    bulk_add = store.bulk_add
+    monkeypatch.setattr(store, "bulk_add", lambda chunk: commits.append(len(chunk)) or bulk_add(chunk))
+    path = _write(tmp_path, "in.csv", "key\n" + "\n".join(f"K{i}" for i in range(7)) + "\n")
+
+    stats = import_keys(path, store, chunk_size=3, generate_secrets=True)
+    assert commits == [3, 3, 1]
+    assert stats["added"] == 7 and store.count() == 7
+
+    commits.clear()
+    import_keys(path, store, chunk_size=0, generate_secrets=True)
+    assert commits == [7]
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl"])
+def test_export_round_trip(backend, fmt, tmp_path):
+    source = make_store(backend, tmp_path, records(4, max_uses=3))
+    source.redeem_many(["KEY0001", "KEY0001", "KEY0002"])
+    path = str(tmp_path / f"out.{fmt}")
+    assert export_keys(path, source) == 4
+
+    target_dir = tmp_path / "restored"
+    target_dir.mkdir()
+    target = make_store(backend, target_dir)
+    stats = import_keys(path, target)
+    assert stats == {"read": 4, "added": 4, "existing": 0, "invalid": 0}
+    assert target.all() == source.all()
@@ -0,0 +1,72 @@
+"""Email codes handed out once across the watcher and the search fallback, against the stand-in IMAP server"""
+
+import time
+
+import pytest
+
+import email_reader
+import email_watcher
+from benchmarks.imap_server import StandInIMAPServer, sample_mailboxes, verification_email
+
+FOLDERS = ["inbox", "Spam"]
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(email_reader, "handed_out", email_reader.HandedOut())
+    server = StandInIMAPServer(("127.0.0.1", 0), sample_mailboxes(FOLDERS))
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    email_reader.close_pools()
+
+@pytest.fixture
+def account(server):
+    return {"label": "Local", "IMAP_SERVER": "127.0.0.1", "IMAP_PORT": server.server_address[1],
+            "IMAP_SSL": False, "EMAIL_ACCOUNT": "me", "EMAIL_PASSWORD": "x", "FOLDERS": FOLDERS}
+
+@pytest.fixture
+def watcher(account):
+    watcher = email_watcher.EmailWatcher([account])
+    watcher.start()
+    deadline = time.monotonic() + 5
+    while not (watcher.connected() and len(watcher.inbox)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(watcher.inbox) == 1
+    yield watcher
+    watcher.stop(timeout=5)
+
+def _unseen(server, folder="inbox"):
+    box = server.mailbox(folder)
+    return [number for number, flags in enumerate(box.flags, start=1) if "\\Seen" not in flags]
+
+def test_search_alone_returns_code_once(server, account):
+    assert email_reader.get_latest_chatgpt_code([account]) == "123456"
+    assert _unseen(server) == [1]  # only the newsletter
+    assert email_reader.get_latest_chatgpt_code([account]) is None
+
+def test_search_skips_code_the_watcher_handed_out(server, account, watcher, monkeypatch):
+    # The watcher's \Seen flag has not reached the server yet
+    monkeypatch.setattr(email_watcher, "mark_seen", lambda entry: None)
+    assert email_reader.get_latest_chatgpt_code() == "123456"
+    assert _unseen(server) == [1, 2]
+
+    assert email_reader.get_latest_chatgpt_code([account]) is None
+
+def test_watcher_skips_code_a_search_returned(server, account, watcher):
+    assert email_reader.get_latest_chatgpt_code([account]) == "123456"
+    assert watcher.take_code() is None
+
+def test_new_codes_still_flow(server, account, watcher):
+    assert watcher.take_code() == "123456"
+    server.deliver("inbox", verification_email("654321"))
+    assert email_reader.get_latest_chatgpt_code([account]) == "654321"
+    assert 3 not in _unseen(server)
+
+def test_handed_out_expires():
+    handed_out = email_reader.HandedOut(ttl=10)
+    assert handed_out.claim(("Local", "inbox", 1), now=100)
+    assert not handed_out.claim(("Local", "inbox", 1), now=105)
+    handed_out.release(("Local", "inbox", 1))
+    assert handed_out.claim(("Local", "inbox", 1), now=106)
+    assert handed_out.claim(("Local", "inbox", 1), now=117)
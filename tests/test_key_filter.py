@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from conftest import SECRET, make_store, records
+from key_filter import BloomFilter, KeyFilter
+
+def test_bloom_has_no_false_negatives_and_bounded_false_positives():
+    bloom = BloomFilter(20000, error_rate=0.01)
+    keys = [f"member-{i}" for i in range(20000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+    false_positives = sum(f"stranger-{i}" in bloom for i in range(50000))
+    assert false_positives / 50000 < 0.02
+    assert bloom.estimated_error_rate() < 0.02
+
+def test_bloom_rejects_bad_error_rate():
+    with pytest.raises(ValueError):
+        BloomFilter(10, error_rate=1.0)
+
+@pytest.fixture
+def store(tmp_path):
+    return make_store("json", tmp_path, records(50))
+
+def _wait_for_rebuild(key_filter):
+    deadline = time.monotonic() + 5
+    while key_filter._rebuilding and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def test_rebuild_covers_every_key(store):
+    key_filter = KeyFilter(store, refresh_interval=60)
+    key_filter.rebuild(store.membership_version())
+    assert all(key_filter.might_contain(key) for key in store.all())
+    assert not key_filter.might_contain("NOPE")
+    assert key_filter.report()["keys"] == 50
+
+def test_add_is_seen_immediately(store):
+    key_filter = KeyFilter(store, refresh_interval=60)
+    key_filter.rebuild(store.membership_version())
+    key_filter.add(["LATE1", "LATE2"])
+    assert key_filter.might_contain("LATE1") and key_filter.might_contain("LATE2")
+
+def test_discard_triggers_rebuild_after_enough_deletes(store):
+    key_filter = KeyFilter(store, refresh_interval=60)
+    key_filter.rebuild(store.membership_version())
+    key_filter.discard("KEY0000")
+    assert key_filter._version is not None
+    for i in range(1, 6):
+        key_filter.discard(f"KEY{i:04d}")
+    # Over STALE_REBUILD_RATIO of the keys are gone: the filter is stale
+    # and passes misses until the rebuild replaces it
+    assert key_filter._version is None
+    assert key_filter.might_contain("NOPE")
+    _wait_for_rebuild(key_filter)
+    assert key_filter._deleted == 0
+    assert not key_filter.might_contain("NOPE")
+
+def test_keys_added_elsewhere_are_rejected_only_within_refresh_interval(store, tmp_path):
+    key_filter = KeyFilter(store, refresh_interval=0.2)
+    assert not key_filter.might_contain("ELSEWHERE")
+
+    # Another process adds the key; this store's filter hears nothing
+    assert make_store("json", tmp_path).add("ELSEWHERE", SECRET)
+    assert not key_filter.might_contain("ELSEWHERE")
+
+    time.sleep(0.25)
+    assert key_filter.might_contain("ELSEWHERE")
+    _wait_for_rebuild(key_filter)
+    assert key_filter.might_contain("ELSEWHERE")
+    assert not key_filter.might_contain("STILL-MISSING")
+
+def test_zero_refresh_checks_on_every_miss(store, tmp_path):
+    key_filter = KeyFilter(store, refresh_interval=0)
+    assert not key_filter.might_contain("ELSEWHERE")
+    assert make_store("json", tmp_path).add("ELSEWHERE", SECRET)
+    assert key_filter.might_contain("ELSEWHERE")
+    assert not key_filter.might_contain("STILL-MISSING")
+
+def test_store_integration(store, monkeypatch):
+    monkeypatch.setenv("KEY_FILTER_REFRESH", "60")
+    assert not store.might_contain("NEW")
+    assert store.add("NEW", SECRET)
+    assert store.might_contain("NEW")
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import key_manager
+from conftest import SECRET, records
+from key_store import configure_key_store
+
+@pytest.fixture
+def store(tmp_path):
+    keys_file = tmp_path / "keys.json"
+    keys_file.write_text(json.dumps({}))
+    store = configure_key_store("json", str(keys_file))
+    store.bulk_add(records(3))
+    return store
+
+@pytest.fixture
+def commands(monkeypatch):
+    called = []
+    monkeypatch.setattr(key_manager, "HANDLERS",
+                        {name: (lambda args, name=name: called.append((name, args)) or 0)
+                         for name in key_manager.COMMANDS})
+    return called
+
+@pytest.mark.parametrize("argv, command, keys", [
+    (["--status", "depleted"], "list", []),
+    (["KEY0001"], "list", ["KEY0001"]),
+    # Key names and option values that happen to be command names
+    (["--match", "add"], "list", []),
+    (["--status", "depleted", "--", "delete"], "list", ["delete"]),
+    (["add", "NEW"], "add", ["NEW"]),
+    (["--backend", "json", "reset", "KEY0001"], "reset", ["KEY0001"]),
+    (["--json", "info", "KEY0002"], "info", ["KEY0002"]),
+])
+def test_routing(commands, argv, command, keys):
+    assert key_manager.main(argv) == 0
+    [(name, args)] = commands
+    assert name == command
+    assert args.keys == keys
+
+def test_add_validates_secret(store, capsys):
+    with pytest.raises(SystemExit):
+        key_manager.main(["add", "NEW", "--secret", "not base32!"])
+    assert "not valid base32" in capsys.readouterr().err
+    assert store.get("NEW") is None
+
+    assert key_manager.main(["add", "NEW", "--secret", "jbsw y3dp ehpk 3pxp"]) == 0
+    assert store.get("NEW")["secret"] == SECRET
+
+def test_add_key_validates_secret(store):
+    assert not key_manager.add_key("NEW", "1234")
+    assert store.get("NEW") is None
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import random
+from collections import Counter
+
+import pytest
+
+import key_store
+from conftest import FILE_BACKENDS, make_store, records
+from shared_counters import SharedCounters
+
+def _redeem_worker(args):
+    backend, directory, keys, attempts, seed = args
+    # A fresh store per process, as every gunicorn worker opens its own
+    store = key_store.create_key_store(backend, os.path.join(directory, FILE_BACKENDS[backend]))
+    rng = random.Random(seed)
+    granted = Counter()
+    for _ in range(attempts):
+        key = rng.choice(keys)
+        record, error = store.redeem(key)
+        if error is None:
+            granted[key] += 1
+    return granted
+
+def test_concurrent_redemption_stops_at_max_uses(backend, tmp_path):
+    keys = records(8, max_uses=3)
+    make_store(backend, tmp_path, keys)
+    ctx = multiprocessing.get_context("fork")
+    jobs = [(backend, str(tmp_path), sorted(keys), 60, seed) for seed in range(6)]
+    with ctx.Pool(len(jobs)) as pool:
+        granted = sum(pool.map(_redeem_worker, jobs), Counter())
+
+    assert granted == {key: 3 for key in keys}
+    store = make_store(backend, tmp_path)
+    for key in keys:
+        assert store.get(key)["usage_count"] == 3
+        assert store.redeem(key)[1] is not None
+
+@pytest.fixture
+def json_store(tmp_path):
+    return make_store("json", tmp_path, records(5, max_uses=10))
+
+def _journal_records(store):
+    size = os.path.getsize(store.journal_path)
+    return (size - key_store.JOURNAL_HEADER.size) // key_store.JOURNAL_RECORD.size
+
+def test_redemptions_append_to_journal_and_replay(json_store, tmp_path):
+    reader = make_store("json", tmp_path)
+    assert reader.get("KEY0000")["usage_count"] == 0
+    snapshot = os.stat(json_store.path).st_mtime_ns
+
+    for _ in range(3):
+        assert json_store.redeem("KEY0000")[1] is None
+    json_store.redeem("KEY0001")
+
+    assert _journal_records(json_store) == 4
+    assert os.stat(json_store.path).st_mtime_ns == snapshot
+    # A store that already loaded the snapshot picks up the new records...
+    assert reader.get("KEY0000")["usage_count"] == 3
+    # ...and so does one starting from scratch
+    fresh = make_store("json", tmp_path)
+    assert fresh.get("KEY0000")["usage_count"] == 3
+    assert fresh.get("KEY0001")["usage_count"] == 1
+    assert fresh.get("KEY0000")["last_used"] is not None
+
+def test_compact_folds_journal_into_snapshot(json_store, tmp_path):
+    json_store.redeem_many(["KEY0000", "KEY0000", "KEY0002"])
+    assert json_store.compact()
+
+    assert os.path.getsize(json_store.journal_path) == key_store.JOURNAL_HEADER.size
+    on_disk = key_store._load_json_table(json_store.path)
+    assert on_disk["KEY0000"]["usage_count"] == 2
+    assert on_disk["KEY0002"]["usage_count"] == 1
+    assert make_store("json", tmp_path).get("KEY0000")["usage_count"] == 2
+
+def test_journal_compacts_at_threshold(json_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(key_store, "JOURNAL_COMPACT_THRESHOLD", 4)
+    reader = make_store("json", tmp_path)
+    reader.get("KEY0000")
+    for _ in range(3):
+        json_store.redeem("KEY0003")
+    assert _journal_records(json_store) == 3
+
+    json_store.redeem("KEY0003")
+    assert _journal_records(json_store) == 0
+    assert key_store._load_json_table(json_store.path)["KEY0003"]["usage_count"] == 4
+    assert reader.get("KEY0003")["usage_count"] == 4
+
+def test_journal_from_older_snapshot_is_ignored(json_store, tmp_path):
+    json_store.redeem("KEY0000")
+    journal = open(json_store.journal_path, "rb").read()
+    json_store.compact()
+    # A journal whose header names another snapshot must not be replayed
+    with open(json_store.journal_path, "wb") as f:
+        f.write(journal)
+    assert make_store("json", tmp_path).get("KEY0000")["usage_count"] == 1
+
+@pytest.fixture
+def snapshot_store(tmp_path):
+    return make_store("snapshot", tmp_path, records(5, max_uses=10))
+
+def test_snapshot_counters_shared_between_instances(snapshot_store, tmp_path):
+    other = make_store("snapshot", tmp_path)
+    assert other.get("KEY0001")["usage_count"] == 0
+    snapshot_store.redeem_many(["KEY0001", "KEY0001"])
+
+    record = other.get("KEY0001")
+    assert record["usage_count"] == 2 and record["last_used"] is not None
+    assert not os.path.exists(snapshot_store.journal_path) or \
+        os.path.getsize(snapshot_store.journal_path) == key_store.JOURNAL_HEADER.size
+
+    table = other.cache.get()
+    counters = SharedCounters.open(snapshot_store.counters_path, table)
+    assert counters is not None
+    assert counters.get(table.find("KEY0001"))[0] == 2
+
+def test_snapshot_save_folds_counters(snapshot_store, tmp_path):
+    snapshot_store.redeem("KEY0002")
+    old_table = snapshot_store.cache.get()
+    assert snapshot_store.add("KEY9999", "JBSWY3DPEHPK3PXP", max_uses=2)
+
+    fresh = make_store("snapshot", tmp_path)
+    assert fresh.get("KEY0002")["usage_count"] == 1
+    assert fresh.get("KEY9999")["usage_count"] == 0
+    new_table = fresh.cache.get()
+    counters = SharedCounters.open(fresh.counters_path, new_table)
+    assert counters.get(new_table.find("KEY0002"))[0] == 1
+    # Counters belong to one snapshot: a stale table cannot map them
+    assert SharedCounters.open(fresh.counters_path, old_table) is None
+
+def test_snapshot_reset_clears_counter(snapshot_store, tmp_path):
+    snapshot_store.redeem_many(["KEY0003"] * 3)
+    previous = snapshot_store.reset_many(["KEY0003", "MISSING"])
+    assert previous["KEY0003"]["usage_count"] == 3 and "MISSING" not in previous
+    record = make_store("snapshot", tmp_path).get("KEY0003")
+    assert record["usage_count"] == 0 and record["last_used"] is not None
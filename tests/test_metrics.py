@@ -0,0 +1,69 @@
+import multiprocessing
+import os
+
+import pytest
+
+import metrics
+import server_files
+
+WORKER_REQUESTS = metrics.Counter("test_worker_requests_total", "Requests counted by test workers", ("worker",))
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(server_files, "SHARED_DIR", str(tmp_path))
+    monkeypatch.delenv("METRICS_DIR", raising=False)
+    monkeypatch.delenv("SERVER_SOFTWARE", raising=False)
+    return tmp_path
+
+def _worker(amount):
+    # Forked from the test process, which stands in for the gunicorn master
+    metrics.share_between_workers()
+    WORKER_REQUESTS.labels(worker="any").inc(amount)
+    metrics._worker_files.flush()
+
+def _scrape(queue):
+    metrics.share_between_workers()
+    queue.put(metrics.render())
+
+def _run(target, *args):
+    process = multiprocessing.get_context("fork").Process(target=target, args=args)
+    process.start()
+    process.join()
+    return process
+
+def test_scrape_sums_over_workers_of_one_server(shared_dir, monkeypatch):
+    monkeypatch.setenv("SERVER_SOFTWARE", "gunicorn/23.0.0")
+    for amount in (1, 2, 4):
+        assert _run(_worker, amount).exitcode == 0
+    queue = multiprocessing.get_context("fork").Queue()
+    _run(_scrape, queue)
+
+    assert 'test_worker_requests_total{worker="any"} 7' in queue.get(timeout=5).splitlines()
+    assert [path.name for path in shared_dir.iterdir()] == [f"{metrics.DIR_PREFIX}{os.getpid()}"]
+
+def test_dead_server_directories_are_removed(shared_dir, monkeypatch):
+    dead = _run(int).pid
+    (shared_dir / f"{metrics.DIR_PREFIX}{dead}").mkdir()
+    (shared_dir / f"{metrics.DIR_PREFIX}{dead}" / "1-1.json").write_text("{}")
+    (shared_dir / f"{metrics.DIR_PREFIX}1").mkdir()
+    (shared_dir / f"{metrics.DIR_PREFIX}notapid").mkdir()
+    monkeypatch.setenv("SERVER_SOFTWARE", "gunicorn/23.0.0")
+
+    assert server_files.server_path(metrics.DIR_PREFIX) == str(shared_dir / f"{metrics.DIR_PREFIX}{os.getppid()}")
+    remaining = sorted(path.name for path in shared_dir.iterdir())
+    assert remaining == [f"{metrics.DIR_PREFIX}1", f"{metrics.DIR_PREFIX}notapid"]
+
+def test_no_master_keeps_metrics_per_process(shared_dir):
+    files = metrics._WorkerFiles()
+    files._setup()
+    assert files.directory is None and files.snapshots() is None
+    assert list(shared_dir.iterdir()) == []
+
+def test_configured_directory_is_used_as_is(shared_dir, monkeypatch):
+    monkeypatch.setenv("METRICS_DIR", str(shared_dir / "metrics"))
+    files = metrics._WorkerFiles()
+    files._setup()
+    files.flush()
+    assert files.directory == str(shared_dir / "metrics")
+    assert len(files.snapshots()) == 1
+    files.path = None  # stops the flush thread
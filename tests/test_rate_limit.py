@@ -0,0 +1,80 @@
+"""Rate limiting of proxied requests (app.enforce_rate_limit, rate_limit.client_address)"""
+
+import json
+
+import pytest
+
+import app as app_module
+from key_store import configure_key_store
+from rate_limit import MemoryBucketStore, RateLimiter, client_address, create_rate_limiter
+
+PROXY = "10.0.0.1"
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    keys_file = tmp_path / "keys.json"
+    keys_file.write_text(json.dumps({}))
+    configure_key_store("json", str(keys_file))
+    monkeypatch.setattr(app_module, "response_cache", None)
+    monkeypatch.setattr(app_module, "rate_limiter",
+                        RateLimiter(MemoryBucketStore(), ip_rate=0.001, ip_burst=2, key_burst=100))
+    monkeypatch.setitem(app_module.app.config, "RATE_LIMIT_TRUST_PROXY", 1)
+    return app_module.app.test_client()
+
+def validate(client, forwarded_for):
+    return client.post("/validate-key", json={"key": "UNKNOWN"}, environ_base={"REMOTE_ADDR": PROXY},
+                       headers={"X-Forwarded-For": forwarded_for}).status_code
+
+def test_clients_behind_one_proxy_are_limited_separately(client):
+    assert [validate(client, "203.0.113.1") for _ in range(3)] == [200, 200, 429]
+    assert validate(client, "203.0.113.2") == 200
+
+def test_client_cannot_pick_its_address_behind_the_proxy(client):
+    assert validate(client, "203.0.113.1") == 200
+    assert validate(client, "203.0.113.1") == 200
+    # The proxy appends the real address; the spoofed entry to its left is ignored
+    assert validate(client, "198.51.100.7, 203.0.113.1") == 429
+
+def test_client_address():
+    assert client_address(PROXY, "203.0.113.1") == PROXY
+    assert client_address(PROXY, "198.51.100.7, 203.0.113.1", proxy_hops=1) == "203.0.113.1"
+    assert client_address(PROXY, "203.0.113.1, 10.0.0.2", proxy_hops=2) == "203.0.113.1"
+    assert client_address(PROXY, "203.0.113.1", proxy_hops=2) == "203.0.113.1"
+    assert client_address(PROXY, None, proxy_hops=1) == PROXY
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    import server_files
+
+    monkeypatch.setattr(server_files, "SHARED_DIR", str(tmp_path))
+    monkeypatch.delenv("RATE_LIMIT_PATH", raising=False)
+    monkeypatch.delenv("SERVER_SOFTWARE", raising=False)
+    return tmp_path
+
+def _dead_pid():
+    import multiprocessing
+
+    process = multiprocessing.get_context("fork").Process(target=int)
+    process.start()
+    process.join()
+    return process.pid
+
+def test_sqlite_buckets_are_per_gunicorn_server(shared_dir, monkeypatch):
+    import os
+
+    stale = [shared_dir / f"keyapi_rate_limit.{_dead_pid()}.db{suffix}" for suffix in ("", "-wal", "-shm")]
+    for path in stale:
+        path.write_text("")
+    monkeypatch.setenv("SERVER_SOFTWARE", "gunicorn/23.0.0")
+
+    limiter = create_rate_limiter("sqlite")
+    assert limiter.store.path == str(shared_dir / f"keyapi_rate_limit.{os.getppid()}.db")
+    assert not any(path.exists() for path in stale)
+
+def test_sqlite_buckets_stay_in_memory_without_a_server(shared_dir):
+    assert isinstance(create_rate_limiter("sqlite").store, MemoryBucketStore)
+    assert list(shared_dir.iterdir()) == []
+
+def test_sqlite_buckets_at_configured_path(shared_dir, monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_PATH", str(shared_dir / "buckets.db"))
+    assert create_rate_limiter("sqlite").store.path == str(shared_dir / "buckets.db")
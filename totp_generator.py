@@ -1,30 +1,144 @@
-import os
-import json
+import time
+import threading
 import pyotp
-from typing import Tuple, Optional, Dict, Any
-from datetime import datetime
+from typing import Tuple, Optional, Dict, Any, List
+from key_store import _format_timestamp, expiry, get_key_store, is_expired, is_key_valid, rejection_reason
+from metrics import STAGE_LATENCY, TOTP_CACHE_LOOKUPS
+
+_totp_hits = TOTP_CACHE_LOOKUPS.labels(result="hit")
+_totp_misses = TOTP_CACHE_LOOKUPS.labels(result="miss")
+_totp_latency = STAGE_LATENCY.labels(stage="totp")
+_validate_latency = STAGE_LATENCY.labels(stage="validate")
+
+class TOTPCache:
+    """
+    Cache of TOTP codes keyed on (secret, time-step counter).
+
+    Many access keys share one TOTP secret, so a burst of redemptions against
+    a shared account computes the HMAC once per 30-second window instead of
+    once per request. Codes are dropped as soon as the window advances; the
+    pyotp.TOTP objects are kept across windows, up to max_secrets of them.
+    """
+
+    def __init__(self, interval: int = 30, max_secrets: int = 4096):
+        self.interval = interval
+        self.max_secrets = max_secrets
+        self._counter = None
+        self._codes: Dict[str, str] = {}
+        self._totps: Dict[str, pyotp.TOTP] = {}
+        self._lock = threading.Lock()
+
+    def now(self, secret: str) -> str:
+        """Return the current code for a secret"""
+        counter = int(time.time()) // self.interval
+        if counter == self._counter:
+            code = self._codes.get(secret)
+            if code is not None:
+                _totp_hits.inc()
+                return code
+        with self._lock:
+            if counter != self._counter:
+                # New time window: every cached code is stale
+                self._codes = {}
+                self._counter = counter
+            code = self._codes.get(secret)
+            if code is None:
+                _totp_misses.inc()
+                totp = self._totps.get(secret)
+                if totp is None:
+                    if len(self._totps) >= self.max_secrets:
+                        self._totps.clear()
+                    totp = self._totps[secret] = pyotp.TOTP(secret, interval=self.interval)
+                code = self._codes[secret] = totp.generate_otp(counter)
+            else:
+                _totp_hits.inc()
+            return code
+
+totp_cache = TOTPCache()
 
 def load_keys():
-    """Load keys from keys.json file"""
+    """Load every key from the configured key store as a keys.json-style dict"""
+    return get_key_store().all()
+
+def _redemption_result(key_data: Optional[Dict[str, Any]], error: Optional[str]) -> Dict[str, Any]:
+    """Turn a KeyStore redeem outcome into a redeem_key() result"""
+    result = {"code": None, "error": None, "reason": None}
     try:
-        with open('keys.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print("Error: keys.json file not found")
-        return {}
-    except json.JSONDecodeError:
-        print("Error: Invalid JSON format in keys.json")
-        return {}
-
-def save_keys(keys):
-    """Save keys to keys.json file"""
+        if key_data is not None:
+            max_uses = key_data.get("max_uses", 1)
+            usage_count = key_data.get("usage_count", 0)
+            result.update({
+                "max_uses": max_uses,
+                "usage_count": usage_count,
+                "remaining_uses": "unlimited" if max_uses == -1 else max_uses - usage_count
+            })
+        
+        if error:
+            if key_data is None:
+                result["reason"] = "invalid_key"
+            elif is_expired(key_data):
+                result["reason"] = "expired"
+            elif not is_key_valid(key_data):
+                result["reason"] = "depleted"
+            else:
+                result["reason"] = "error"
+            result["error"] = error
+            return result
+        
+        # Generate TOTP code, shared by every key on the same secret this window
+        with _totp_latency.time():
+            result["code"] = totp_cache.now(key_data["secret"])
+        
+    except Exception as e:
+        result.update({"code": None, "error": f"Error generating TOTP code: {str(e)}", "reason": "error"})
+    
+    return result
+
+def redeem_key(user_key: str) -> Dict[str, Any]:
+    """
+    Redeem a key in a single store round-trip and generate its TOTP code
+    
+    Args:
+        user_key: The access key provided by the user
+        
+    Returns:
+        Dictionary with the code (None if rejected), the error message and a
+        machine-readable reason ("invalid_key", "expired", "depleted" or
+        "error"), plus
+        max_uses, usage_count and remaining_uses as of this redemption.
+    """
     try:
-        with open('keys.json', 'w') as f:
-            json.dump(keys, f, indent=2)
-        return True
+        store = get_key_store()
+        # Unknown keys are rejected from memory, before any store access
+        if not store.might_contain(user_key):
+            return _redemption_result(None, rejection_reason(None))
+        # Check-and-increment is a single atomic store operation, shared with
+        # concurrent requests when group commit is on
+        key_data, error = (store.group_commit or store).redeem(user_key)
     except Exception as e:
-        print(f"Error saving keys: {e}")
-        return False
+        return {"code": None, "error": f"Error generating TOTP code: {str(e)}", "reason": "error"}
+    return _redemption_result(key_data, error)
+
+def redeem_keys(user_keys: List[str]) -> List[Dict[str, Any]]:
+    """
+    Redeem several keys in one store transaction
+    
+    Args:
+        user_keys: The access keys to redeem, in order
+        
+    Returns:
+        One redeem_key()-style result per key, in the same order
+    """
+    try:
+        store = get_key_store()
+        known = [store.might_contain(user_key) for user_key in user_keys]
+        redeemed = iter((store.group_commit or store).redeem_many(
+            [key for key, present in zip(user_keys, known) if present]) if any(known) else [])
+        outcomes = [next(redeemed) if present else (None, rejection_reason(None)) for present in known]
+    except Exception as e:
+        error = f"Error generating TOTP code: {str(e)}"
+        return [{"code": None, "error": error, "reason": "error"} for _ in user_keys]
+    return [_redemption_result(key_data, error) for key_data, error in outcomes]
 
 def generate_totp_code(user_key: str) -> Tuple[Optional[str], Optional[str]]:
     """
@@ -37,49 +151,12 @@ def generate_totp_code(user_key: str) -> Tuple[Optional[str], Optional[str]]:
         Tuple of (code, error_message). If successful, returns (code, None).
         If failed, returns (None, error_message).
     """
-    try:
-        keys = load_keys()
-        
-        # Check if key exists
-        if user_key not in keys:
-            return None, "Invalid key provided"
-        
-        key_data = keys[user_key]
-        max_uses = key_data.get("max_uses", 1)
-        usage_count = key_data.get("usage_count", 0)
-        
-        # Check if key has reached usage limit (unless unlimited)
-        if max_uses != -1 and usage_count >= max_uses:
-            remaining = max_uses - usage_count
-            return None, f"Key has reached its usage limit ({usage_count}/{max_uses} uses)"
-        
-        # Get the secret for TOTP generation
-        secret = key_data.get("secret")
-        if not secret:
-            return None, "No secret found for this key"
-        
-        # Generate TOTP code
-        totp = pyotp.TOTP(secret)
-        code = totp.now()
-        
-        # Increment usage count
-        keys[user_key]["usage_count"] = usage_count + 1
-        
-        # Add last_used timestamp
-        keys[user_key]["last_used"] = datetime.utcnow().isoformat() + "Z"
-        
-        # Save updated keys
-        if not save_keys(keys):
-            return None, "Failed to update key usage count"
-        
-        return code, None
-        
-    except Exception as e:
-        return None, f"Error generating TOTP code: {str(e)}"
+    result = redeem_key(user_key)
+    return result["code"], result["error"]
 
 def validate_key(user_key: str) -> bool:
     """
-    Validate if a key exists and has remaining uses
+    Validate if a key exists, has remaining uses and has not expired
     
     Args:
         user_key: The access key to validate
@@ -88,23 +165,16 @@ def validate_key(user_key: str) -> bool:
         True if key is valid and has remaining uses, False otherwise
     """
     try:
-        keys = load_keys()
+        store = get_key_store()
+        if not store.might_contain(user_key):
+            return False
+        key_data = store.get(user_key)
         
         # Check if key exists
-        if user_key not in keys:
+        if key_data is None:
             return False
         
-        key_data = keys[user_key]
-        max_uses = key_data.get("max_uses", 1)
-        usage_count = key_data.get("usage_count", 0)
-        
-        # Check if key has remaining uses
-        if max_uses == -1:  # Unlimited uses
-            return True
-        elif usage_count < max_uses:  # Has remaining uses
-            return True
-        else:  # No remaining uses
-            return False
+        return is_key_valid(key_data)
         
     except Exception as e:
         print(f"Error validating key: {e}")
@@ -121,21 +191,30 @@ def get_key_info(user_key: str) -> Dict[str, Any]:
         Dictionary with key information
     """
     try:
-        keys = load_keys()
+        store = get_key_store()
+        if not store.might_contain(user_key):
+            return {"exists": False}
+        with _validate_latency.time():
+            key_data = store.get(user_key)
         
-        if user_key not in keys:
+        if key_data is None:
             return {"exists": False}
         
-        key_data = keys[user_key]
         max_uses = key_data.get("max_uses", 1)
         usage_count = key_data.get("usage_count", 0)
+        now = time.time()
+        deadline = expiry(key_data)
         
         return {
             "exists": True,
             "max_uses": max_uses,
             "usage_count": usage_count,
             "remaining_uses": "unlimited" if max_uses == -1 else max_uses - usage_count,
-            "is_valid": validate_key(user_key),
+            "is_valid": is_key_valid(key_data, now),
+            "is_expired": is_expired(key_data, now),
+            # When the key stops working: its expires_at, or first use + TTL once started
+            "expires_at": _format_timestamp(deadline) if deadline is not None else None,
+            "ttl_after_first_use": key_data.get("ttl_after_first_use"),
             "last_used": key_data.get("last_used"),
             "created_at": key_data.get("created_at")
         }
@@ -159,21 +238,14 @@ def add_new_key(access_key: str, secret: str = None) -> bool:
         True if successful, False otherwise
     """
     try:
-        keys = load_keys()
-        
-        if access_key in keys:
-            print(f"Key {access_key} already exists")
-            return False
-        
         if not secret:
             secret = generate_random_secret()
         
-        keys[access_key] = {
-            "secret": secret,
-            "used": False
-        }
+        if not get_key_store().add(access_key, secret):
+            print(f"Key {access_key} already exists")
+            return False
         
-        return save_keys(keys)
+        return True
         
     except Exception as e:
         print(f"Error adding new key: {e}")